@@ -0,0 +1,218 @@
+"""
+This module contains the AddressTable class, a column-oriented store for geocoded address rows. X and Y are NumPy
+float64 arrays, Type is stored as small integer codes into a list of categories, and the spreadsheet columns are
+kept as plain lists of strings. The table is written to csv or to a binary .npz file in bulk, and the loaders read
+whole coordinate columns from it instead of parsing a dictionary per row.
+"""
+
+import os
+import csv
+import numpy as np
+
+# Columns that are stored as arrays rather than as lists of strings
+ARRAY_COLUMNS = ('X', 'Y', 'Type')
+
+
+class AddressTable:
+    """
+    A class to represent geocoded addresses column by column.
+    """
+
+    def __init__(self, fieldnames, columns, x, y, type_codes, type_categories):
+        """
+        Initializes the table from its columns.
+        :param fieldnames: All column names in output order, including X, Y and Type
+        :param columns: A dictionary of column name to a list of strings, for every column except X, Y and Type
+        :param x: A float64 array of X coordinates
+        :param y: A float64 array of Y coordinates
+        :param type_codes: A uint8 array of indexes into type_categories
+        :param type_categories: A list of Type values
+        :return: None
+        """
+        self.fieldnames = list(fieldnames)
+        self.columns = columns
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.type_codes = np.asarray(type_codes, dtype=np.uint8)
+        self.type_categories = list(type_categories)
+
+    def __len__(self):
+        return len(self.x)
+
+    @staticmethod
+    def read_columns(path):
+        """
+        Reads a csv file into lists of strings, one per column, without building a dictionary per row.
+        :param path: Path to the csv file
+        :return: A (fieldnames, columns) tuple
+        """
+        with open(path, newline='') as input_file:
+            csv_reader = csv.reader(input_file)
+            fieldnames = next(csv_reader, [])
+            rows = list(csv_reader)
+
+        # Short or long rows are padded or cut to the header, as csv.DictReader would read them
+        width = len(fieldnames)
+        rows = [row if len(row) == width else (row + [""] * width)[:width] for row in rows]
+        values = [list(column) for column in zip(*rows)] if rows else [[] for _ in fieldnames]
+        return fieldnames, dict(zip(fieldnames, values))
+
+    @classmethod
+    def from_columns(cls, fieldnames, columns, x, y, type_name):
+        """
+        Builds a table in which every row has the same Type.
+        :param fieldnames: The string column names, in output order
+        :param columns: A dictionary of column name to a list of strings
+        :param x: A float64 array of X coordinates
+        :param y: A float64 array of Y coordinates
+        :param type_name: The Type of every row
+        :return: An AddressTable
+        """
+        # X, Y and Type follow the spreadsheet columns, as they did in output.csv, and any key column comes last
+        sheet_fields = [name for name in fieldnames if name != 'RowKey']
+        key_fields = [name for name in fieldnames if name == 'RowKey']
+        return cls(sheet_fields + list(ARRAY_COLUMNS) + key_fields, columns, x, y,
+                   np.zeros(len(x), dtype=np.uint8), [type_name])
+
+    @classmethod
+    def read_csv(cls, path):
+        """
+        Reads a table written by write_csv.
+        :param path: Path to the csv file
+        :return: An AddressTable
+        """
+        fieldnames, columns = cls.read_columns(path)
+        x = np.array(columns.pop('X'), dtype=np.float64)
+        y = np.array(columns.pop('Y'), dtype=np.float64)
+        type_categories, type_codes = np.unique(np.array(columns.pop('Type'), dtype=str), return_inverse=True)
+        return cls(fieldnames, columns, x, y, type_codes, type_categories.tolist())
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Stacks tables one after another. A column missing from some of the tables is filled with empty strings.
+        :param tables: A non-empty list of AddressTables
+        :return: An AddressTable
+        """
+        fieldnames = list(dict.fromkeys(name for table in tables for name in table.fieldnames))
+        columns = {name: [value for table in tables for value in (table.columns.get(name) or [""] * len(table))]
+                   for name in fieldnames if name not in ARRAY_COLUMNS}
+
+        # Each table numbers its own Type categories, so the codes are mapped onto the merged list
+        type_categories = list(dict.fromkeys(category for table in tables for category in table.type_categories))
+        type_codes = [np.array([type_categories.index(category) for category in table.type_categories],
+                               dtype=np.uint8)[table.type_codes] for table in tables]
+        return cls(fieldnames, columns, np.concatenate([table.x for table in tables]),
+                   np.concatenate([table.y for table in tables]), np.concatenate(type_codes), type_categories)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a table written by save.
+        :param path: Path to the .npz file
+        :return: An AddressTable
+        """
+        with np.load(path, allow_pickle=False) as saved:
+            fieldnames = saved['fieldnames'].tolist()
+            string_fields = [name for name in fieldnames if name not in ARRAY_COLUMNS]
+            columns = {name: saved[f"column_{i}"].tolist() for i, name in enumerate(string_fields)}
+            return cls(fieldnames, columns, saved['x'], saved['y'], saved['type_codes'],
+                       saved['type_categories'].tolist())
+
+    def save(self, path):
+        """
+        Writes the table to a binary .npz file. The coordinates are stored as raw float64, so they are read back
+        exactly and without parsing. The file is written next to the path and renamed over it when complete.
+        :param path: Path of the .npz file
+        :return: None
+        """
+        string_fields = [name for name in self.fieldnames if name not in ARRAY_COLUMNS]
+        # Column names may hold characters NumPy does not allow in array names, so the arrays are numbered
+        arrays = {f"column_{i}": np.array(self.columns[name], dtype=str) for i, name in enumerate(string_fields)}
+        with open(f"{path}.part", "wb") as output_file:
+            np.savez(output_file, fieldnames=np.array(self.fieldnames, dtype=str), x=self.x, y=self.y,
+                     type_codes=self.type_codes, type_categories=np.array(self.type_categories, dtype=str), **arrays)
+        os.replace(f"{path}.part", path)
+
+    def column(self, name):
+        """
+        Gets a column as a list of Python values.
+        :param name: Column name
+        :return: A list of strings for text columns, floats for X and Y
+        """
+        if name == 'X':
+            return self.x.tolist()
+        if name == 'Y':
+            return self.y.tolist()
+        if name == 'Type':
+            return [self.type_categories[code] for code in self.type_codes.tolist()]
+        return self.columns[name]
+
+    def add_column(self, name, values):
+        """
+        Adds a text column after the existing columns.
+        :param name: Column name
+        :param values: A list of strings, one per row
+        :return: None
+        """
+        if name not in self.fieldnames:
+            self.fieldnames.append(name)
+        self.columns[name] = list(values)
+
+    def write_csv(self, path):
+        """
+        Writes the table to a csv file in one pass. The file is written next to the path and renamed over it when
+        complete, so an interrupted run never leaves a half-written csv behind.
+        :param path: Path of the csv file
+        :return: None
+        """
+        with open(f"{path}.part", "w", newline='') as output_file:
+            csv_writer = csv.writer(output_file)
+            csv_writer.writerow(self.fieldnames)
+            csv_writer.writerows(zip(*(self.column(name) for name in self.fieldnames)))
+        os.replace(f"{path}.part", path)
+
+    def take(self, indexes):
+        """
+        Builds a table of some of the rows.
+        :param indexes: An integer array of row indexes
+        :return: An AddressTable
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        positions = indexes.tolist()
+        columns = {name: [values[i] for i in positions] for name, values in self.columns.items()}
+        return AddressTable(self.fieldnames, columns, self.x[indexes], self.y[indexes], self.type_codes[indexes],
+                            self.type_categories)
+
+    def row(self, i):
+        """
+        Builds the dictionary of one row, for the code paths that still work a row at a time.
+        :param i: Row index
+        :return: A dictionary of column name to value
+        """
+        return {name: self.column_value(name, i) for name in self.fieldnames}
+
+    def column_value(self, name, i):
+        """
+        Gets one value of a column.
+        :param name: Column name
+        :param i: Row index
+        :return: The value
+        """
+        if name == 'X':
+            return float(self.x[i])
+        if name == 'Y':
+            return float(self.y[i])
+        if name == 'Type':
+            return self.type_categories[self.type_codes[i]]
+        return self.columns[name][i]
+
+    def rows(self):
+        """
+        Iterates over the rows as dictionaries.
+        :param: None
+        :return: A generator of row dictionaries
+        """
+        names = self.fieldnames
+        for values in zip(*(self.column(name) for name in names)):
+            yield dict(zip(names, values))
@@ -1,9 +1,28 @@
 import requests
 import csv
-import arcpy
 import logging
 import json
+import io
+import hashlib
+import os
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from Etl.SpatialEtl import SpatialEtl
+from Etl.GeocodeCache import GeocodeCache
+from Etl.LocalGeocoder import LocalGeocoder
+from Etl.AddressTable import AddressTable
+from Etl.HttpClient import HttpClient
+from Etl.GeometryBackend import ShapelyBackend
+from Etl.Tracing import traced, span, set_count, in_current_span
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+logger = logging.getLogger(__name__)
+
 
 class GSheetsEtl(SpatialEtl):
     """
@@ -15,109 +34,888 @@ class GSheetsEtl(SpatialEtl):
     and web geocoding service
     """
 
+    # Every address on the form is in Boulder, so the city and state are added during the transform
+    city = "Boulder"
+    state = "CO"
+
     def __init__(self, config_dict):
         self.config_dict = config_dict
+        # The sheet's own files go to source_dir when several sheets share proj_dir, the caches stay in proj_dir
+        self.work_dir = config_dict.get('source_dir') or config_dict.get('proj_dir')
+        self.http = HttpClient.from_config(config_dict)
+        self.geocode_cache = None
+        # False when the geocode cache was opened by MultiSourceEtl and is shared with other sheets
+        self.owns_geocode_cache = False
+        self.local_geocoder = None
+        self.table = None
+        self.extract_skipped = False
+        self.bytes_transferred = 0
+        self.delta = None
+        self.pending_manifest = None
+        self.pending_meta = None
+        self.loaded = False
+        self.output_fieldnames = []
+        # Addresses whose geocoding request failed, as opposed to finding no match
+        self.failed_addresses = set()
 
+    @traced("extract")
     def extract(self):
         """
-        Extracts addresses from a Google Sheets form and writes them to a CSV file.
+        Extracts addresses from a Google Sheets form and streams them to a CSV file. The ETag and
+        Last-Modified headers of the last download are kept so an unchanged sheet is not downloaded again. They
+        are only saved by save_meta once the download has been loaded.
         :param: None
         :return: None
         """
-        logging.debug("Entering extract function")
+        self.extract_skipped = False
+        self.bytes_transferred = 0
+        self.pending_meta = None
+        csv_path = f"{self.work_dir}addresses.csv"
+        meta_path = f"{self.work_dir}addresses.meta.json"
 
         try:
-            logging.debug("Extracting addresses from google form spreadsheet")
-            r = requests.get(self.config_dict.get('remote_url'))
-            r.encoding = "utf-8"
-            data = r.text
-            with open(f"{self.config_dict.get('proj_dir')}addresses.csv", "w") as output_file:
-                output_file.write(data)
+            logger.debug("Extracting addresses from google form spreadsheet")
+            headers = {'Accept-Encoding': 'gzip'}
+
+            # Only ask for the sheet if it has changed since the last download
+            if os.path.exists(csv_path) and os.path.exists(meta_path):
+                with open(meta_path) as meta_file:
+                    meta = json.load(meta_file)
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+
+            with self.http.get(self.config_dict.get('remote_url'), headers=headers, stream=True) as r:
+                if r.status_code == 304:
+                    self.extract_skipped = True
+                    logger.info("Sheet has not changed since the last run, download skipped")
+                    return
+
+                r.raise_for_status()
+                with open(f"{csv_path}.part", "wb") as output_file:
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        output_file.write(chunk)
+
+                # The old headers no longer describe addresses.csv, so a stopped run downloads the sheet again
+                if os.path.exists(meta_path):
+                    os.remove(meta_path)
+                os.replace(f"{csv_path}.part", csv_path)
+
+                # r.raw.tell() counts the bytes read off the wire, before gzip decoding
+                self.bytes_transferred = r.raw.tell()
+                set_count(self.bytes_transferred)
+                logger.info("Downloaded sheet, %s bytes transferred", self.bytes_transferred)
+
+                self.pending_meta = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
         except Exception as e:
             print(f"Error in the GSheets extract function{e}")
 
-        logging.debug("Exiting extract function")
+    def save_meta(self):
+        """
+        Writes the ETag and Last-Modified headers of the last download, once it has been transformed and loaded.
+        :param: None
+        :return: None
+        """
+        if self.pending_meta is None:
+            return
+
+        meta_path = f"{self.work_dir}addresses.meta.json"
+        with open(f"{meta_path}.part", "w") as meta_file:
+            json.dump(self.pending_meta, meta_file)
+        os.replace(f"{meta_path}.part", meta_path)
+        self.pending_meta = None
+
+    def geocode(self, address):
+        """
+        Geocodes a single address, from the local geocoder when it has a match and with the web geocoding
+        service otherwise.
+        :param address: The one line address to geocode
+        :return: An (x, y) tuple, or None if the geocoder found no match
+        """
+        if self.local_geocoder is not None:
+            coordinates = self.local_geocoder.lookup(address)
+            if coordinates is not None:
+                return coordinates
+
+        if self.geocode_cache is not None:
+            found, coordinates = self.geocode_cache.get(address, self.cache_benchmark())
+            if found:
+                return coordinates
+
+        with span("geocode"):
+            try:
+                coordinates = self.request_geocode(address)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                # A failed request is skipped, and not cached, so one flaky response does not stop the run
+                logger.warning("Geocoding failed for address %s: %s", address, e)
+                self.failed_addresses.add(address)
+                return None
+
+        if self.geocode_cache is not None:
+            self.geocode_cache.put(address, coordinates, self.cache_benchmark())
+        return coordinates
+
+    def request_geocode(self, address):
+        """
+        Sends a single address to the web geocoding service.
+        :param address: The one line address to geocode
+        :return: An (x, y) tuple, or None if the geocoder found no match
+        """
+        geocode_url = fr"{self.config_dict.get('geocoder_prefix_url')}" + address + fr"{self.config_dict.get('geocoder_suffix_url')}"
+
+        r = self.http.get(geocode_url)
+        r.raise_for_status()
+        resp_dict = r.json()
+        address_matches = resp_dict['result']['addressMatches']
+        if address_matches:
+            return address_matches[0]['coordinates']['x'], address_matches[0]['coordinates']['y']
+
+        logger.debug("No coordinates found for address: %s", address)
+        return None
+
+    def cache_benchmark(self, batch=False):
+        """
+        Names the geocoder benchmark results are cached under, so results of one benchmark are never reused for
+        another. One line results are keyed on the suffix url, batch results on geocoder_batch_benchmark. The
+        name comes from this sheet's config, as a cache shared by several sheets may serve different benchmarks.
+        :param batch: True for results of the batch geocoding service
+        :return: The benchmark part of the cache key
+        """
+        if batch:
+            return f"batch benchmark={self.config_dict.get('geocoder_batch_benchmark', '2020')}"
+        return self.config_dict.get('geocoder_suffix_url') or ""
+
+    def open_geocode_cache(self):
+        """
+        Opens the persistent geocode cache under proj_dir if the geocode_cache config key is set, and loads the
+        local geocoder if the local_geocoder config key is set. A cache or local geocoder that has already been
+        given to this object is used as it is.
+        :param: None
+        :return: None
+        """
+        if self.config_dict.get('local_geocoder') and self.local_geocoder is None:
+            try:
+                with span("load_local_geocoder"):
+                    self.local_geocoder = LocalGeocoder.from_config(self.config_dict, city=self.city,
+                                                                    state=self.state)
+            except Exception as e:
+                # Every address then goes to the web geocoder, as it did before the local index existed
+                logger.warning("Could not load the local geocoder: %s", e)
+
+        if not self.config_dict.get('geocode_cache') or self.geocode_cache is not None:
+            return
+
+        self.geocode_cache = GeocodeCache.from_config(self.config_dict)
+        self.owns_geocode_cache = True
+
+    def close_geocode_cache(self):
+        """
+        Logs the local geocoder and geocode cache hit and miss counts and closes the cache.
+        :param: None
+        :return: None
+        """
+        if self.local_geocoder is not None:
+            logger.info("Local geocoder: %s exact, %s fuzzy, %s sent to the web geocoder", self.local_geocoder.hits,
+                        self.local_geocoder.fuzzy_hits, self.local_geocoder.misses)
+
+        if self.geocode_cache is None:
+            return
+        if not self.owns_geocode_cache:
+            # The owner logs the totals of every sheet and closes the cache
+            self.geocode_cache.commit()
+            return
+
+        logger.info("Geocode cache: %s hits, %s misses", self.geocode_cache.hits, self.geocode_cache.misses)
+        self.geocode_cache.close()
+        self.geocode_cache = None
+        self.owns_geocode_cache = False
+
+    def geocode_all(self, addresses):
+        """
+        Geocodes a list of addresses, using a bounded pool of worker threads when the
+        geocoder_concurrency config key is greater than 1.
+        :param addresses: A list of one line addresses
+        :return: A list of (x, y) tuples or None, in the same order as the addresses
+        """
+        concurrency = int(self.config_dict.get('geocoder_concurrency', 1) or 1)
+
+        if concurrency <= 1:
+            return [self.geocode(address) for address in addresses]
+
+        logger.debug("Geocoding %s addresses with %s workers", len(addresses), concurrency)
+        # executor.map yields results in submission order, so the output keeps the input row order
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(in_current_span(self.geocode), addresses))
+
+    def one_line_address(self, street):
+        """
+        Builds the one line address sent to the geocoder from a street address.
+        :param street: The street address from the spreadsheet
+        :return: The one line address
+        """
+        return f"{street} {self.city} {self.state}"
+
+    def post_batch(self, chunk):
+        """
+        Uploads one chunk of addresses to the batch geocoding service and parses the returned match file.
+        :param chunk: A list of (id, street) tuples
+        :return: A dictionary of id to (x, y) tuples for the matched addresses
+        """
+        upload = io.StringIO()
+        csv_writer = csv.writer(upload)
+        for unique_id, street in chunk:
+            csv_writer.writerow([unique_id, street, self.city, self.state, ""])
+
+        logger.debug("Uploading a batch of %s addresses", len(chunk))
+        r = self.http.post(self.config_dict.get('geocoder_batch_url'),
+                           data={'benchmark': self.config_dict.get('geocoder_batch_benchmark', '2020')},
+                           files={'addressFile': ('addresses.csv', upload.getvalue(), 'text/csv')})
+        r.raise_for_status()
+
+        # Each line of the match file looks like
+        # "id","input address","Match","Exact","matched address","x,y","tiger line id","side"
+        matches = {}
+        for line in csv.reader(io.StringIO(r.text)):
+            if len(line) < 6 or line[2] != "Match":
+                continue
+            x, y = line[5].split(",")
+            matches[line[0]] = (float(x), float(y))
+        return matches
+
+    def geocode_batch(self, streets):
+        """
+        Geocodes street addresses with the batch geocoding service. The addresses are split into chunks of
+        geocoder_batch_size and the chunks are uploaded in parallel.
+        :param streets: A list of street addresses
+        :return: A list of (x, y) tuples or None, in the same order as the street addresses
+        """
+        results = [None] * len(streets)
+        pending = []
+        benchmark = self.cache_benchmark(batch=True)
+
+        for i, street in enumerate(streets):
+            if self.local_geocoder is not None:
+                results[i] = self.local_geocoder.lookup(self.one_line_address(street))
+                if results[i] is not None:
+                    continue
+            if self.geocode_cache is not None:
+                found, coordinates = self.geocode_cache.get(self.one_line_address(street), benchmark)
+                if found:
+                    results[i] = coordinates
+                    continue
+            pending.append((str(i), street))
+
+        batch_size = int(self.config_dict.get('geocoder_batch_size', 10000))
+        chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        concurrency = int(self.config_dict.get('geocoder_concurrency', 1) or 1)
+        logger.debug("Geocoding %s addresses in %s batches", len(pending), len(chunks))
+
+        matches = {}
+        failed = set()
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as executor:
+            futures = [executor.submit(self.post_batch, chunk) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    matches.update(future.result())
+                except (requests.RequestException, ValueError) as e:
+                    # Skip the failed chunk, and do not cache it, rather than losing every other chunk
+                    logger.warning("Batch geocoding failed for %s addresses: %s", len(chunk), e)
+                    failed.update(unique_id for unique_id, street in chunk)
+
+        for unique_id, street in pending:
+            if unique_id in failed:
+                self.failed_addresses.add(self.one_line_address(street))
+                continue
+            coordinates = matches.get(unique_id)
+            if coordinates is None:
+                logger.debug("No coordinates found for address: %s %s %s", street, self.city, self.state)
+            if self.geocode_cache is not None:
+                self.geocode_cache.put(self.one_line_address(street), coordinates, benchmark)
+            results[int(unique_id)] = coordinates
+
+        return results
+
+    def geocode_streets(self, streets):
+        """
+        Geocodes street addresses with either the batch or the one line geocoder, depending on the
+        geocoder_mode config key.
+        :param streets: A list of street addresses
+        :return: A list of (x, y) tuples or None, in the same order as the street addresses
+        """
+        if self.config_dict.get('geocoder_mode') == 'batch':
+            return self.geocode_batch(streets)
+
+        return self.geocode_all([self.one_line_address(street) for street in streets])
+
+    def checkpoint_fingerprint(self, streets):
+        """
+        Builds the fingerprint of a geocoding run: the geocoder settings and the street addresses, in order.
+        :param streets: A list of street addresses
+        :return: A hex digest
+        """
+        digest = hashlib.sha1()
+        for key in ('geocoder_mode', 'geocoder_prefix_url', 'geocoder_suffix_url', 'geocoder_batch_url',
+                    'geocoder_batch_benchmark'):
+            digest.update(f"{self.config_dict.get(key)}\x1e".encode("utf-8"))
+        digest.update("\x1f".join(streets).encode("utf-8"))
+        return digest.hexdigest()
+
+    def load_checkpoint(self, fingerprint):
+        """
+        Reads the addresses geocoded by an interrupted run with the same fingerprint. A checkpoint of any other
+        run is removed. A line cut short by the interruption is ignored.
+        :param fingerprint: The fingerprint of this run
+        :return: A dictionary of address position to an (x, y) tuple or None
+        """
+        checkpoint_path = f"{self.work_dir}geocode.checkpoint"
+        if not os.path.exists(checkpoint_path):
+            return {}
+
+        done = {}
+        with open(checkpoint_path) as checkpoint_file:
+            try:
+                header = json.loads(checkpoint_file.readline() or "{}")
+            except ValueError:
+                header = {}
+            if header.get('fingerprint') != fingerprint:
+                logger.info("Discarding the geocoding checkpoint of a different sheet")
+                checkpoint_file.close()
+                os.remove(checkpoint_path)
+                return {}
+
+            for line in checkpoint_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                for position, x, y in entry['rows']:
+                    done[position] = (x, y) if x is not None else None
+        return done
+
+    def geocode_with_checkpoint(self, streets):
+        """
+        Geocodes street addresses checkpoint_rows at a time. After each chunk the results are appended to
+        geocode.checkpoint and synced to disk, so a run that is interrupted resumes where it stopped. Addresses
+        whose request failed are left out of the checkpoint and are tried again by the next run.
+        :param streets: A list of street addresses
+        :return: A list of (x, y) tuples or None, in the same order as the street addresses
+        """
+        chunk_size = int(self.config_dict.get('checkpoint_rows', 500) or 0)
+        if chunk_size <= 0 or not streets:
+            return self.geocode_streets(streets)
+        if self.config_dict.get('geocoder_mode') == 'batch':
+            # Smaller chunks would split the uploads below geocoder_batch_size, or upload them one at a time
+            concurrency = int(self.config_dict.get('geocoder_concurrency', 1) or 1)
+            chunk_size = max(chunk_size, int(self.config_dict.get('geocoder_batch_size', 10000)) * concurrency)
+
+        fingerprint = self.checkpoint_fingerprint(streets)
+        done = self.load_checkpoint(fingerprint)
+        results = [done.get(position) for position in range(len(streets))]
+        pending = [position for position in range(len(streets)) if position not in done]
+        if done:
+            logger.info("Resuming from the geocoding checkpoint, %s of %s addresses are already geocoded",
+                        len(done), len(streets))
+
+        with open(f"{self.work_dir}geocode.checkpoint", "a") as checkpoint_file:
+            if checkpoint_file.tell() == 0:
+                checkpoint_file.write(json.dumps({'fingerprint': fingerprint, 'rows': len(streets)}) + "\n")
+
+            for start in range(0, len(pending), chunk_size):
+                chunk = pending[start:start + chunk_size]
+                rows = []
+                for position, coordinates in zip(chunk, self.geocode_streets([streets[i] for i in chunk])):
+                    results[position] = coordinates
+                    if self.one_line_address(streets[position]) not in self.failed_addresses:
+                        rows.append([position] + (list(coordinates) if coordinates is not None else [None, None]))
+
+                checkpoint_file.write(json.dumps({'offset': len(done) + start + len(chunk), 'rows': rows}) + "\n")
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+                if self.geocode_cache is not None:
+                    self.geocode_cache.commit()
+
+        return results
+
+    def remove_checkpoint(self):
+        """
+        Removes the geocoding checkpoint once the transform output has been written.
+        :param: None
+        :return: None
+        """
+        checkpoint_path = f"{self.work_dir}geocode.checkpoint"
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    def load_manifest(self):
+        """
+        Reads the manifest of row keys, content hashes and coordinates written by the previous incremental run.
+        :param: None
+        :return: The manifest dictionary, empty if there is no previous run
+        """
+        manifest_path = f"{self.work_dir}manifest.json"
+        if not os.path.exists(manifest_path):
+            return {}
+
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def save_manifest(self):
+        """
+        Writes the manifest built by the last transform, once its changes have been loaded.
+        :param: None
+        :return: None
+        """
+        if self.pending_manifest is None:
+            return
+
+        manifest_path = f"{self.work_dir}manifest.json"
+        with open(f"{manifest_path}.part", "w") as manifest_file:
+            json.dump(self.pending_manifest, manifest_file)
+        os.replace(f"{manifest_path}.part", manifest_path)
+        self.pending_manifest = None
 
+    def row_keys(self, columns, fieldnames):
+        """
+        Builds a stable key and a content hash for each spreadsheet row. The key comes from the
+        incremental_key_field config key, or from the row content when no key field is set.
+        :param columns: A dictionary of spreadsheet column name to a list of strings
+        :param fieldnames: The spreadsheet column names
+        :return: A list of (key, hash) tuples in the same order as the rows
+        """
+        key_field = self.config_dict.get('incremental_key_field')
+        key_values = columns.get(key_field) if key_field else None
+        seen = {}
+        keys = []
+
+        for i, values in enumerate(zip(*(columns[name] for name in fieldnames))):
+            digest = hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+            key = (key_values[i] if key_values is not None else None) or digest
+
+            # Identical rows share a hash, so number repeats to keep every key unique
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > 1:
+                key = f"{key}#{seen[key]}"
+            keys.append((key, digest))
+
+        return keys
+
+    @traced("transform")
     def transform(self):
         """
-        Adds city, state, and geocoded X, Y coordinates to the extracted addresses.
+        Adds city, state, and geocoded X, Y coordinates to the extracted addresses. When the incremental
+        config key is set, only rows that were added or changed since the last run are geocoded.
         :param: None
         :return: None
         """
-        logging.debug("Entering transform function")
+        incremental = bool(self.config_dict.get('incremental'))
+        self.delta = None
+        self.table = None
+        self.failed_addresses = set()
+        work_dir = self.work_dir
 
         try:
-            logging.debug("Add City, State")
-
-            with open(fr"{self.config_dict.get('proj_dir')}addresses.csv",
-                      "r") as input_file, \
-                    open(fr"{self.config_dict.get('proj_dir')}output.csv", "w",
-                         newline='') as output_file:
-                csv_reader = csv.DictReader(input_file)
-                fieldnames = csv_reader.fieldnames + ['X', 'Y', 'Type']
-                csv_writer = csv.DictWriter(output_file, fieldnames=fieldnames)
-                csv_writer.writeheader()
-                for row in csv_reader:
-                    address = row["Street Address:"] + " Boulder CO"
-                    logging.debug(address)
-                    geocode_url = fr"{self.config_dict.get('geocoder_prefix_url')}" + address + fr"{self.config_dict.get('geocoder_suffix_url')}"
-
-
-                    r = requests.get(geocode_url)
-                    resp_dict = r.json()
-                    address_matches = resp_dict['result']['addressMatches']
-                    if address_matches:
-                        x = address_matches[0]['coordinates']['x']
-                        y = address_matches[0]['coordinates']['y']
-                    else:
-                        logging.debug(f"No coordinates found for address: {address}")
+            logger.debug("Add City, State")
+            self.open_geocode_cache()
+
+            # The sheet is read column by column, so no dictionary is built per row
+            sheet_fields, columns = AddressTable.read_columns(fr"{work_dir}addresses.csv")
+            streets = columns["Street Address:"]
+            row_count = len(streets)
+
+            manifest = self.load_manifest() if incremental else {}
+            keys = self.row_keys(columns, sheet_fields) if incremental else [(None, None)] * row_count
+
+            # Rows whose content hash matches the manifest reuse the coordinates from the last run
+            x = np.full(row_count, np.nan)
+            y = np.full(row_count, np.nan)
+            changed = []
+            for i, (key, digest) in enumerate(keys):
+                previous = manifest.get(key)
+                if previous is not None and previous['hash'] == digest:
+                    if previous['xy']:
+                        x[i], y[i] = previous['xy']
+                else:
+                    # The arguments are only joined into a message when debug logging is on
+                    logger.debug("%s %s %s", streets[i], self.city, self.state)
+                    changed.append(i)
+
+            logger.debug("Geocoding %s of %s rows", len(changed), row_count)
+            for i, coordinates in zip(changed, self.geocode_with_checkpoint([streets[i] for i in changed])):
+                if coordinates is not None:
+                    x[i], y[i] = coordinates
+
+            fieldnames = list(sheet_fields)
+            if incremental:
+                fieldnames.append('RowKey')
+                columns['RowKey'] = [key for key, digest in keys]
+            table = AddressTable.from_columns(fieldnames, columns, x, y, 'Residential')
+
+            # Skip addresses the geocoder could not match
+            matched = ~np.isnan(x)
+            self.table = table.take(np.flatnonzero(matched))
+            self.output_fieldnames = self.table.fieldnames
+            self.table.write_csv(fr"{work_dir}output.csv")
+            if self.config_dict.get('binary_output'):
+                self.table.save(fr"{work_dir}output.npz")
+            self.remove_checkpoint()
+            set_count(len(self.table))
+
+            if self.failed_addresses:
+                # Without the ETag the next run downloads the sheet again rather than skip it, and retries these
+                logger.warning("%s addresses could not be geocoded and will be tried again by the next run",
+                               len(self.failed_addresses))
+                self.pending_meta = None
+
+            if incremental:
+                # A row whose request failed is left out of the manifest, so the next run geocodes it again instead
+                # of taking it as an address without a match. Its old point is deleted below like any removed row.
+                failed = {i for i in changed if self.one_line_address(streets[i]) in self.failed_addresses}
+                new_manifest = {}
+                delta = {'insert': [], 'update': [], 'delete': []}
+                for i, (key, digest) in enumerate(keys):
+                    if i not in failed:
+                        new_manifest[key] = {'hash': digest,
+                                             'xy': [float(x[i]), float(y[i])] if matched[i] else None}
+
+                for i in changed:
+                    key = keys[i][0]
+                    had_coordinates = bool((manifest.get(key) or {}).get('xy'))
+                    if i in failed:
                         continue
+                    if matched[i]:
+                        delta['update' if had_coordinates else 'insert'].append(table.row(i))
+                    elif had_coordinates:
+                        delta['delete'].append(key)
 
-                    row['X'] = x
-                    row['Y'] = y
-                    row['Type'] = 'Residential'
-                    csv_writer.writerow(row)
+                delta['delete'].extend(key for key, entry in manifest.items()
+                                       if key not in new_manifest and entry['xy'])
+                self.delta = delta if manifest else None
+                self.pending_manifest = new_manifest
+                logger.info("Incremental changes: %s inserts, %s updates, %s deletes, %s left for the next run",
+                            len(delta['insert']), len(delta['update']), len(delta['delete']), len(failed))
         except Exception as e:
+            # Download the sheet again next run rather than take it as loaded
+            self.pending_meta = None
             print(f"Error in the GSheets transform function{e}")
+        finally:
+            self.close_geocode_cache()
+
+    def apply_delta(self, out_feature_class):
+        """
+        Applies the inserts, updates and deletes found by an incremental transform to the output feature class
+        instead of rebuilding it.
+        :param out_feature_class: The feature class created by a previous full load
+        :return: None
+        """
+        workspace = arcpy.env.workspace
+        existing_fields = {field.name for field in arcpy.ListFields(out_feature_class)}
+
+        # The fields were created with valid field names, so map the columns the same way. The X and Y fields are
+        # written too, so a delta leaves the same table a full load would
+        columns = [name for name in self.output_fieldnames if name != 'RowKey']
+        field_map = {name: arcpy.ValidateFieldName(name, workspace) for name in columns}
+        field_map = {name: field for name, field in field_map.items() if field in existing_fields}
+        fields = list(field_map.values())
+
+        updates = {row['RowKey']: row for row in self.delta['update']}
+        changed_keys = list(updates) + self.delta['delete']
+
+        # Keep the where clauses a reasonable length by working through the keys in chunks
+        for start in range(0, len(changed_keys), 500):
+            chunk = changed_keys[start:start + 500]
+            key_list = ",".join("'" + key.replace("'", "''") + "'" for key in chunk)
+            with arcpy.da.UpdateCursor(out_feature_class, ['RowKey', 'SHAPE@XY'] + fields,
+                                       f"RowKey IN ({key_list})") as cursor:
+                for feature in cursor:
+                    row = updates.get(feature[0])
+                    if row is None:
+                        cursor.deleteRow()
+                        continue
+                    cursor.updateRow([feature[0], (float(row['X']), float(row['Y']))] +
+                                     [row.get(name) for name in field_map])
 
-        logging.debug("Exiting transform function")
+        with arcpy.da.InsertCursor(out_feature_class, ['SHAPE@XY', 'RowKey'] + fields) as cursor:
+            for row in self.delta['insert']:
+                cursor.insertRow([(float(row['X']), float(row['Y'])), row['RowKey']] +
+                                 [row.get(name) for name in field_map])
 
+    def output_table(self):
+        """
+        Gets the transformed addresses: the table kept by transform, or else output.npz or output.csv from an
+        earlier run.
+        :param: None
+        :return: An AddressTable
+        """
+        if self.table is not None:
+            return self.table
+
+        if self.config_dict.get('binary_output') and os.path.exists(f"{self.work_dir}output.npz"):
+            return AddressTable.load(f"{self.work_dir}output.npz")
+        return AddressTable.read_csv(f"{self.work_dir}output.csv")
+
+    def create_output_feature_class(self, out_feature_class, columns):
+        """
+        Creates the output feature class as an empty WGS 1984 point feature class with a field for each column.
+        X and Y are double fields and the other columns are text fields, as XYTableToPoint made them.
+        :param out_feature_class: The feature class name in the current workspace
+        :param columns: The column names
+        :return: The field names, in the same order as columns
+        """
+        fields = [arcpy.ValidateFieldName(name, arcpy.env.workspace) for name in columns]
+
+        arcpy.management.Delete(out_feature_class, "FeatureClass")
+        arcpy.management.CreateFeatureclass(arcpy.env.workspace, out_feature_class, "POINT",
+                                            spatial_reference=arcpy.SpatialReference(4326))
+        for name, field in zip(columns, fields):
+            if name in ('X', 'Y'):
+                arcpy.management.AddField(out_feature_class, field, "DOUBLE")
+            else:
+                arcpy.management.AddField(out_feature_class, field, "TEXT", field_length=255)
+        return fields
+
+    def insert_table(self, out_feature_class, table):
+        """
+        Inserts the rows of an AddressTable into a feature class made by create_output_feature_class. Each row is
+        built straight from the table's columns, so the coordinates are never formatted as text and parsed again.
+        :param out_feature_class: The feature class name in the current workspace
+        :param table: An AddressTable
+        :return: The number of rows inserted
+        """
+        fields = [arcpy.ValidateFieldName(name, arcpy.env.workspace) for name in table.fieldnames]
+        points = zip(table.x.tolist(), table.y.tolist())
+        with arcpy.da.InsertCursor(out_feature_class, ['SHAPE@XY'] + fields) as cursor:
+            for row in zip(points, *(table.column(name) for name in table.fieldnames)):
+                cursor.insertRow(row)
+        return len(table)
+
+    def uses_arcpy(self):
+        """
+        Checks whether avoid points are loaded into the geodatabase with arcpy or written as GeoJSON for the
+        shapely geometry backend.
+        :param: None
+        :return: True when loading with arcpy
+        """
+        return (self.config_dict.get('geometry_backend') or ("arcpy" if arcpy is not None else "shapely")) == "arcpy"
+
+    @traced("load")
     def load(self):
         """
-        Loads the transformed addresses into an ArcGIS feature class.
+        Loads the transformed addresses into an ArcGIS feature class, or into the avoid_points layer of the
+        shapely geometry backend. The points are written straight from the transformed columns. After an
+        incremental transform the changed rows are applied to the existing layer instead of rebuilding it.
         :param: None
         :return: None
         """
-        logging.debug("Entering load function")
+        self.loaded = False
+        if not self.uses_arcpy():
+            try:
+                backend = ShapelyBackend(self.config_dict)
+                if self.delta is not None and backend.exists("avoid_points"):
+                    count = backend.apply_point_changes("avoid_points", 'RowKey', self.delta['update'],
+                                                        self.delta['insert'], self.delta['delete'])
+                else:
+                    count = backend.write_table("avoid_points", self.output_table())
+                self.save_manifest()
+                self.save_meta()
+                self.loaded = True
+                set_count(count)
+                logger.debug(count)
+            except Exception as e:
+                print(f"Error in the GSheets load function{e}")
+
+            return
 
         try:
             arcpy.env.workspace = rf"{self.config_dict.get('proj_dir')}WestNileOutbreak.gdb\\"
             arcpy.env.overwriteOutput = True
 
-            in_table = self.config_dict.get('proj_dir') + "output.csv"
             out_feature_class = "avoid_points"
-            x_coords = "X"
-            y_coords = "Y"
 
-            arcpy.management.Delete(out_feature_class, "FeatureClass")
+            if self.delta is not None and arcpy.Exists(out_feature_class):
+                self.apply_delta(out_feature_class)
+            else:
+                table = self.output_table()
+                self.create_output_feature_class(out_feature_class, table.fieldnames)
+                self.insert_table(out_feature_class, table)
 
-            arcpy.management.XYTableToPoint(in_table, out_feature_class, x_coords, y_coords)
+            self.save_manifest()
+            self.save_meta()
+            self.loaded = True
 
-            logging.debug(arcpy.GetCount_management(out_feature_class))
+            count = int(arcpy.GetCount_management(out_feature_class)[0])
+            set_count(count)
+            logger.debug(count)
         except Exception as e:
             print(f"Error in the GSheets load function{e}")
 
+    def extract_rows(self):
+        """
+        Streams the Google Sheets form and yields its rows as they arrive. When the debug_csv config key is set
+        the raw sheet is also written to addresses.csv.
+        :param: None
+        :return: A generator of row dictionaries
+        """
+        logger.debug("Extracting addresses from google form spreadsheet")
+
+        with self.http.get(self.config_dict.get('remote_url'), headers={'Accept-Encoding': 'gzip'},
+                           stream=True) as r:
+            r.raise_for_status()
+            lines = (line.decode("utf-8") for line in r.iter_lines())
+
+            if not self.config_dict.get('debug_csv'):
+                yield from csv.DictReader(lines)
+                return
+
+            with open(f"{self.work_dir}addresses.csv", "w", newline='') as debug_file:
+                def tee(source):
+                    for line in source:
+                        debug_file.write(line + "\n")
+                        yield line
+
+                yield from csv.DictReader(tee(lines))
+
+    def transform_rows(self, rows):
+        """
+        Geocodes a stream of rows. Rows are geocoded in small windows so loading can start before the whole
+        sheet has been geocoded. Unmatched addresses are skipped.
+        :param rows: An iterable of row dictionaries
+        :return: A generator of row dictionaries with X, Y and Type added
+        """
+        concurrency = int(self.config_dict.get('geocoder_concurrency', 1) or 1)
+        window_size = int(self.config_dict.get('stream_window_size', concurrency * 4))
+
+        self.open_geocode_cache()
+        try:
+            window = []
+            for row in rows:
+                window.append(row)
+                if len(window) >= window_size:
+                    yield from self.geocode_window(window)
+                    window = []
+            yield from self.geocode_window(window)
+        finally:
+            self.close_geocode_cache()
+
+    def geocode_window(self, window):
+        """
+        Geocodes one window of streamed rows.
+        :param window: A list of row dictionaries
+        :return: A generator of the matched row dictionaries with X, Y and Type added
+        """
+        if not window:
+            return
+
+        for row, coordinates in zip(window, self.geocode_streets([row["Street Address:"] for row in window])):
+            if coordinates is None:
+                continue
 
-        logging.debug("Exiting load function")
+            row['X'], row['Y'] = coordinates
+            row['Type'] = 'Residential'
+            yield row
 
+    def load_rows(self, rows):
+        """
+        Creates the avoid_points feature class and inserts streamed rows into it as they arrive. When the
+        debug_csv config key is set the rows are also written to output.csv.
+        :param rows: An iterable of row dictionaries with X, Y and Type
+        :return: None
+        """
+        if not self.uses_arcpy():
+            self.load_row_batches(rows)
+            return
+
+        arcpy.env.workspace = rf"{self.config_dict.get('proj_dir')}WestNileOutbreak.gdb\\"
+        arcpy.env.overwriteOutput = True
+        out_feature_class = "avoid_points"
+
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            logger.info("No geocoded rows to load")
+            return
+
+        columns = [name for name in first_row if name not in ('X', 'Y')]
+        fields = self.create_output_feature_class(out_feature_class, columns)
+
+        debug_file = None
+        if self.config_dict.get('debug_csv'):
+            debug_file = open(f"{self.work_dir}output.csv", "w", newline='')
+            csv_writer = csv.DictWriter(debug_file, fieldnames=list(first_row))
+            csv_writer.writeheader()
+
+        count = 0
+        try:
+            with arcpy.da.InsertCursor(out_feature_class, ['SHAPE@XY'] + fields) as cursor:
+                for row in itertools.chain([first_row], rows):
+                    cursor.insertRow([(float(row['X']), float(row['Y']))] + [row.get(name) for name in columns])
+                    if debug_file is not None:
+                        csv_writer.writerow(row)
+                    count += 1
+        finally:
+            if debug_file is not None:
+                debug_file.close()
+
+        logger.debug("Loaded %s rows into %s", count, out_feature_class)
+
+    def load_row_batches(self, rows):
+        """
+        Writes streamed rows to the avoid_points layer of the shapely geometry backend in load_batch_size batches,
+        so each batch is written while the next one is geocoded. When the debug_csv config key is set the rows are
+        also written to output.csv.
+        :param rows: An iterable of row dictionaries with X, Y and Type
+        :return: None
+        """
+        backend = ShapelyBackend(self.config_dict)
+        debug_file = None
+        csv_writer = None
+
+        def batches():
+            nonlocal debug_file, csv_writer
+            row_iter = iter(rows)
+            while True:
+                batch = list(itertools.islice(row_iter, backend.batch_size))
+                if not batch:
+                    return
+                if self.config_dict.get('debug_csv'):
+                    if debug_file is None:
+                        debug_file = open(f"{self.work_dir}output.csv", "w", newline='')
+                        csv_writer = csv.DictWriter(debug_file, fieldnames=list(batch[0]))
+                        csv_writer.writeheader()
+                    csv_writer.writerows(batch)
+                yield [({"type": "Point", "coordinates": [float(row['X']), float(row['Y'])]}, dict(row))
+                       for row in batch]
+
+        try:
+            count = backend.write_batches("avoid_points", batches(), epsg=4326)
+        finally:
+            if debug_file is not None:
+                debug_file.close()
+
+        logger.debug("Loaded %s rows into avoid_points", count)
+
+    @traced("process")
     def process(self):
         """
         Executes the full ETL process (extract, transform, and load).
         :param: None
         :return: None
         """
-        logging.debug("Entering ETL processing function")
+        if self.config_dict.get('pipeline') == 'stream':
+            try:
+                self.stream_process()
+            except Exception as e:
+                print(f"Error in the GSheets streaming pipeline{e}")
+            return
+
         self.extract()
+
+        # An unchanged sheet has already been transformed and loaded by a previous run, unless that run stopped
+        # part way through geocoding it
+        if self.extract_skipped and os.path.exists(f"{self.work_dir}output.csv") \
+                and not os.path.exists(f"{self.work_dir}geocode.checkpoint"):
+            logger.info("avoid_points is up to date with the sheet")
+            return
+
         self.transform()
         self.load()
-        logging.debug("Exiting ETL processing function")
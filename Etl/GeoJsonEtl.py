@@ -0,0 +1,334 @@
+"""
+This module contains the GeoJsonEtl class, which loads a large GeoJSON or newline-delimited GeoJSON export into a
+layer. Features are parsed one at a time from the byte stream of the file or URL, filtered and trimmed as they
+arrive, and written to the geometry backend in batches of load_batch_size features, so memory use depends on the
+batch size rather than on the size of the export.
+"""
+
+import os
+import json
+import gzip
+import codecs
+import logging
+import itertools
+from Etl.SpatialEtl import SpatialEtl
+from Etl.HttpClient import HttpClient
+from Etl.GeometryBackend import create_backend
+from Etl.Tracing import traced, set_count
+
+logger = logging.getLogger(__name__)
+
+# File extensions of newline-delimited GeoJSON
+NDJSON_EXTENSIONS = (".ndjson", ".geojsonl", ".geojsonseq", ".jsonl")
+
+# Bytes read from the source at a time
+CHUNK_SIZE = 1024 * 1024
+
+
+class GeoJsonEtl(SpatialEtl):
+    """
+    GeoJsonEtl performs a streaming extract, transform and load of a GeoJSON FeatureCollection or a
+    newline-delimited GeoJSON file.
+
+    Parameters:
+    config_dict (dictionary): A dictionary containing configuration settings
+    source (dictionary): The export to load, by default the geojson_source config key. Its keys are url (a path or
+    http(s) URL), layer (the output layer), and optionally format (geojson or ndjson), epsg (of the export, 4326 by
+    default), out_epsg, fields (the properties to keep), where (a property to allowed values dictionary),
+    bbox ([min x, min y, max x, max y] in the export's coordinates) and geometry_types.
+    """
+
+    def __init__(self, config_dict, source=None):
+        self.config_dict = config_dict
+        self.source = source or config_dict.get('geojson_source') or {}
+        self.http = HttpClient.from_config(config_dict)
+        self.batch_size = int(self.source.get('batch_size') or config_dict.get('load_batch_size', 10000))
+        self.read_count = 0
+        self.kept_count = 0
+
+    @property
+    def url(self):
+        """
+        Gets the path or URL of the export.
+        :param: None
+        :return: The path or URL
+        """
+        return self.source.get('url') or self.source.get('path')
+
+    def is_ndjson(self):
+        """
+        Checks whether the export is newline-delimited GeoJSON, from the format key or the file extension.
+        :param: None
+        :return: True for newline-delimited GeoJSON
+        """
+        source_format = self.source.get('format')
+        if source_format:
+            return source_format.lower() in ("ndjson", "geojsonl", "geojsonseq")
+
+        name = self.url.split("?")[0].lower()
+        if name.endswith(".gz"):
+            name = name[:-3]
+        return name.endswith(NDJSON_EXTENSIONS)
+
+    def read_chunks(self):
+        """
+        Reads the export as a stream of byte chunks. Gzipped files are decompressed as they are read, and a
+        gzipped HTTP response is decompressed by requests.
+        :param: None
+        :return: A generator of bytes
+        """
+        url = self.url
+        if url.lower().startswith(("http://", "https://")):
+            with self.http.get(url, headers={'Accept-Encoding': 'gzip'}, stream=True) as r:
+                r.raise_for_status()
+                yield from r.iter_content(CHUNK_SIZE)
+            return
+
+        opener = gzip.open if url.lower().endswith(".gz") else open
+        with opener(url, "rb") as source_file:
+            for chunk in iter(lambda: source_file.read(CHUNK_SIZE), b""):
+                yield chunk
+
+    @staticmethod
+    def parse_ndjson(chunks):
+        """
+        Parses newline-delimited GeoJSON, one feature per line. Record separators of GeoJSON text sequences are
+        ignored.
+        :param chunks: An iterable of bytes
+        :return: A generator of feature dictionaries
+        """
+        pending = b""
+        for chunk in chunks:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                line = line.strip().strip(b"\x1e")
+                if line:
+                    yield json.loads(line)
+
+        pending = pending.strip().strip(b"\x1e")
+        if pending:
+            yield json.loads(pending)
+
+    @staticmethod
+    def parse_feature_collection(chunks):
+        """
+        Parses the features of a GeoJSON FeatureCollection one at a time. Members other than features are
+        decoded and skipped, and each feature is decoded as soon as all of its text has been read.
+        :param chunks: An iterable of bytes
+        :return: A generator of feature dictionaries
+        """
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        chunks = iter(chunks)
+        state = {"buffer": "", "position": 0, "eof": False}
+
+        def read_more(size=1):
+            # Reads until at least size characters are waiting, dropping the text already parsed
+            buffer = state["buffer"][state["position"]:]
+            while len(buffer) < size and not state["eof"]:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    state["eof"] = True
+                    buffer += text_decoder.decode(b"", final=True)
+                else:
+                    buffer += text_decoder.decode(chunk)
+            state["buffer"], state["position"] = buffer, 0
+
+        def peek():
+            # Skips whitespace and returns the next character, or "" at the end of the stream
+            while True:
+                buffer, position = state["buffer"], state["position"]
+                while position < len(buffer) and buffer[position] in " \t\r\n":
+                    position += 1
+                state["position"] = position
+                if position < len(buffer) or state["eof"]:
+                    return buffer[position:position + 1]
+                read_more()
+
+        def expect(char):
+            if peek() != char:
+                raise ValueError(f"Expected {char!r} at character {state['position']} of the GeoJSON stream")
+            state["position"] += 1
+
+        def value():
+            # A value that ends exactly at the end of the buffer may continue in the next chunk
+            peek()
+            while True:
+                try:
+                    decoded, end = decoder.raw_decode(state["buffer"], state["position"])
+                    if end < len(state["buffer"]) or state["eof"]:
+                        state["position"] = end
+                        return decoded
+                except json.JSONDecodeError:
+                    if state["eof"]:
+                        raise
+                # Doubling what is waiting keeps a feature that spans many chunks from being decoded once per chunk
+                read_more(2 * (len(state["buffer"]) - state["position"]) + 1)
+
+        expect("{")
+        while True:
+            char = peek()
+            if char == "}" or char == "":
+                return
+            if char == ",":
+                state["position"] += 1
+                continue
+
+            key = value()
+            expect(":")
+            if key != "features":
+                value()
+                continue
+
+            expect("[")
+            while True:
+                char = peek()
+                if char == "]":
+                    state["position"] += 1
+                    break
+                if char == ",":
+                    state["position"] += 1
+                    continue
+                if char == "":
+                    raise ValueError("The GeoJSON stream ended inside the features array")
+                yield value()
+
+    def extract_rows(self):
+        """
+        Streams the features of the export.
+        :param: None
+        :return: A generator of feature dictionaries
+        """
+        logger.debug("Streaming features from %s", self.url)
+        if self.is_ndjson():
+            features = self.parse_ndjson(self.read_chunks())
+        else:
+            features = self.parse_feature_collection(self.read_chunks())
+
+        for feature in features:
+            self.read_count += 1
+            yield feature
+
+    @staticmethod
+    def coordinates_bounds(coordinates):
+        """
+        Finds the bounding box of nested GeoJSON coordinates.
+        :param coordinates: A position or a nested list of positions
+        :return: A (min x, min y, max x, max y) tuple, or None when there are no positions
+        """
+        stack = [coordinates]
+        xs, ys = [], []
+        while stack:
+            item = stack.pop()
+            if item and isinstance(item[0], (int, float)):
+                xs.append(item[0])
+                ys.append(item[1])
+            else:
+                stack.extend(item)
+        if not xs:
+            return None
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def keep(self, feature):
+        """
+        Checks a feature against the where, bbox and geometry_types filters of the source.
+        :param feature: A feature dictionary
+        :return: True if the feature is loaded
+        """
+        geometry = feature.get('geometry')
+        if not geometry:
+            return False
+
+        geometry_types = self.source.get('geometry_types')
+        if geometry_types and geometry.get('type') not in geometry_types:
+            return False
+
+        properties = feature.get('properties') or {}
+        for name, allowed in (self.source.get('where') or {}).items():
+            allowed = allowed if isinstance(allowed, list) else [allowed]
+            if properties.get(name) not in allowed:
+                return False
+
+        bbox = self.source.get('bbox')
+        if bbox:
+            if geometry.get('type') == "GeometryCollection":
+                coordinates = [part.get('coordinates') or [] for part in geometry.get('geometries') or []]
+            else:
+                coordinates = geometry.get('coordinates') or []
+            bounds = self.coordinates_bounds(coordinates)
+            if bounds is None or bounds[2] < bbox[0] or bounds[0] > bbox[2] or bounds[3] < bbox[1] \
+                    or bounds[1] > bbox[3]:
+                return False
+        return True
+
+    def transform_rows(self, rows):
+        """
+        Filters a stream of features and keeps only the configured properties.
+        :param rows: An iterable of feature dictionaries
+        :return: A generator of (GeoJSON geometry dictionary, properties) tuples
+        """
+        fields = self.source.get('fields')
+        for feature in rows:
+            if not self.keep(feature):
+                continue
+
+            properties = feature.get('properties') or {}
+            if fields:
+                properties = {name: properties.get(name) for name in fields}
+            self.kept_count += 1
+            yield feature['geometry'], properties
+
+    def batches(self, rows):
+        """
+        Groups a stream into lists of at most batch_size items.
+        :param rows: An iterable
+        :return: A generator of lists
+        """
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def load_rows(self, rows):
+        """
+        Writes a stream of features to the source's layer in batches.
+        :param rows: An iterable of (GeoJSON geometry dictionary, properties) tuples
+        :return: The number of features written
+        """
+        layer = self.source.get('layer')
+        if not layer:
+            raise ValueError(f"The GeoJSON source {self.url} has no layer to load into")
+
+        backend = create_backend(self.config_dict)
+        count = backend.write_batches(layer, self.batches(rows), int(self.source.get('epsg', 4326)),
+                                      self.source.get('out_epsg'))
+        logger.debug("Loaded %s of %s features from %s into %s", count, self.read_count, self.url, layer)
+        return count
+
+    def extract(self):
+        """
+        Checks that the export exists. The features are read while they are loaded, so nothing is copied.
+        :param: None
+        :return: None
+        """
+        if not self.url.lower().startswith(("http://", "https://")) and not os.path.exists(self.url):
+            raise FileNotFoundError(f"The GeoJSON source {self.url} does not exist")
+
+    @traced("geojson_etl")
+    def process(self):
+        """
+        Executes the streaming ETL process (extract, transform, and load).
+        :param: None
+        :return: None
+        """
+        try:
+            self.extract()
+            count = self.load_rows(self.transform_rows(self.extract_rows()))
+            set_count(count)
+        except Exception as e:
+            print(f"Error in the GeoJSON ETL process{e}")
+        finally:
+            self.http.close()
@@ -0,0 +1,436 @@
+"""
+This module reads and writes single layer GeoPackage files with the standard library's sqlite3 module, so the
+shapely geometry backend can store layers without GDAL. A layer is written to a new file inside one transaction
+with prepared insert statements run through executemany, and the file replaces the old layer only once it is
+complete. Point coordinates are packed into GeoPackage geometry blobs straight from the X and Y arrays.
+"""
+
+import os
+import struct
+import sqlite3
+import itertools
+import numpy as np
+
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+# The "GPKG" application id and the version 1.3 user version every GeoPackage sets
+APPLICATION_ID = 0x47504B47
+USER_VERSION = 10300
+
+# Size of the envelope that follows the blob header, by envelope indicator
+ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+# A little endian GeoPackage header without an envelope followed by a little endian WKB point
+POINT_BLOB = np.dtype([('magic', 'S2'), ('version', 'u1'), ('flags', 'u1'), ('srs_id', '<i4'),
+                       ('byte_order', 'u1'), ('wkb_type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+WGS84_WKT = ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],'
+             'UNIT["degree",0.0174532925199433],AUTHORITY["EPSG","4326"]]')
+
+CORE_TABLES = [
+    """CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY,
+       organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL,
+       description TEXT)""",
+    """CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+       identifier TEXT UNIQUE, description TEXT DEFAULT '',
+       last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+       min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+       srs_id INTEGER, CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+       geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+       CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+       CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+       CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))""",
+]
+
+
+def quote(name):
+    """
+    Quotes a table or column name for SQL.
+    :param name: Table or column name
+    :return: The quoted name
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def srs_definition(srs_id):
+    """
+    Gets the WKT definition of a spatial reference.
+    :param srs_id: EPSG code
+    :return: The WKT, or "undefined" when it cannot be looked up without pyproj
+    """
+    if pyproj is not None:
+        return pyproj.CRS.from_epsg(srs_id).to_wkt("WKT1_GDAL")
+    return "undefined"
+
+
+def column_type(values):
+    """
+    Picks the SQLite type of an attribute column.
+    :param values: The values of the column
+    :return: INTEGER, REAL or TEXT
+    """
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return "INTEGER"
+    if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return "REAL"
+    return "TEXT"
+
+
+def property_names(features):
+    """
+    Collects the property names of features in the order they first appear.
+    :param features: A list of (geometry, properties) tuples
+    :return: A list of names
+    """
+    names = {}
+    for geometry, properties in features:
+        for name in properties:
+            names.setdefault(name, None)
+    return list(names)
+
+
+def merge_bounds(bounds, geometries):
+    """
+    Grows a bounding box to cover more geometries.
+    :param bounds: A (min x, min y, max x, max y) tuple, or None
+    :param geometries: A list of shapely geometries
+    :return: The grown bounding box, or None while every geometry is empty
+    """
+    min_x, min_y, max_x, max_y = (float(value) for value in shapely.total_bounds(geometries))
+    if min_x != min_x:
+        return bounds
+    if bounds is None:
+        return min_x, min_y, max_x, max_y
+    return min(bounds[0], min_x), min(bounds[1], min_y), max(bounds[2], max_x), max(bounds[3], max_y)
+
+
+def point_blobs(x, y, srs_id):
+    """
+    Packs point coordinates into GeoPackage geometry blobs in one pass over the arrays.
+    :param x: An array of X coordinates
+    :param y: An array of Y coordinates
+    :param srs_id: EPSG code of the coordinates
+    :return: A list of blobs
+    """
+    packed = np.empty(len(x), dtype=POINT_BLOB)
+    packed['magic'] = b"GP"
+    packed['version'] = 0
+    packed['flags'] = 1
+    packed['srs_id'] = srs_id
+    packed['byte_order'] = 1
+    packed['wkb_type'] = 1
+    packed['x'] = x
+    packed['y'] = y
+
+    data = packed.tobytes()
+    size = POINT_BLOB.itemsize
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def geometry_blobs(geometries, srs_id):
+    """
+    Packs shapely geometries into GeoPackage geometry blobs.
+    :param geometries: A list of shapely geometries
+    :param srs_id: EPSG code of the geometries
+    :return: A list of blobs
+    """
+    header = b"GP\x00\x01" + struct.pack("<i", srs_id)
+    empty_header = b"GP\x00\x11" + struct.pack("<i", srs_id)
+    blobs = shapely.to_wkb(np.array(geometries, dtype=object), output_dimension=2, byte_order=1,
+                           flavor="iso").tolist()
+    return [(empty_header if geometry.is_empty else header) + blob for geometry, blob in zip(geometries, blobs)]
+
+
+def parse_blobs(blobs):
+    """
+    Reads GeoPackage geometry blobs.
+    :param blobs: A list of blobs
+    :return: A list of shapely geometries
+    """
+    wkbs = []
+    for blob in blobs:
+        envelope = (blob[3] >> 1) & 7
+        wkbs.append(blob[8 + ENVELOPE_SIZES[envelope]:])
+    return shapely.from_wkb(wkbs).tolist()
+
+
+class GeoPackage:
+    """
+    A class to represent a GeoPackage file holding one feature table.
+    """
+
+    def __init__(self, path, batch_size=10000):
+        """
+        Initializes the object.
+        :param path: Path of the .gpkg file
+        :param batch_size: The number of rows packed and inserted at a time
+        :return: None
+        """
+        self.path = path
+        self.batch_size = int(batch_size)
+
+    def create(self, layer, columns, geometry_type, srs_id, bounds):
+        """
+        Creates a new GeoPackage next to the final path with an empty feature table.
+        :param layer: Feature table name
+        :param columns: A list of (column name, SQLite type) tuples
+        :param geometry_type: POINT or GEOMETRY
+        :param srs_id: EPSG code of the geometries
+        :param bounds: A (min x, min y, max x, max y) tuple, or None
+        :return: An open sqlite3 connection inside a transaction
+        """
+        part_path = f"{self.path}.part"
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+        connection = sqlite3.connect(part_path, isolation_level=None)
+        # The file only replaces the layer once it is complete, so it needs no rollback journal
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute(f"PRAGMA application_id={APPLICATION_ID}")
+        connection.execute(f"PRAGMA user_version={USER_VERSION}")
+        connection.execute("BEGIN")
+        for statement in CORE_TABLES:
+            connection.execute(statement)
+
+        # Every GeoPackage lists WGS 1984 and the two undefined systems, whatever its layers use
+        connection.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+            ("WGS 84 geodetic", 4326, "EPSG", 4326, WGS84_WKT, None),
+            ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+            ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+        ])
+        if srs_id not in (4326, -1, 0):
+            connection.execute("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, 'EPSG', ?, ?, NULL)",
+                               (f"EPSG:{srs_id}", srs_id, srs_id, srs_definition(srs_id)))
+
+        min_x, min_y, max_x, max_y = bounds if bounds is not None else (None, None, None, None)
+        connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, "
+                           "max_y, srs_id) VALUES (?, 'features', ?, ?, ?, ?, ?, ?)",
+                           (layer, layer, min_x, min_y, max_x, max_y, srs_id))
+        connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', ?, ?, 0, 0)",
+                           (layer, geometry_type, srs_id))
+
+        column_sql = "".join(f", {quote(name)} {sql_type}" for name, sql_type in columns)
+        connection.execute(f"CREATE TABLE {quote(layer)} (fid INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           f"geom {geometry_type}{column_sql})")
+        return connection
+
+    def finish(self, connection):
+        """
+        Commits the transaction and moves the new file over the old layer.
+        :param connection: The connection returned by create
+        :return: None
+        """
+        connection.execute("COMMIT")
+        connection.close()
+        os.replace(f"{self.path}.part", self.path)
+
+    def insert_sql(self, layer, names):
+        """
+        Builds the prepared insert statement of a feature table.
+        :param layer: Feature table name
+        :param names: The attribute column names
+        :return: The SQL statement
+        """
+        column_sql = "".join(f", {quote(name)}" for name in names)
+        return f"INSERT INTO {quote(layer)} (geom{column_sql}) VALUES (?{', ?' * len(names)})"
+
+    def write_table(self, layer, table, x, y, srs_id):
+        """
+        Writes an AddressTable as a point layer.
+        :param layer: Feature table name
+        :param table: An AddressTable
+        :param x: The X coordinates to store, already in srs_id
+        :param y: The Y coordinates to store, already in srs_id
+        :param srs_id: EPSG code of x and y
+        :return: The number of points written
+        """
+        names = table.fieldnames
+        columns = [(name, "REAL" if name in ('X', 'Y') else "TEXT") for name in names]
+        bounds = (float(np.min(x)), float(np.min(y)), float(np.max(x)), float(np.max(y))) if len(table) else None
+
+        connection = self.create(layer, columns, "POINT", srs_id, bounds)
+        try:
+            sql = self.insert_sql(layer, names)
+            values = [table.column(name) for name in names]
+            for start in range(0, len(table), self.batch_size):
+                stop = start + self.batch_size
+                connection.executemany(sql, zip(point_blobs(x[start:stop], y[start:stop], srs_id),
+                                                *(column[start:stop] for column in values)))
+            self.finish(connection)
+        except Exception:
+            connection.close()
+            raise
+        return len(table)
+
+    def write_features(self, layer, features, srs_id):
+        """
+        Writes (geometry, properties) features as a layer.
+        :param layer: Feature table name
+        :param features: A list of (geometry, properties) tuples
+        :param srs_id: EPSG code of the geometries
+        :return: The number of features written
+        """
+        names = property_names(features)
+        columns = [(name, column_type([properties.get(name) for geometry, properties in features]))
+                   for name in names]
+
+        geometries = [geometry for geometry, properties in features]
+        types = {geometry.geom_type.upper() for geometry in geometries}
+        geometry_type = "POINT" if types == {"POINT"} else "GEOMETRY"
+        bounds = merge_bounds(None, geometries) if geometries else None
+
+        connection = self.create(layer, columns, geometry_type, srs_id, bounds)
+        try:
+            sql = self.insert_sql(layer, names)
+            for start in range(0, len(features), self.batch_size):
+                batch = features[start:start + self.batch_size]
+                blobs = geometry_blobs([geometry for geometry, properties in batch], srs_id)
+                connection.executemany(sql, ([blob] + [properties.get(name) for name in names]
+                                             for blob, (geometry, properties) in zip(blobs, batch)))
+            self.finish(connection)
+        except Exception:
+            connection.close()
+            raise
+        return len(features)
+
+    def write_batches(self, layer, batches, srs_id):
+        """
+        Writes features that arrive in batches, holding only one batch in memory at a time. The columns and their
+        types are taken from the first batch, so properties that only appear in later batches are not stored.
+        :param layer: Feature table name
+        :param batches: An iterable of lists of (geometry, properties) tuples
+        :param srs_id: EPSG code of the geometries
+        :return: The number of features written
+        """
+        batches = iter(batches)
+        first_batch = next(batches, [])
+        names = property_names(first_batch)
+        columns = [(name, column_type([properties.get(name) for geometry, properties in first_batch]))
+                   for name in names]
+
+        count = 0
+        bounds = None
+        connection = self.create(layer, columns, "GEOMETRY", srs_id, None)
+        try:
+            sql = self.insert_sql(layer, names)
+            for batch in itertools.chain([first_batch], batches):
+                if not batch:
+                    continue
+                geometries = [geometry for geometry, properties in batch]
+                blobs = geometry_blobs(geometries, srs_id)
+                connection.executemany(sql, ([blob] + [properties.get(name) for name in names]
+                                             for blob, (geometry, properties) in zip(blobs, batch)))
+                bounds = merge_bounds(bounds, geometries)
+                count += len(batch)
+
+            if bounds is not None:
+                connection.execute("UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? "
+                                   "WHERE table_name = ?", bounds + (layer,))
+            self.finish(connection)
+        except Exception:
+            connection.close()
+            raise
+        return count
+
+    def apply_changes(self, key_field, updates, inserts, deletes, srs_id):
+        """
+        Updates, inserts and deletes features of the feature table in place, matching them on a key column, so the
+        cost follows the number of changes rather than the size of the layer. The key column is indexed the first
+        time. The changes are committed together.
+        :param key_field: The attribute column that identifies a feature
+        :param updates: A list of (geometry, properties) tuples replacing the features with the same key
+        :param inserts: A list of (geometry, properties) tuples to add
+        :param deletes: A list of the keys of the features to remove
+        :param srs_id: EPSG code of the geometries
+        :return: The number of features in the table afterwards
+        """
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            layer = self.feature_table(connection)
+            names = [row[1] for row in connection.execute(f"PRAGMA table_info({quote(layer)})")
+                     if row[1] not in ('fid', 'geom')]
+            if key_field not in names:
+                raise ValueError(f"{self.path} has no {key_field} column")
+
+            connection.execute("BEGIN")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {quote(f'{layer}_{key_field}')} "
+                               f"ON {quote(layer)} ({quote(key_field)})")
+
+            connection.executemany(f"DELETE FROM {quote(layer)} WHERE {quote(key_field)} = ?",
+                                   ([key] for key in deletes))
+
+            set_sql = "".join(f", {quote(name)} = ?" for name in names)
+            update_sql = f"UPDATE {quote(layer)} SET geom = ?{set_sql} WHERE {quote(key_field)} = ?"
+            blobs = geometry_blobs([geometry for geometry, properties in updates], srs_id) if updates else []
+            connection.executemany(update_sql, ([blob] + [properties.get(name) for name in names] +
+                                                [properties.get(key_field)]
+                                                for blob, (geometry, properties) in zip(blobs, updates)))
+
+            blobs = geometry_blobs([geometry for geometry, properties in inserts], srs_id) if inserts else []
+            connection.executemany(self.insert_sql(layer, names),
+                                   ([blob] + [properties.get(name) for name in names]
+                                    for blob, (geometry, properties) in zip(blobs, inserts)))
+
+            # The extent only grows; a deleted feature at the edge leaves it larger than it needs to be
+            changed = [geometry for geometry, properties in updates + inserts]
+            if changed:
+                bounds = connection.execute("SELECT min_x, min_y, max_x, max_y FROM gpkg_contents "
+                                            "WHERE table_name = ?", (layer,)).fetchone()
+                bounds = merge_bounds(None if None in bounds else bounds, changed)
+                connection.execute("UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ?, "
+                                   "last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now') WHERE table_name = ?",
+                                   tuple(bounds) + (layer,))
+
+            count = connection.execute(f"SELECT COUNT(*) FROM {quote(layer)}").fetchone()[0]
+            connection.execute("COMMIT")
+            return count
+        except Exception:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    @staticmethod
+    def feature_table(connection):
+        """
+        Finds the feature table of the GeoPackage.
+        :param connection: An open sqlite3 connection
+        :return: The table name
+        """
+        return connection.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features' "
+                                  "LIMIT 1").fetchone()[0]
+
+    def read_features(self):
+        """
+        Reads the features of the first feature table.
+        :param: None
+        :return: A list of (geometry, properties) tuples
+        """
+        connection = sqlite3.connect(self.path)
+        try:
+            layer, geometry_column = connection.execute(
+                "SELECT c.table_name, g.column_name FROM gpkg_contents c JOIN gpkg_geometry_columns g "
+                "ON c.table_name = g.table_name WHERE c.data_type = 'features' LIMIT 1").fetchone()
+            cursor = connection.execute(f"SELECT * FROM {quote(layer)}")
+            names = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            connection.close()
+
+        geometry_index = names.index(geometry_column)
+        attribute_indexes = [i for i, name in enumerate(names) if name not in ('fid', geometry_column)]
+        geometries = parse_blobs([row[geometry_index] for row in rows if row[geometry_index] is not None])
+        present = [row for row in rows if row[geometry_index] is not None]
+        return [(geometry, {names[i]: row[i] for i in attribute_indexes}) for geometry, row in zip(geometries, present)]
@@ -0,0 +1,155 @@
+"""
+This module contains the GeocodeCache class, a persistent SQLite cache that sits in front of the web geocoding
+service. Entries are keyed on the normalized address and the geocoder benchmark, misses are stored as negative
+entries, and the cache supports a time to live and a size cap with least recently used eviction.
+"""
+
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodeCache:
+    """
+    A class to represent a persistent, on-disk cache of geocoding results.
+    """
+
+    def __init__(self, db_path, benchmark="", ttl_days=None, max_entries=None):
+        """
+        Opens (or creates) the cache database.
+        :param db_path: Path to the SQLite cache file
+        :param benchmark: The default geocoder benchmark (suffix url), used as part of the cache key
+        :param ttl_days: Number of days an entry stays valid, None to never expire
+        :param max_entries: Maximum number of entries to keep, None for no limit
+        :return: None
+        """
+        self.benchmark = benchmark or ""
+        self.ttl_seconds = float(ttl_days) * 86400 if ttl_days else None
+        self.max_entries = int(max_entries) if max_entries else None
+        self.hits = 0
+        self.misses = 0
+
+        # The geocoder may call the cache from several worker threads
+        self._lock = threading.Lock()
+        # Another process writing to the cache makes this one wait for the lock instead of failing at once
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            "address TEXT NOT NULL, benchmark TEXT NOT NULL, x REAL, y REAL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (address, benchmark))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)")
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config_dict):
+        """
+        Opens geocode_cache.sqlite under proj_dir with the geocode_cache_* keys of the configuration dictionary.
+        :param config_dict: A dictionary containing configuration settings
+        :return: A GeocodeCache
+        """
+        return cls(f"{config_dict.get('proj_dir')}geocode_cache.sqlite", config_dict.get('geocoder_suffix_url'),
+                   config_dict.get('geocode_cache_ttl_days'), config_dict.get('geocode_cache_max_entries'))
+
+    @staticmethod
+    def normalize(address):
+        """
+        Normalizes an address so that trivial differences in case and spacing share a cache entry.
+        :param address: The one line address
+        :return: The normalized address
+        """
+        return " ".join(address.upper().replace(",", " ").split())
+
+    def get(self, address, benchmark=None):
+        """
+        Looks up an address in the cache.
+        :param address: The one line address
+        :param benchmark: The benchmark the address is geocoded with, the cache's own by default
+        :return: A (found, coordinates) tuple. coordinates is an (x, y) tuple, or None for a cached miss
+        """
+        key = self.normalize(address)
+        benchmark = self.benchmark if benchmark is None else benchmark
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute("SELECT x, y, created FROM geocode WHERE address = ? AND benchmark = ?",
+                                     (key, benchmark)).fetchone()
+
+            if row is None or (self.ttl_seconds is not None and now - row[2] > self.ttl_seconds):
+                self.misses += 1
+                return False, None
+
+            self._conn.execute("UPDATE geocode SET last_used = ? WHERE address = ? AND benchmark = ?",
+                               (now, key, benchmark))
+            self.hits += 1
+
+        if row[0] is None:
+            return True, None
+        return True, (row[0], row[1])
+
+    def put(self, address, coordinates, benchmark=None):
+        """
+        Stores a geocoding result in the cache.
+        :param address: The one line address
+        :param coordinates: An (x, y) tuple, or None to store a negative entry
+        :param benchmark: The benchmark the address was geocoded with, the cache's own by default
+        :return: None
+        """
+        x, y = coordinates if coordinates is not None else (None, None)
+        benchmark = self.benchmark if benchmark is None else benchmark
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)",
+                               (self.normalize(address), benchmark, x, y, now, now))
+
+    def commit(self):
+        """
+        Commits the entries stored so far, so a stopped run keeps them and other connections are not kept waiting.
+        :param: None
+        :return: None
+        """
+        with self._lock:
+            self._conn.commit()
+
+    def evict(self):
+        """
+        Removes expired entries and, if the cache is over its size cap, the least recently used entries.
+        :param: None
+        :return: Number of entries removed
+        """
+        removed = 0
+
+        with self._lock:
+            if self.ttl_seconds is not None:
+                removed += self._conn.execute("DELETE FROM geocode WHERE created < ?",
+                                              (time.time() - self.ttl_seconds,)).rowcount
+
+            if self.max_entries is not None:
+                count = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+                if count > self.max_entries:
+                    removed += self._conn.execute(
+                        "DELETE FROM geocode WHERE rowid IN "
+                        "(SELECT rowid FROM geocode ORDER BY last_used LIMIT ?)",
+                        (count - self.max_entries,)).rowcount
+
+            self._conn.commit()
+
+        return removed
+
+    def close(self):
+        """
+        Applies eviction, commits and closes the cache database.
+        :param: None
+        :return: None
+        """
+        removed = self.evict()
+        logger.debug("Geocode cache evicted %s entries", removed)
+
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,946 @@
+"""
+This module contains the geometry backends used by finalproject.py. The GeometryBackend superclass describes the
+analysis operations the risk-zone workflow needs. ArcpyBackend runs them with arcpy against the file geodatabase,
+and ShapelyBackend runs them with Shapely/GEOS against GeoJSON files so the analysis can run headless on Linux.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import itertools
+from Etl.GeoPackage import GeoPackage
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+try:
+    import shapely
+    from shapely.geometry import shape, mapping
+    from shapely.ops import unary_union
+    from shapely.prepared import prep
+    import numpy as np
+except ImportError:
+    shapely = None
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+logger = logging.getLogger(__name__)
+
+
+# Length of each linear unit in meters, used to turn arcpy style distances such as "1500 Feet" into data units
+LINEAR_UNITS = {
+    "meter": 1.0,
+    "meters": 1.0,
+    "kilometer": 1000.0,
+    "kilometers": 1000.0,
+    "foot": 0.3048,
+    "feet": 0.3048,
+    "ussurveyfoot": 1200.0 / 3937.0,
+    "ussurveyfeet": 1200.0 / 3937.0,
+    "footus": 1200.0 / 3937.0,
+    "yard": 0.9144,
+    "yards": 0.9144,
+    "mile": 1609.344,
+    "miles": 1609.344,
+}
+
+# Feature class shape type of each GeoJSON geometry type
+ARCPY_SHAPE_TYPES = {
+    "Point": "POINT",
+    "MultiPoint": "MULTIPOINT",
+    "LineString": "POLYLINE",
+    "MultiLineString": "POLYLINE",
+    "Polygon": "POLYGON",
+    "MultiPolygon": "POLYGON",
+}
+
+
+def parse_distance(distance, data_unit="Feet"):
+    """
+    Converts an arcpy style linear distance to the linear unit of the data.
+    :param distance: A distance such as "1500 Feet", "2 Miles" or "300" (already in data units)
+    :param data_unit: The linear unit of the data's coordinate system
+    :return: The distance in data units
+    """
+    parts = str(distance).split()
+    if len(parts) == 1:
+        return float(parts[0])
+
+    unit = "".join(parts[1:]).lower().replace("_", "")
+    return float(parts[0]) * LINEAR_UNITS[unit] / LINEAR_UNITS[data_unit.lower().replace("_", "")]
+
+
+class GeometryBackend:
+    """
+    A class to represent the analysis operations of the West Nile Virus workflow.
+    """
+
+    # Whether the backend can add layers to the ArcGIS Pro map and export it
+    has_map = False
+
+    def __init__(self, config_dict):
+        """
+        Initializes the object with a configuration dictionary.
+        :param config_dict: A dictionary containing configuration settings
+        :return: None
+        """
+        self.config_dict = config_dict
+
+    def scratch_name(self, layer):
+        """
+        Gets the name to use for an intermediate layer. When the scratch_workspace config key is memory,
+        intermediates are kept in memory instead of being written to disk.
+        :param layer: Layer name
+        :return: The layer name in the scratch workspace
+        """
+        return layer
+
+    def exists(self, layer):
+        """
+        Checks whether a layer exists.
+        :param layer: Layer name
+        :return: True if the layer exists
+        """
+        raise NotImplementedError
+
+    def delete(self, layer):
+        """
+        Deletes a layer.
+        :param layer: Layer name
+        :return: None
+        """
+        raise NotImplementedError
+
+    def buffer(self, in_layer, out_layer, distance):
+        """
+        Buffers a layer and dissolves the result into a single feature.
+        :param in_layer: Layer to buffer
+        :param out_layer: Output layer name
+        :param distance: Linear distance such as "1500 Feet"
+        :return: None
+        """
+        raise NotImplementedError
+
+    def intersect(self, in_layers, out_layer):
+        """
+        Intersects several polygon layers.
+        :param in_layers: List of layer names
+        :param out_layer: Output layer name
+        :return: None
+        """
+        raise NotImplementedError
+
+    def erase(self, in_layer, erase_layer, out_layer):
+        """
+        Removes the areas of erase_layer from in_layer.
+        :param in_layer: Layer to erase from
+        :param erase_layer: Layer with the areas to remove
+        :param out_layer: Output layer name
+        :return: None
+        """
+        raise NotImplementedError
+
+    def spatial_join(self, target_layer, join_layer, out_layer):
+        """
+        Joins join_layer onto target_layer, adding a Join_Count field to every target feature.
+        :param target_layer: Layer whose features are kept
+        :param join_layer: Layer joined onto the target features
+        :param out_layer: Output layer name
+        :return: None
+        """
+        raise NotImplementedError
+
+    def count_within(self, target_layer, within_layer):
+        """
+        Counts the features of target_layer that are within within_layer.
+        :param target_layer: Layer to count
+        :param within_layer: Polygon layer
+        :return: The number of features within
+        """
+        raise NotImplementedError
+
+    def select_joined(self, joined_layer, out_layer):
+        """
+        Copies the features of a spatial join output that joined exactly one feature.
+        :param joined_layer: Output of spatial_join
+        :param out_layer: Output layer name
+        :return: None
+        """
+        raise NotImplementedError
+
+    def classify_addresses(self, address_layer, zone_layer, out_layer):
+        """
+        Classifies every address against the risk zones and writes the addresses that fall in exactly one zone
+        to out_layer. Backends without a spatial index fall back to a spatial join, a count and a selection.
+        :param address_layer: Address point layer
+        :param zone_layer: Risk zone polygon layer
+        :param out_layer: Output layer name for the target addresses
+        :return: A (joined, notified) tuple with the number of addresses that touch a zone and the number
+        that are within a zone
+        """
+        self.spatial_join(address_layer, zone_layer, "joined_addresses")
+        notified = self.count_within("joined_addresses", zone_layer)
+        self.select_joined("joined_addresses", out_layer)
+        return self.count_joined("joined_addresses"), notified
+
+    def count_joined(self, joined_layer):
+        """
+        Counts the features of a spatial join output that joined at least one feature.
+        :param joined_layer: Output of spatial_join
+        :return: The number of joined features
+        """
+        raise NotImplementedError
+
+    def buffer_isolated(self, in_layer, out_layer, distance, scratch_dir):
+        """
+        Buffers a layer inside a worker process without touching outputs other workers may be writing.
+        :param in_layer: Layer to buffer
+        :param out_layer: Output layer name
+        :param distance: Linear distance such as "1500 Feet"
+        :param scratch_dir: A directory the worker may use for its own scratch workspace
+        :return: The path of the buffered output, to pass to import_buffer
+        """
+        raise NotImplementedError
+
+    def import_buffer(self, path, out_layer):
+        """
+        Brings a buffer made by buffer_isolated into the main workspace.
+        :param path: The path returned by buffer_isolated
+        :param out_layer: Output layer name
+        :return: None
+        """
+        raise NotImplementedError
+
+    def fingerprint(self, layer):
+        """
+        Hashes the contents of a layer so the step cache can tell when it has changed.
+        :param layer: Layer name
+        :return: A hex digest of the layer's geometries and attributes
+        """
+        raise NotImplementedError
+
+    def save_layer(self, layer, entry_dir):
+        """
+        Copies a layer into a step cache entry directory.
+        :param layer: Layer name
+        :param entry_dir: The cache entry directory
+        :return: None
+        """
+        raise NotImplementedError
+
+    def restore_layer(self, entry_dir, layer):
+        """
+        Copies a layer saved by save_layer back into the workspace.
+        :param entry_dir: The cache entry directory
+        :param layer: Layer name
+        :return: None
+        """
+        raise NotImplementedError
+
+    def read_geometries(self, layer):
+        """
+        Reads the geometries of a layer as shapely geometries.
+        :param layer: Layer name
+        :return: A list of shapely geometries
+        """
+        raise NotImplementedError
+
+    def linear_unit(self, layer):
+        """
+        Gets the linear unit of a layer's coordinate system, used to convert buffer distances.
+        :param layer: Layer name
+        :return: A linear unit name such as "Feet"
+        """
+        raise NotImplementedError
+
+    def read_points(self, layer, field, epsg=4326):
+        """
+        Reads a text field and the point coordinates of a layer, projected to the given coordinate system.
+        :param layer: Point layer name
+        :param field: Name of the text field to read
+        :param epsg: The EPSG code of the coordinates to return, WGS 1984 like the web geocoder by default
+        :return: A generator of (text, x, y) tuples
+        """
+        raise NotImplementedError
+
+    def stamp(self, layer):
+        """
+        Builds a cheap marker that changes when a layer is edited. Unlike fingerprint it does not read the
+        features, so it may miss an edit that keeps the feature count and extent.
+        :param layer: Layer name
+        :return: A string
+        """
+        raise NotImplementedError
+
+    def write_batches(self, layer, batches, epsg=4326, out_epsg=None):
+        """
+        Writes features that arrive in batches to a layer, replacing it if it exists, with only one batch in
+        memory at a time. The fields are taken from the first batch.
+        :param layer: Layer name
+        :param batches: An iterable of lists of (GeoJSON geometry dictionary, properties) tuples
+        :param epsg: The EPSG code of the geometries
+        :param out_epsg: The EPSG code of the layer, by default geojson_epsg for the shapely backend and epsg for
+        arcpy
+        :return: The number of features written
+        """
+        raise NotImplementedError
+
+
+def build_index(zones):
+    """
+    Builds an STR-tree over zone polygons so points are only tested against zones whose bounding box they hit.
+    :param zones: A list of shapely polygons
+    :return: A shapely STRtree
+    """
+    return shapely.STRtree(zones)
+
+
+def classify_points(points, zones):
+    """
+    Classifies points against zone polygons in a single indexed pass.
+    :param points: A list of shapely points
+    :param zones: A list of shapely polygons
+    :return: A (join_counts, within) tuple of NumPy arrays, the number of zones each point intersects and
+    whether each point is within a zone
+    """
+    tree = build_index(zones)
+    join_counts = np.zeros(len(points), dtype=np.int64)
+    within = np.zeros(len(points), dtype=bool)
+    if not points or not zones:
+        return join_counts, within
+
+    # query returns [point index, zone index] pairs, and only tests the exact predicate on bounding box hits
+    point_index, zone_index = tree.query(points, predicate="intersects")
+    np.add.at(join_counts, point_index, 1)
+    within[tree.query(points, predicate="within")[0]] = True
+    return join_counts, within
+
+
+class ArcpyBackend(GeometryBackend):
+    """
+    A class to represent the analysis operations run with arcpy against the file geodatabase.
+    """
+
+    has_map = True
+
+    def __init__(self, config_dict):
+        """
+        Initializes the object and sets the arcpy workspace.
+        :param config_dict: A dictionary containing configuration settings
+        :return: None
+        """
+        super().__init__(config_dict)
+        arcpy.env.workspace = fr"{config_dict.get('proj_dir')}WestNileOutbreak.gdb"
+        arcpy.env.overwriteOutput = True
+
+    def scratch_name(self, layer):
+        if self.config_dict.get('scratch_workspace') == 'memory':
+            return f"memory\\{layer}"
+        return layer
+
+    def exists(self, layer):
+        return arcpy.Exists(layer)
+
+    def delete(self, layer):
+        arcpy.Delete_management(layer)
+
+    def buffer(self, in_layer, out_layer, distance):
+        arcpy.analysis.Buffer(in_layer, out_layer, distance, "FULL", "ROUND", "All")
+
+    def intersect(self, in_layers, out_layer):
+        arcpy.Intersect_analysis(in_layers, out_layer)
+
+    def erase(self, in_layer, erase_layer, out_layer):
+        arcpy.analysis.Erase(in_layer, erase_layer, out_layer)
+
+    def spatial_join(self, target_layer, join_layer, out_layer):
+        arcpy.analysis.SpatialJoin(target_layer, join_layer, out_layer)
+
+    def count_within(self, target_layer, within_layer):
+        # Feature layer names cannot contain the memory\ workspace prefix
+        feature_layer = f"{target_layer.split(chr(92))[-1]}_layer"
+        arcpy.management.MakeFeatureLayer(target_layer, feature_layer)
+        arcpy.management.SelectLayerByLocation(feature_layer, "WITHIN", within_layer)
+        return int(arcpy.GetCount_management(feature_layer).getOutput(0))
+
+    def select_joined(self, joined_layer, out_layer):
+        feature_layer = f"{joined_layer.split(chr(92))[-1]}_layer"
+        arcpy.management.MakeFeatureLayer(joined_layer, feature_layer)
+        arcpy.management.SelectLayerByAttribute(feature_layer, "NEW_SELECTION", "Join_Count = 1")
+        arcpy.management.CopyFeatures(feature_layer, out_layer)
+
+    def count_joined(self, joined_layer):
+        feature_layer = f"{joined_layer.split(chr(92))[-1]}_layer"
+        arcpy.management.MakeFeatureLayer(joined_layer, feature_layer, "Join_Count >= 1")
+        return int(arcpy.GetCount_management(feature_layer).getOutput(0))
+
+    def classify_addresses(self, address_layer, zone_layer, out_layer):
+        if shapely is None:
+            return super().classify_addresses(address_layer, zone_layer, out_layer)
+
+        # Both cursors read in the address layer's coordinate system, so points and zones are compared alike
+        spatial_reference = arcpy.Describe(address_layer).spatialReference
+        with arcpy.da.SearchCursor(zone_layer, ["SHAPE@WKB"], spatial_reference=spatial_reference) as cursor:
+            zones = [shapely.from_wkb(bytes(row[0])) for row in cursor]
+        tree = build_index(zones)
+
+        # One pass over the addresses classifies each point and copies the targets into out_layer. The output has
+        # the Join_Count and TARGET_FID fields of a SpatialJoin output, but not the zone layer's fields
+        fields = [field.name for field in arcpy.ListFields(address_layer)
+                  if field.type not in ("OID", "Geometry") and field.editable]
+        arcpy.management.CreateFeatureclass(arcpy.env.workspace, out_layer, "POINT", address_layer,
+                                            spatial_reference=spatial_reference)
+        arcpy.management.AddField(out_layer, "Join_Count", "LONG")
+        arcpy.management.AddField(out_layer, "TARGET_FID", "LONG")
+        joined = 0
+        notified = 0
+        with arcpy.da.SearchCursor(address_layer, ["OID@", "SHAPE@XY"] + fields,
+                                   spatial_reference=spatial_reference) as search_cursor, \
+                arcpy.da.InsertCursor(out_layer, ["SHAPE@XY", "Join_Count", "TARGET_FID"] + fields) as insert_cursor:
+            for row in search_cursor:
+                point = shapely.Point(row[1])
+                hits = [zones[i] for i in tree.query(point, predicate="intersects")]
+                if not hits:
+                    continue
+                joined += 1
+                if any(zone.contains(point) for zone in hits):
+                    notified += 1
+                if len(hits) == 1:
+                    insert_cursor.insertRow([row[1], 1, row[0]] + list(row[2:]))
+
+        return joined, notified
+
+    def buffer_isolated(self, in_layer, out_layer, distance, scratch_dir):
+        # Each worker writes to its own scratch geodatabase so workers never lock the project geodatabase
+        arcpy.management.CreateFileGDB(scratch_dir, f"{out_layer}.gdb")
+        scratch_path = os.path.join(scratch_dir, f"{out_layer}.gdb", out_layer)
+        arcpy.analysis.Buffer(os.path.join(arcpy.env.workspace, in_layer), scratch_path, distance,
+                              "FULL", "ROUND", "All")
+        return scratch_path
+
+    def import_buffer(self, path, out_layer):
+        arcpy.management.CopyFeatures(path, out_layer)
+
+    def fingerprint(self, layer):
+        digest = hashlib.sha256()
+        fields = [field.name for field in arcpy.ListFields(layer) if field.type not in ("OID", "Geometry")]
+        with arcpy.da.SearchCursor(layer, ["SHAPE@WKB"] + fields) as cursor:
+            for row in cursor:
+                digest.update(bytes(row[0] or b""))
+                digest.update(repr(row[1:]).encode("utf-8"))
+        return digest.hexdigest()
+
+    def save_layer(self, layer, entry_dir):
+        if not arcpy.Exists(os.path.join(entry_dir, "layers.gdb")):
+            arcpy.management.CreateFileGDB(entry_dir, "layers.gdb")
+        arcpy.management.CopyFeatures(layer, os.path.join(entry_dir, "layers.gdb", layer.split("\\")[-1]))
+
+    def restore_layer(self, entry_dir, layer):
+        arcpy.management.CopyFeatures(os.path.join(entry_dir, "layers.gdb", layer.split("\\")[-1]), layer)
+
+    def read_geometries(self, layer):
+        with arcpy.da.SearchCursor(layer, ["SHAPE@WKB"]) as cursor:
+            return [shapely.from_wkb(bytes(row[0])) for row in cursor]
+
+    def linear_unit(self, layer):
+        return arcpy.Describe(layer).spatialReference.linearUnitName
+
+    def read_points(self, layer, field, epsg=4326):
+        spatial_reference = arcpy.SpatialReference(epsg)
+        with arcpy.da.SearchCursor(layer, [field, "SHAPE@XY"], spatial_reference=spatial_reference) as cursor:
+            for text, (x, y) in cursor:
+                yield text, x, y
+
+    def stamp(self, layer):
+        extent = arcpy.Describe(layer).extent
+        return f"{arcpy.management.GetCount(layer)[0]} {extent.XMin} {extent.YMin} {extent.XMax} {extent.YMax}"
+
+    def write_batches(self, layer, batches, epsg=4326, out_epsg=None):
+        batches = iter(batches)
+        first_batch = next(batches, [])
+        in_reference = arcpy.SpatialReference(epsg)
+        out_reference = arcpy.SpatialReference(int(out_epsg or epsg))
+        shape_type = ARCPY_SHAPE_TYPES.get(first_batch[0][0].get("type"), "POLYGON") if first_batch else "POINT"
+
+        names = list(dict.fromkeys(name for geometry, properties in first_batch for name in properties))
+        fields = [arcpy.ValidateFieldName(name, arcpy.env.workspace) for name in names]
+        arcpy.management.Delete(layer)
+        arcpy.management.CreateFeatureclass(arcpy.env.workspace, layer, shape_type, spatial_reference=out_reference)
+        for name, field in zip(names, fields):
+            values = [properties.get(name) for geometry, properties in first_batch]
+            numeric = all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                          for value in values if value is not None)
+            if numeric and any(value is not None for value in values):
+                arcpy.management.AddField(layer, field, "DOUBLE")
+            else:
+                arcpy.management.AddField(layer, field, "TEXT", field_length=255)
+
+        count = 0
+        with arcpy.da.InsertCursor(layer, ["SHAPE@"] + fields) as cursor:
+            for batch in itertools.chain([first_batch], batches):
+                for geometry, properties in batch:
+                    feature_shape = arcpy.FromWKB(arcpy.AsShape(geometry).WKB, in_reference)
+                    if out_reference.factoryCode != in_reference.factoryCode:
+                        feature_shape = feature_shape.projectAs(out_reference)
+                    cursor.insertRow([feature_shape] + [properties.get(name) for name in names])
+                    count += 1
+        return count
+
+
+class ShapelyBackend(GeometryBackend):
+    """
+    A class to represent the analysis operations run with Shapely/GEOS against GeoJSON files. Every layer is a
+    <layer name>.geojson file in the geojson_dir directory, in a projected coordinate system whose linear unit is
+    geojson_linear_unit. With the layer_format config key set to gpkg, layers are written as <layer name>.gpkg
+    GeoPackage files instead; either kind is read. Layers named memory/<layer name> are scratch layers kept in
+    memory.
+    """
+
+    def __init__(self, config_dict):
+        """
+        Initializes the object and creates the GeoJSON directory.
+        :param config_dict: A dictionary containing configuration settings
+        :return: None
+        """
+        super().__init__(config_dict)
+        if shapely is None:
+            raise ImportError("The shapely geometry backend needs the shapely package")
+
+        self.data_dir = config_dict.get('geojson_dir') or os.path.join(config_dict.get('proj_dir'), "geojson")
+        self.linear_unit_name = config_dict.get('geojson_linear_unit', "Feet")
+        self.layer_format = config_dict.get('layer_format') or "geojson"
+        if self.layer_format not in ("geojson", "gpkg"):
+            raise ValueError(f"Unknown layer format {self.layer_format}")
+        self.batch_size = int(config_dict.get('load_batch_size', 10000))
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        # Scratch layers, keyed on their lower case name
+        self.memory = {}
+
+    @staticmethod
+    def is_memory(layer):
+        """
+        Checks whether a layer is a scratch layer kept in memory.
+        :param layer: Layer name
+        :return: True for scratch layers
+        """
+        return layer.lower().startswith("memory/")
+
+    def output_path(self, layer):
+        """
+        Builds the path a layer is written to, in the configured layer format. Geodatabase names are not case
+        sensitive, so neither are these.
+        :param layer: Layer name
+        :return: The path to the GeoJSON or GeoPackage file
+        """
+        return os.path.join(self.data_dir, f"{layer.lower()}.{self.layer_format}")
+
+    def layer_path(self, layer):
+        """
+        Finds the file of a layer, in the configured layer format if it exists in both.
+        :param layer: Layer name
+        :return: The path to the GeoJSON or GeoPackage file
+        """
+        path = self.output_path(layer)
+        if not os.path.exists(path):
+            other_format = "geojson" if self.layer_format == "gpkg" else "gpkg"
+            other_path = os.path.join(self.data_dir, f"{layer.lower()}.{other_format}")
+            if os.path.exists(other_path):
+                return other_path
+        return path
+
+    def replace_layer(self, layer, path):
+        """
+        Removes the file a layer had in the other format, so a rewritten layer is not shadowed by a stale one.
+        :param layer: Layer name
+        :param path: The path the layer was just written to
+        :return: None
+        """
+        for layer_format in ("geojson", "gpkg"):
+            old_path = os.path.join(self.data_dir, f"{layer.lower()}.{layer_format}")
+            if old_path != path and os.path.exists(old_path):
+                os.remove(old_path)
+
+    def srs_id(self):
+        """
+        Gets the EPSG code stored with GeoPackage layers.
+        :param: None
+        :return: The geojson_epsg config key, or -1 for an undefined coordinate system
+        """
+        epsg = self.config_dict.get('geojson_epsg')
+        return int(epsg) if epsg else -1
+
+    @staticmethod
+    def read_path(path):
+        """
+        Reads the features of a GeoJSON or GeoPackage file.
+        :param path: Path to the GeoJSON or GeoPackage file
+        :return: A list of (geometry, properties) tuples
+        """
+        if path.endswith(".gpkg"):
+            return GeoPackage(path).read_features()
+
+        with open(path) as layer_file:
+            collection = json.load(layer_file)
+        return [(shape(feature['geometry']), feature.get('properties') or {})
+                for feature in collection['features'] if feature.get('geometry')]
+
+    def write_path(self, path, features):
+        """
+        Writes features to a GeoJSON or GeoPackage file, replacing it if it exists.
+        :param path: Path to the GeoJSON or GeoPackage file
+        :param features: An iterable of (geometry, properties) tuples
+        :return: None
+        """
+        if path.endswith(".gpkg"):
+            layer = os.path.splitext(os.path.basename(path))[0]
+            GeoPackage(path, self.batch_size).write_features(layer, list(features), self.srs_id())
+            return
+
+        collection = {"type": "FeatureCollection",
+                      "features": [{"type": "Feature", "geometry": mapping(geometry), "properties": properties}
+                                   for geometry, properties in features]}
+        # json.dump encodes in Python, one chunk at a time; json.dumps uses the C encoder
+        with open(f"{path}.part", "w") as layer_file:
+            layer_file.write(json.dumps(collection))
+        os.replace(f"{path}.part", path)
+
+    def read(self, layer):
+        """
+        Reads the features of a layer.
+        :param layer: Layer name
+        :return: A list of (geometry, properties) tuples
+        """
+        if self.is_memory(layer):
+            return list(self.memory[layer.lower()])
+        return self.read_path(self.layer_path(layer))
+
+    def write(self, layer, features):
+        """
+        Writes features to a layer, replacing it if it exists.
+        :param layer: Layer name
+        :param features: An iterable of (geometry, properties) tuples
+        :return: None
+        """
+        if self.is_memory(layer):
+            self.memory[layer.lower()] = list(features)
+            return
+        path = self.output_path(layer)
+        self.write_path(path, features)
+        self.replace_layer(layer, path)
+
+    def write_points(self, layer, rows, epsg=4326):
+        """
+        Writes rows with X and Y columns as a point layer, projecting them to geojson_epsg when pyproj is installed.
+        :param layer: Layer name
+        :param rows: An iterable of row dictionaries with X and Y
+        :param epsg: The EPSG code of the X and Y columns
+        :return: The number of points written
+        """
+        features = self.point_features(rows, epsg)
+        self.write(layer, features)
+        return len(features)
+
+    def apply_point_changes(self, layer, key_field, updates, inserts, deletes, epsg=4326):
+        """
+        Applies changed rows with X and Y columns to a point layer, matching features on a key field. A GeoPackage
+        layer is changed in place with keyed SQL statements; any other layer is read and written again.
+        :param layer: Layer name
+        :param key_field: The field that identifies a feature
+        :param updates: A list of row dictionaries replacing the features with the same key
+        :param inserts: A list of row dictionaries to add
+        :param deletes: A list of the keys of the features to remove
+        :param epsg: The EPSG code of the X and Y columns
+        :return: The number of features in the layer
+        """
+        updated = self.point_features(updates, epsg)
+        inserted = self.point_features(inserts, epsg)
+
+        path = self.layer_path(layer)
+        if not self.is_memory(layer) and path.endswith(".gpkg"):
+            return GeoPackage(path, self.batch_size).apply_changes(key_field, updated, inserted, deletes,
+                                                                   self.srs_id())
+
+        replaced = {properties[key_field]: (geometry, properties) for geometry, properties in updated}
+        deleted = set(deletes)
+        features = [replaced.get(properties.get(key_field), (geometry, properties))
+                    for geometry, properties in self.read(layer) if properties.get(key_field) not in deleted]
+        features.extend(inserted)
+        self.write(layer, features)
+        return len(features)
+
+    def point_features(self, rows, epsg=4326):
+        """
+        Turns rows with X and Y columns into point features projected to geojson_epsg.
+        :param rows: An iterable of row dictionaries with X and Y
+        :param epsg: The EPSG code of the X and Y columns
+        :return: A list of (geometry, properties) tuples
+        """
+        transformer = None
+        target_epsg = self.config_dict.get('geojson_epsg')
+        if target_epsg and int(target_epsg) != epsg:
+            if pyproj is None:
+                raise ImportError("Projecting points to geojson_epsg needs the pyproj package")
+            transformer = pyproj.Transformer.from_crs(epsg, int(target_epsg), always_xy=True)
+
+        features = []
+        for row in rows:
+            x, y = float(row['X']), float(row['Y'])
+            if transformer is not None:
+                x, y = transformer.transform(x, y)
+            features.append((shapely.Point(x, y), dict(row)))
+        return features
+
+    def write_table(self, layer, table, epsg=4326):
+        """
+        Writes an AddressTable as a point layer. The coordinate columns are projected and turned into points as
+        whole arrays.
+        :param layer: Layer name
+        :param table: An AddressTable
+        :param epsg: The EPSG code of the X and Y columns
+        :return: The number of points written
+        """
+        x, y = table.x, table.y
+        target_epsg = self.config_dict.get('geojson_epsg')
+        if target_epsg and int(target_epsg) != epsg:
+            if pyproj is None:
+                raise ImportError("Projecting points to geojson_epsg needs the pyproj package")
+            x, y = pyproj.Transformer.from_crs(epsg, int(target_epsg), always_xy=True).transform(x, y)
+
+        if self.layer_format == "gpkg" and not self.is_memory(layer):
+            # The columns go straight into the GeoPackage without building a point or a dictionary per row
+            path = self.output_path(layer)
+            GeoPackage(path, self.batch_size).write_table(layer.lower(), table, np.asarray(x), np.asarray(y),
+                                                          self.srs_id())
+            self.replace_layer(layer, path)
+            return len(table)
+
+        self.write(layer, zip(shapely.points(x, y).tolist(), table.rows()))
+        return len(table)
+
+    def scratch_name(self, layer):
+        if self.config_dict.get('scratch_workspace') == 'memory':
+            return f"memory/{layer}"
+        return layer
+
+    def exists(self, layer):
+        if self.is_memory(layer):
+            return layer.lower() in self.memory
+        return os.path.exists(self.layer_path(layer))
+
+    def delete(self, layer):
+        if self.is_memory(layer):
+            del self.memory[layer.lower()]
+            return
+        os.remove(self.layer_path(layer))
+
+    def buffer(self, in_layer, out_layer, distance):
+        distance = parse_distance(distance, self.linear_unit_name)
+        dissolved = unary_union([geometry.buffer(distance) for geometry, properties in self.read(in_layer)])
+        self.write(out_layer, [(dissolved, {})])
+
+    def intersect(self, in_layers, out_layer):
+        # Intersect every feature of the running result with the features of the next layer it overlaps. Each
+        # layer is read once, and its STR-tree finds the pairs whose envelopes overlap
+        result = self.read(in_layers[0])
+        for layer in in_layers[1:]:
+            others = self.read(layer)
+            if not result or not others:
+                result = []
+                continue
+
+            tree = shapely.STRtree([geometry for geometry, properties in others])
+            pairs = tree.query([geometry for geometry, properties in result], predicate="intersects")
+            # Keep the order of the nested loop over the result and then the layer
+            pairs = pairs[:, np.lexsort((pairs[1], pairs[0]))]
+            overlaps = shapely.intersection(np.array([result[i][0] for i in pairs[0]], dtype=object),
+                                            np.array([others[j][0] for j in pairs[1]], dtype=object))
+            result = [(overlap, {**result[i][1], **others[j][1]})
+                      for overlap, i, j in zip(overlaps.tolist(), pairs[0], pairs[1]) if not overlap.is_empty]
+        self.write(out_layer, result)
+
+    def erase(self, in_layer, erase_layer, out_layer):
+        erase_geometry = unary_union([geometry for geometry, properties in self.read(erase_layer)])
+        result = []
+        for geometry, properties in self.read(in_layer):
+            remaining = geometry.difference(erase_geometry)
+            if not remaining.is_empty:
+                result.append((remaining, properties))
+        self.write(out_layer, result)
+
+    def spatial_join(self, target_layer, join_layer, out_layer):
+        join_geometries = [prep(geometry) for geometry, properties in self.read(join_layer)]
+        result = []
+        for target_fid, (geometry, properties) in enumerate(self.read(target_layer), start=1):
+            join_count = sum(1 for join_geometry in join_geometries if join_geometry.intersects(geometry))
+            result.append((geometry, {"Join_Count": join_count, "TARGET_FID": target_fid, **properties}))
+        self.write(out_layer, result)
+
+    def count_within(self, target_layer, within_layer):
+        within_geometry = prep(
+            unary_union([geometry for geometry, properties in self.read(within_layer)]))
+        return sum(1 for geometry, properties in self.read(target_layer) if within_geometry.contains(geometry))
+
+    def select_joined(self, joined_layer, out_layer):
+        self.write(out_layer, [(geometry, properties) for geometry, properties in self.read(joined_layer)
+                               if properties.get("Join_Count") == 1])
+
+    def count_joined(self, joined_layer):
+        return sum(1 for geometry, properties in self.read(joined_layer) if properties.get("Join_Count", 0) >= 1)
+
+    def classify_addresses(self, address_layer, zone_layer, out_layer):
+        addresses = self.read(address_layer)
+        join_counts, within = classify_points([geometry for geometry, properties in addresses],
+                                              [geometry for geometry, properties in self.read(zone_layer)])
+
+        self.write(out_layer, [(geometry, {"Join_Count": 1, "TARGET_FID": target_fid, **properties})
+                               for target_fid, (geometry, properties) in enumerate(addresses, start=1)
+                               if join_counts[target_fid - 1] == 1])
+        return int((join_counts >= 1).sum()), int(within.sum())
+
+    def buffer_isolated(self, in_layer, out_layer, distance, scratch_dir):
+        # Scratch layers live in the worker's memory, so the worker hands its output back through a file
+        scratch_path = os.path.join(scratch_dir, f"{os.path.basename(self.output_path(out_layer))}")
+        self.buffer(in_layer, "memory/buffer", distance)
+        self.write_path(scratch_path, self.read("memory/buffer"))
+        return scratch_path
+
+    def import_buffer(self, path, out_layer):
+        self.write(out_layer, self.read_path(path))
+
+    def fingerprint(self, layer):
+        digest = hashlib.sha256()
+        # A GeoPackage records when it was written, so its features are hashed rather than its bytes
+        if self.is_memory(layer) or self.layer_path(layer).endswith(".gpkg"):
+            for geometry, properties in self.read(layer):
+                digest.update(shapely.to_wkb(geometry))
+                digest.update(json.dumps(properties, sort_keys=True).encode("utf-8"))
+            return digest.hexdigest()
+
+        with open(self.layer_path(layer), "rb") as layer_file:
+            for chunk in iter(lambda: layer_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def save_layer(self, layer, entry_dir):
+        self.write_path(os.path.join(entry_dir, os.path.basename(self.layer_path(layer))), self.read(layer))
+
+    def restore_layer(self, entry_dir, layer):
+        # The layer may have been saved in the other layer format
+        name = os.path.basename(self.output_path(layer))
+        for layer_format in ("geojson", "gpkg"):
+            path = os.path.join(entry_dir, f"{os.path.splitext(name)[0]}.{layer_format}")
+            if os.path.exists(path):
+                self.write(layer, self.read_path(path))
+                return
+        raise FileNotFoundError(f"No saved copy of {layer} in {entry_dir}")
+
+    def read_geometries(self, layer):
+        return [geometry for geometry, properties in self.read(layer)]
+
+    def linear_unit(self, layer):
+        return self.linear_unit_name
+
+    def read_points(self, layer, field, epsg=4326):
+        transformer = None
+        source_epsg = self.config_dict.get('geojson_epsg')
+        if source_epsg and int(source_epsg) != epsg:
+            if pyproj is None:
+                raise ImportError("Projecting points from geojson_epsg needs the pyproj package")
+            transformer = pyproj.Transformer.from_crs(int(source_epsg), epsg, always_xy=True)
+
+        for geometry, properties in self.read(layer):
+            x, y = geometry.x, geometry.y
+            if transformer is not None:
+                x, y = transformer.transform(x, y)
+            yield properties.get(field), x, y
+
+    def stamp(self, layer):
+        stat = os.stat(self.layer_path(layer))
+        return f"{stat.st_size} {stat.st_mtime_ns}"
+
+    def write_batches(self, layer, batches, epsg=4326, out_epsg=None):
+        out_epsg = int(out_epsg or self.config_dict.get('geojson_epsg') or epsg)
+        transformer = None
+        if out_epsg != epsg:
+            if pyproj is None:
+                raise ImportError("Projecting features needs the pyproj package")
+            transformer = pyproj.Transformer.from_crs(epsg, out_epsg, always_xy=True)
+
+        def project(batch):
+            # Each batch is projected with one call over all of its coordinates
+            geometries = [shape(geometry) for geometry, properties in batch]
+            if transformer is not None and geometries:
+                geometries = shapely.transform(
+                    np.array(geometries, dtype=object),
+                    lambda coordinates: np.column_stack(transformer.transform(coordinates[:, 0],
+                                                                              coordinates[:, 1]))).tolist()
+            return [(geometry, properties) for geometry, (_, properties) in zip(geometries, batch)]
+
+        if self.is_memory(layer):
+            self.memory[layer.lower()] = [feature for batch in batches for feature in project(batch)]
+            return len(self.memory[layer.lower()])
+
+        path = self.output_path(layer)
+        if path.endswith(".gpkg"):
+            projected = (project(batch) for batch in batches)
+            count = GeoPackage(path, self.batch_size).write_batches(layer.lower(), projected, out_epsg)
+            self.replace_layer(layer, path)
+            return count
+
+        count = 0
+        with open(f"{path}.part", "w") as layer_file:
+            layer_file.write('{"type": "FeatureCollection", "features": [')
+            for batch in batches:
+                if transformer is None:
+                    features = [{"type": "Feature", "geometry": geometry, "properties": properties}
+                                for geometry, properties in batch]
+                else:
+                    features = [{"type": "Feature", "geometry": mapping(geometry), "properties": properties}
+                                for geometry, properties in project(batch)]
+                if not features:
+                    continue
+                # The batch is encoded as a list, and its brackets dropped to splice it into the features array
+                layer_file.write(("," if count else "") + json.dumps(features)[1:-1])
+                count += len(features)
+            layer_file.write("]}")
+        os.replace(f"{path}.part", path)
+        self.replace_layer(layer, path)
+        return count
+
+
+def buffer_worker(config_dict, in_layer, out_layer, distance, scratch_dir):
+    """
+    Buffers one layer in a worker process. The backend is created in the worker because arcpy state does not
+    carry over to child processes.
+    :param config_dict: A dictionary containing configuration settings
+    :param in_layer: Layer to buffer
+    :param out_layer: Output layer name
+    :param distance: Linear distance such as "1500 Feet"
+    :param scratch_dir: A directory the worker may use for its own scratch workspace
+    :return: The path of the buffered output
+    """
+    return create_backend(config_dict).buffer_isolated(in_layer, out_layer, distance, scratch_dir)
+
+
+def create_backend(config_dict):
+    """
+    Creates the geometry backend named by the geometry_backend config key. Without the key arcpy is used
+    when it is installed and Shapely otherwise.
+    :param config_dict: A dictionary containing configuration settings
+    :return: A GeometryBackend
+    """
+    name = config_dict.get('geometry_backend') or ("arcpy" if arcpy is not None else "shapely")
+    logger.debug("Using the %s geometry backend", name)
+
+    if name == "arcpy":
+        return ArcpyBackend(config_dict)
+    if name == "shapely":
+        return ShapelyBackend(config_dict)
+    raise ValueError(f"Unknown geometry backend {name}")
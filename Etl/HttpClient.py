@@ -0,0 +1,113 @@
+"""
+This module contains the HttpClient class, a shared HTTP layer for the ETL classes. It keeps a pool of keep-alive
+connections, applies a timeout to every request and retries transient failures with jittered exponential backoff.
+"""
+
+import random
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+    A class to represent a pooled HTTP session with retries.
+    """
+
+    # Status codes that are worth trying again
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size=10, timeout=30, max_retries=3, backoff_factor=0.5):
+        """
+        Creates the session and mounts a connection pool for http and https.
+        :param pool_size: Number of keep-alive connections to keep per host
+        :param timeout: Seconds to wait for a connection or a response
+        :param max_retries: Number of times to retry a failed request
+        :param backoff_factor: Base delay in seconds, doubled after every retry
+        :return: None
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_config(cls, config_dict):
+        """
+        Creates a client from the http_* keys of the configuration dictionary.
+        :param config_dict: A dictionary containing configuration settings
+        :return: An HttpClient
+        """
+        return cls(pool_size=int(config_dict.get('http_pool_size', 10)),
+                   timeout=float(config_dict.get('http_timeout', 30)),
+                   max_retries=int(config_dict.get('http_max_retries', 3)),
+                   backoff_factor=float(config_dict.get('http_backoff_factor', 0.5)))
+
+    def backoff(self, attempt):
+        """
+        Sleeps before the next retry. The delay grows exponentially and is jittered so parallel
+        workers do not retry in lockstep.
+        :param attempt: The number of the attempt that just failed, starting at 0
+        :return: None
+        """
+        time.sleep(random.uniform(0, self.backoff_factor * (2 ** attempt)))
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request, retrying connection errors, timeouts and retryable status codes.
+        :param method: The HTTP method
+        :param url: The URL to request
+        :param kwargs: Extra arguments passed on to requests
+        :return: The requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("%s %s failed (%s), retrying", method, url, e)
+                self.backoff(attempt)
+                continue
+
+            if response.status_code not in self.retry_statuses or attempt == self.max_retries:
+                return response
+
+            logger.warning("%s %s returned %s, retrying", method, url, response.status_code)
+            response.close()
+            self.backoff(attempt)
+
+    def get(self, url, **kwargs):
+        """
+        Sends a GET request.
+        :param url: The URL to request
+        :param kwargs: Extra arguments passed on to requests
+        :return: The requests.Response
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        Sends a POST request.
+        :param url: The URL to request
+        :param kwargs: Extra arguments passed on to requests
+        :return: The requests.Response
+        """
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        :param: None
+        :return: None
+        """
+        self.session.close()
@@ -0,0 +1,262 @@
+"""
+This module contains the LocalGeocoder class, an in-memory geocoder built from the county's address points. Exact
+matches are looked up in a hash index of normalized addresses. Addresses that differ in spelling fall back to a
+trigram index over the street names that share the same house number. The index is built once, pickled under
+proj_dir and rebuilt only when the address source changes. GSheetsEtl sends only the addresses it cannot match to
+the web geocoder.
+"""
+
+import os
+import csv
+import pickle
+import threading
+import logging
+from Etl.GeometryBackend import create_backend
+
+# Street types and directions are abbreviated the way the county address points write them
+ABBREVIATIONS = {
+    "STREET": "ST", "AVENUE": "AVE", "ROAD": "RD", "DRIVE": "DR", "BOULEVARD": "BLVD", "LANE": "LN",
+    "COURT": "CT", "PLACE": "PL", "CIRCLE": "CIR", "PARKWAY": "PKWY", "TRAIL": "TRL", "TERRACE": "TER",
+    "HIGHWAY": "HWY", "WAY": "WAY", "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+    "NORTHEAST": "NE", "NORTHWEST": "NW", "SOUTHEAST": "SE", "SOUTHWEST": "SW",
+}
+
+DIRECTIONS = {"N", "S", "E", "W", "NE", "NW", "SE", "SW"}
+STREET_TYPES = set(ABBREVIATIONS.values()) - DIRECTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class LocalGeocoder:
+    """
+    A class to represent a geocoder that matches addresses against a local table of address points.
+    """
+
+    # Bump when the pickled index layout changes
+    version = 2
+
+    def __init__(self, exact, by_number, city="", state="", min_score=0.7):
+        """
+        Initializes the geocoder from its indexes.
+        :param exact: A dictionary of normalized street address to (x, y)
+        :param by_number: A dictionary of house number to a list of (street name, trigrams, qualifiers, (x, y))
+        tuples
+        :param city: City name removed from the end of addresses before matching
+        :param state: State abbreviation removed from the end of addresses before matching
+        :param min_score: The lowest trigram similarity, from 0 to 1, accepted as a fuzzy match
+        :return: None
+        """
+        self.exact = exact
+        self.by_number = by_number
+        self.city = city.upper()
+        self.state = state.upper()
+        self.min_score = float(min_score)
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(address, city="", state=""):
+        """
+        Normalizes an address: upper case, no punctuation, abbreviated street types and directions, and no
+        trailing zip code, state or city.
+        :param address: A street or one line address
+        :param city: Upper case city name to remove
+        :param state: Upper case state abbreviation to remove
+        :return: The normalized street address
+        """
+        cleaned = "".join(char if char.isalnum() else " " for char in str(address).upper())
+        tokens = [ABBREVIATIONS.get(token, token) for token in cleaned.split()]
+
+        if tokens and len(tokens[-1]) == 5 and tokens[-1].isdigit() and len(tokens) > 2:
+            tokens.pop()
+        if state and tokens and tokens[-1] == state:
+            tokens.pop()
+        city_tokens = city.split()
+        if city_tokens and tokens[-len(city_tokens):] == city_tokens and len(tokens) > len(city_tokens):
+            del tokens[-len(city_tokens):]
+        return " ".join(tokens)
+
+    @staticmethod
+    def trigrams(text):
+        """
+        Splits text into overlapping three character pieces, padded so short names still have some.
+        :param text: Text to split
+        :return: A frozenset of trigrams
+        """
+        padded = f"  {text} "
+        return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    @staticmethod
+    def qualifiers(name):
+        """
+        Gets the directions and street types of a street name. Streets that differ only in these, such as
+        N MAIN ST and S MAIN ST, are different streets however alike their names are.
+        :param name: Normalized street name
+        :return: A (directions, street types) tuple of frozensets
+        """
+        tokens = name.split()
+        return frozenset(token for token in tokens if token in DIRECTIONS), \
+            frozenset(token for token in tokens if token in STREET_TYPES)
+
+    @staticmethod
+    def split_number(street):
+        """
+        Splits a normalized street address into its house number and street name.
+        :param street: Normalized street address
+        :return: A (house number, street name) tuple, the number is None when the address does not start with one
+        """
+        number, _, name = street.partition(" ")
+        if number[:1].isdigit():
+            return number, name
+        return None, street
+
+    @classmethod
+    def build(cls, records, city="", state="", min_score=0.7):
+        """
+        Builds the indexes from address points.
+        :param records: An iterable of (address, x, y) tuples
+        :param city: City name removed from the end of addresses
+        :param state: State abbreviation removed from the end of addresses
+        :param min_score: The lowest trigram similarity accepted as a fuzzy match
+        :return: A LocalGeocoder
+        """
+        exact = {}
+        by_number = {}
+        for address, x, y in records:
+            if not address or x is None or y is None:
+                continue
+            street = cls.normalize(address, city.upper(), state.upper())
+            if street in exact:
+                continue
+
+            exact[street] = (float(x), float(y))
+            number, name = cls.split_number(street)
+            if number is not None:
+                by_number.setdefault(number, []).append((name, cls.trigrams(name), cls.qualifiers(name),
+                                                         exact[street]))
+
+        logger.info("Built the local geocoder index from %s addresses", len(exact))
+        return cls(exact, by_number, city, state, min_score)
+
+    def fuzzy(self, street):
+        """
+        Finds the closest street name among the address points with the same house number, direction and street
+        type.
+        :param street: Normalized street address
+        :return: An (x, y) tuple, or None if nothing scores at least min_score
+        """
+        number, name = self.split_number(street)
+        if number is None:
+            return None
+
+        grams = self.trigrams(name)
+        qualifiers = self.qualifiers(name)
+        best_score, best_name, best = 0.0, None, None
+        for candidate_name, candidate_grams, candidate_qualifiers, coordinates in self.by_number.get(number, ()):
+            if candidate_qualifiers != qualifiers:
+                continue
+            # Dice coefficient of the two trigram sets
+            score = 2 * len(grams & candidate_grams) / (len(grams) + len(candidate_grams))
+            if score > best_score:
+                best_score, best_name, best = score, candidate_name, coordinates
+
+        if best_score < self.min_score:
+            return None
+        logger.debug("Fuzzy match of %s to %s %s, score %.2f", street, number, best_name, best_score)
+        return best
+
+    def lookup(self, address):
+        """
+        Geocodes an address from the local indexes.
+        :param address: A street or one line address
+        :return: An (x, y) tuple, or None if the address has no local match
+        """
+        street = self.normalize(address, self.city, self.state)
+        coordinates = self.exact.get(street)
+        if coordinates is not None:
+            with self._lock:
+                self.hits += 1
+            return coordinates
+
+        coordinates = self.fuzzy(street)
+        with self._lock:
+            if coordinates is not None:
+                self.fuzzy_hits += 1
+            else:
+                self.misses += 1
+        return coordinates
+
+    def save(self, path, stamp):
+        """
+        Pickles the indexes with the stamp of the source they were built from.
+        :param path: Path of the index file
+        :param stamp: A string that changes when the source changes
+        :return: None
+        """
+        with open(f"{path}.part", "wb") as index_file:
+            pickle.dump({"version": self.version, "stamp": stamp, "exact": self.exact, "by_number": self.by_number},
+                        index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.part", path)
+
+    @classmethod
+    def load(cls, path, stamp, city="", state="", min_score=0.7):
+        """
+        Loads a pickled index if it was built from the same source.
+        :param path: Path of the index file
+        :param stamp: The stamp of the current source
+        :param city: City name removed from the end of addresses
+        :param state: State abbreviation removed from the end of addresses
+        :param min_score: The lowest trigram similarity accepted as a fuzzy match
+        :return: A LocalGeocoder, or None if the file is missing or out of date
+        """
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "rb") as index_file:
+            saved = pickle.load(index_file)
+        if saved.get("version") != cls.version or saved.get("stamp") != stamp:
+            logger.info("The local geocoder index is out of date")
+            return None
+        return cls(saved["exact"], saved["by_number"], city, state, min_score)
+
+    @classmethod
+    def from_config(cls, config_dict, backend=None, city="", state=""):
+        """
+        Loads the local geocoder index, building it first if the address source has changed. The source is the
+        local_geocoder_source config key: a csv file with the address field and WGS 1984 X and Y columns, or
+        the name of a point layer read with the geometry backend.
+        :param config_dict: A dictionary containing configuration settings
+        :param backend: The GeometryBackend used to read a layer source, made from config_dict by default
+        :param city: City name removed from the end of addresses
+        :param state: State abbreviation removed from the end of addresses
+        :return: A LocalGeocoder
+        """
+        source = config_dict.get('local_geocoder_source') or "Addresses"
+        field = config_dict.get('local_geocoder_address_field', "FULLADDR")
+        min_score = float(config_dict.get('local_geocoder_min_score', 0.7))
+        index_path = f"{config_dict.get('proj_dir')}local_geocoder.pickle"
+
+        is_csv = source.lower().endswith(".csv")
+        if not is_csv and backend is None:
+            backend = create_backend(config_dict)
+
+        if is_csv:
+            stat = os.stat(source)
+            stamp = f"{source} {field} {stat.st_size} {stat.st_mtime_ns}"
+        else:
+            stamp = f"{source} {field} {backend.stamp(source)}"
+
+        geocoder = cls.load(index_path, stamp, city, state, min_score)
+        if geocoder is not None:
+            return geocoder
+
+        if is_csv:
+            with open(source, newline='') as source_file:
+                records = ((row.get(field), row.get('X'), row.get('Y')) for row in csv.DictReader(source_file))
+                geocoder = cls.build(records, city, state, min_score)
+        else:
+            geocoder = cls.build(backend.read_points(source, field), city, state, min_score)
+        geocoder.save(index_path, stamp)
+        return geocoder
@@ -0,0 +1,70 @@
+"""
+This module contains the map export helpers used by finalproject.py. The batch export renders one PDF per subtitle
+or extent in worker processes, each working on its own copy of the ArcGIS Pro project so the layouts do not
+interfere with each other. The copies are saved next to the project, so data paths stored relative to it still
+resolve, and removed once the PDF is written.
+"""
+
+import os
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def set_layout_text(lyt, subtitle, current_date, current_time):
+    """
+    Adds the subtitle to the layout title and fills in the date and time elements.
+    :param lyt: An arcpy.mp layout
+    :param subtitle: Map subtitle
+    :param current_date: Date text
+    :param current_time: Time text
+    :return: None
+    """
+    for el in lyt.listElements():
+        logger.debug("%s", el.name)
+        if "Title" in el.name:
+            el.text = el.text + subtitle
+        elif "Date" in el.name:
+            el.text = f"{current_date}"
+        elif "Time" in el.name:
+            el.text = f"{current_time}"
+
+
+def export_worker(aprx_path, subtitle, extent, pdf_output, current_date, current_time):
+    """
+    Exports one PDF in a worker process from a private copy of the project.
+    :param aprx_path: Path to the saved project
+    :param subtitle: Map subtitle
+    :param extent: A [xmin, ymin, xmax, ymax] list to zoom the map frame to, or None to keep the saved extent
+    :param pdf_output: Path of the PDF to write
+    :param current_date: Date text
+    :param current_time: Time text
+    :return: The path of the PDF
+    """
+    import arcpy
+
+    # Each worker edits its own copy so the title text and extent changes stay separate
+    name, extension = os.path.splitext(os.path.basename(aprx_path))
+    aprx_copy = os.path.join(os.path.dirname(aprx_path), f"{name}_export_{uuid.uuid4().hex[:8]}{extension}")
+    aprx = arcpy.mp.ArcGISProject(aprx_path)
+    aprx.saveACopy(aprx_copy)
+    del aprx
+
+    lyt = map_frame = None
+    try:
+        aprx = arcpy.mp.ArcGISProject(aprx_copy)
+        lyt = aprx.listLayouts()[0]
+        set_layout_text(lyt, subtitle, current_date, current_time)
+
+        if extent:
+            map_frame = lyt.listElements("MAPFRAME_ELEMENT")[0]
+            map_frame.camera.setExtent(arcpy.Extent(*extent, spatial_reference=map_frame.map.spatialReference))
+
+        lyt.exportToPDF(pdf_output)
+    finally:
+        # The project holds a lock on its file until every object from it is released
+        aprx = lyt = map_frame = None
+        os.remove(aprx_copy)
+
+    return pdf_output
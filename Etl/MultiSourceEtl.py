@@ -0,0 +1,183 @@
+"""
+This module contains the MultiSourceEtl class, which runs the GSheetsEtl extract and transform of several Google
+Sheets at the same time, one per district, and loads their addresses into avoid_points together. Each sheet keeps
+its downloads, manifest and output under proj_dir/sources/<name>/, while the geocode cache and the local geocoder
+index in proj_dir are shared. An address reported on more than one sheet is loaded once.
+"""
+
+import os
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from Etl.SpatialEtl import SpatialEtl
+from Etl.GSheetsEtl import GSheetsEtl
+from Etl.GeocodeCache import GeocodeCache
+from Etl.AddressTable import AddressTable
+from Etl.LocalGeocoder import LocalGeocoder
+from Etl.Tracing import traced, span, set_count, in_current_span
+
+logger = logging.getLogger(__name__)
+
+
+class MultiSourceEtl(SpatialEtl):
+    """
+    MultiSourceEtl performs the extract and transform of several Google Sheets concurrently and one merged load.
+
+    Parameters:
+    config_dict (dictionary): A dictionary containing a sources list. Each source is a dictionary with a name and
+    a remote_url, and may override any other config key for that sheet.
+    """
+
+    def __init__(self, config_dict):
+        self.config_dict = config_dict
+        self.sources = config_dict.get('sources') or []
+        self.etls = []
+        self.tables = []
+        self.table = None
+        self.geocode_cache = None
+
+    def source_config(self, source):
+        """
+        Builds the config of one sheet: the shared config, the source's own keys and its own directory.
+        :param source: A dictionary from the sources config key
+        :return: A dictionary containing configuration settings
+        """
+        name = source.get('name')
+        if not name:
+            raise ValueError(f"Every source needs a name, {source.get('remote_url')} has none")
+
+        source_dir = os.path.join(self.config_dict.get('proj_dir'), "sources", name) + os.sep
+        os.makedirs(source_dir, exist_ok=True)
+        return {**self.config_dict, **source, 'source_dir': source_dir}
+
+    def extract(self):
+        """
+        Creates a GSheetsEtl for each source, sharing one geocode cache and one local geocoder between them. The
+        sheets are downloaded by transform, each on its own thread together with its geocoding.
+        :param: None
+        :return: None
+        """
+        self.etls = [GSheetsEtl(self.source_config(source)) for source in self.sources]
+
+        # One connection to the geocode cache serves every thread, so the sheets never wait on each other's locks
+        if self.etls and self.config_dict.get('geocode_cache'):
+            self.geocode_cache = GeocodeCache.from_config(self.config_dict)
+            for etl in self.etls:
+                etl.geocode_cache = self.geocode_cache
+
+        # Load the local geocoder once for every sheet instead of once per thread
+        if self.etls and self.config_dict.get('local_geocoder'):
+            try:
+                with span("load_local_geocoder"):
+                    local_geocoder = LocalGeocoder.from_config(self.config_dict, city=GSheetsEtl.city,
+                                                               state=GSheetsEtl.state)
+                for etl in self.etls:
+                    etl.local_geocoder = local_geocoder
+            except Exception as e:
+                logger.warning("Could not load the local geocoder: %s", e)
+
+    def run_source(self, etl):
+        """
+        Extracts and transforms one sheet. If the sheet has not changed, or its transform fails, the output of
+        its last run is used.
+        :param etl: The GSheetsEtl of the sheet
+        :return: An AddressTable
+        """
+        name = etl.config_dict.get('name')
+        with span("source", source=name):
+            etl.extract()
+            if etl.extract_skipped and os.path.exists(f"{etl.work_dir}output.csv") \
+                    and not os.path.exists(f"{etl.work_dir}geocode.checkpoint"):
+                logger.info("Source %s has not changed since the last run", name)
+                table = etl.output_table()
+            else:
+                etl.transform()
+                table = etl.table
+                if table is None and os.path.exists(f"{etl.work_dir}output.csv"):
+                    logger.warning("The transform of source %s failed, using its last output", name)
+                    table = etl.output_table()
+            if table is None:
+                raise RuntimeError(f"Source {name} has no geocoded addresses")
+
+            table.add_column('Source', [name] * len(table))
+            set_count(len(table))
+            return table
+
+    def transform(self):
+        """
+        Runs the extract and transform of every sheet at the same time, so the sheets wait on the network
+        together rather than one after another.
+        :param: None
+        :return: None
+        """
+        workers = int(self.config_dict.get('source_workers') or len(self.etls) or 1)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="source") as executor:
+            self.tables = list(executor.map(in_current_span(self.run_source), self.etls))
+
+        self.table = AddressTable.concat(self.dedupe(self.tables))
+        self.table.write_csv(f"{self.config_dict.get('proj_dir')}output.csv")
+        logger.info("Merged %s sources into %s addresses", len(self.tables), len(self.table))
+
+    def dedupe(self, tables):
+        """
+        Drops the addresses an earlier source already listed, comparing the normalized dedupe_field column. The
+        first source in config order that reports an address keeps it. Repeats within one sheet are kept, as
+        they are when the sheet is loaded on its own.
+        :param tables: A list of AddressTables in source order
+        :return: A list of AddressTables
+        """
+        field = self.config_dict.get('dedupe_field') or "Street Address:"
+        seen = set()
+        deduped = []
+        for table in tables:
+            keys = [LocalGeocoder.normalize(value, GSheetsEtl.city.upper(), GSheetsEtl.state.upper())
+                    for value in table.column(field)]
+            keep = [i for i, key in enumerate(keys) if key not in seen]
+            seen.update(keys)
+
+            if len(keep) < len(table):
+                logger.info("Dropped %s addresses of source %s listed by an earlier source", len(table) - len(keep),
+                            table.columns['Source'][0])
+                table = table.take(np.array(keep, dtype=np.int64))
+            deduped.append(table)
+        return deduped
+
+    def load(self):
+        """
+        Loads the merged addresses into avoid_points, then records each sheet's manifest and download headers.
+        :param: None
+        :return: None
+        """
+        loader = GSheetsEtl(self.config_dict)
+        try:
+            loader.table = self.table
+            loader.load()
+        finally:
+            loader.http.close()
+
+        if not loader.loaded:
+            raise RuntimeError("The merged addresses were not loaded into avoid_points")
+        for etl in self.etls:
+            etl.save_manifest()
+            etl.save_meta()
+
+    @traced("multi_source_etl")
+    def process(self):
+        """
+        Executes the full ETL process (extract, transform, and load).
+        :param: None
+        :return: None
+        """
+        try:
+            self.extract()
+            self.transform()
+            self.load()
+        except Exception as e:
+            print(f"Error in the multi-source ETL process{e}")
+        finally:
+            for etl in self.etls:
+                etl.http.close()
+            if self.geocode_cache is not None:
+                logger.info("Geocode cache: %s hits, %s misses", self.geocode_cache.hits, self.geocode_cache.misses)
+                self.geocode_cache.close()
+                self.geocode_cache = None
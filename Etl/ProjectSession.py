@@ -0,0 +1,121 @@
+"""
+This module contains the ProjectSession class, which opens the ArcGIS Pro project once per run. Layer additions and
+symbology changes are queued and applied together, with a single save, right before the map is exported.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectSession:
+    """
+    A class to represent one open ArcGIS Pro project and the map changes waiting to be saved to it.
+    """
+
+    def __init__(self, aprx_path, project_factory=None):
+        """
+        Initializes the session. The project is not opened until it is first needed.
+        :param aprx_path: Path to the .aprx project file
+        :param project_factory: A function that opens a project from a path, arcpy.mp.ArcGISProject by default
+        :return: None
+        """
+        self.aprx_path = aprx_path
+        self.project_factory = project_factory
+        self.aprx = None
+        self.map_doc = None
+        self.layers = {}
+        self.pending_adds = []
+        self.pending_symbology = []
+        self.spatial_reference = None
+
+    def open(self):
+        """
+        Opens the project, if it is not open yet, and builds the layer name lookup.
+        :param: None
+        :return: The open project
+        """
+        if self.aprx is None:
+            if self.project_factory is None:
+                import arcpy
+                self.project_factory = arcpy.mp.ArcGISProject
+
+            logger.debug("Opening %s", self.aprx_path)
+            self.aprx = self.project_factory(self.aprx_path)
+            self.map_doc = self.aprx.listMaps()[0]
+            self.layers = {lyr.name: lyr for lyr in self.map_doc.listLayers()}
+        return self.aprx
+
+    def add_layer(self, layer_name, data_path):
+        """
+        Queues a layer to be added to the map, replacing any layer with the same name.
+        :param layer_name: Layer name
+        :param data_path: Path to the layer's data
+        :return: None
+        """
+        self.pending_adds = [(name, path) for name, path in self.pending_adds if name != layer_name]
+        self.pending_adds.append((layer_name, data_path))
+
+    def set_symbology(self, layer_name, color, outline_color, transparency):
+        """
+        Queues a symbology change for a layer.
+        :param layer_name: Layer name
+        :param color: Fill color dictionary such as {'RGB': [255, 0, 0, 100]}
+        :param outline_color: Outline color dictionary
+        :param transparency: Layer transparency percentage
+        :return: None
+        """
+        self.pending_symbology.append((layer_name, color, outline_color, transparency))
+
+    def set_spatial_reference(self, spatial_reference):
+        """
+        Queues a change of the map's spatial reference.
+        :param spatial_reference: An arcpy.SpatialReference
+        :return: None
+        """
+        self.spatial_reference = spatial_reference
+
+    def commit(self):
+        """
+        Applies the queued changes and saves the project once.
+        :param: None
+        :return: None
+        """
+        if not self.pending_adds and not self.pending_symbology and self.spatial_reference is None:
+            return
+
+        self.open()
+
+        for layer_name, data_path in self.pending_adds:
+            # Remove the layer with the same name if it already exists
+            if layer_name in self.layers:
+                self.map_doc.removeLayer(self.layers.pop(layer_name))
+            self.map_doc.addDataFromPath(data_path)
+
+        if self.pending_adds:
+            self.layers = {lyr.name: lyr for lyr in self.map_doc.listLayers()}
+
+        if self.spatial_reference is not None:
+            self.map_doc.spatialReference = self.spatial_reference
+
+        for layer_name, color, outline_color, transparency in self.pending_symbology:
+            lyr = self.layers[layer_name]
+            sym = lyr.symbology
+            sym.renderer.symbol.color = color
+            sym.renderer.symbol.outlineColor = outline_color
+            lyr.symbology = sym
+            lyr.transparency = transparency
+
+        self.aprx.save()
+        self.pending_adds = []
+        self.pending_symbology = []
+        self.spatial_reference = None
+
+    def layout(self):
+        """
+        Commits the queued changes and gets the project's layout for export.
+        :param: None
+        :return: The first layout of the project
+        """
+        self.commit()
+        return self.open().listLayouts()[0]
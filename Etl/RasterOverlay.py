@@ -0,0 +1,187 @@
+"""
+This module contains the raster fast mode of the buffer, intersect and erase overlay. Each buffered layer is
+rasterized to a bit-packed mask of the cells whose center is within the buffer distance of one of its geometries.
+The masks are ANDed together, the cells of the buffered avoid points are cleared, and each address takes the value
+of its cell. No buffer is dissolved, so the preview does far less work than the vector analysis; the result is an
+approximation whose accuracy depends on the cell size.
+"""
+
+import logging
+import numpy as np
+import shapely
+
+logger = logging.getLogger(__name__)
+
+
+class RasterGrid:
+    """
+    A class to represent the cell grid the masks are rasterized to.
+    """
+
+    def __init__(self, bounds, cell_size):
+        """
+        Creates a grid covering the bounds.
+        :param bounds: A (min x, min y, max x, max y) tuple
+        :param cell_size: Width and height of a cell in data units
+        :return: None
+        """
+        self.min_x, self.min_y, max_x, max_y = bounds
+        self.cell_size = float(cell_size)
+        self.cols = max(1, int(np.ceil((max_x - self.min_x) / self.cell_size)))
+        self.rows = max(1, int(np.ceil((max_y - self.min_y) / self.cell_size)))
+
+    def key(self):
+        """
+        Identifies the grid, so masks cached for one grid are not used with another.
+        :param: None
+        :return: A tuple of the origin, cell size and shape
+        """
+        return self.min_x, self.min_y, self.cell_size, self.rows, self.cols
+
+    def cell_indices(self, x, y):
+        """
+        Finds the cell each point falls in.
+        :param x: NumPy array of x coordinates
+        :param y: NumPy array of y coordinates
+        :return: A (row, col) tuple of int64 NumPy arrays, which may be outside the grid
+        """
+        col = np.floor((x - self.min_x) / self.cell_size).astype(np.int64)
+        row = np.floor((y - self.min_y) / self.cell_size).astype(np.int64)
+        return row, col
+
+    def window(self, bounds):
+        """
+        Finds the cells whose centers fall in a bounding box.
+        :param bounds: A (min x, min y, max x, max y) tuple
+        :return: A (row slice, col slice) tuple, empty if the box is outside the grid
+        """
+        min_x, min_y, max_x, max_y = bounds
+        col_start = max(0, int(np.ceil((min_x - self.min_x) / self.cell_size - 0.5)))
+        col_stop = min(self.cols, int(np.floor((max_x - self.min_x) / self.cell_size - 0.5)) + 1)
+        row_start = max(0, int(np.ceil((min_y - self.min_y) / self.cell_size - 0.5)))
+        row_stop = min(self.rows, int(np.floor((max_y - self.min_y) / self.cell_size - 0.5)) + 1)
+        return slice(row_start, max(row_start, row_stop)), slice(col_start, max(col_start, col_stop))
+
+    def fill(self, polygon, inside):
+        """
+        Sets the cells whose center is inside a polygon, one grid row at a time: each row of centers is crossed
+        with the edges of every ring, and the cells between each pair of crossings are set (the even-odd rule, so
+        holes and the parts of multipolygons are handled alike).
+        :param polygon: A shapely Polygon or MultiPolygon
+        :param inside: A boolean array of shape (rows, cols) to set the cells in
+        :return: None
+        """
+        rows, cols = self.window(polygon.bounds)
+        if rows.start == rows.stop or cols.start == cols.stop:
+            return
+
+        rings = shapely.get_parts(shapely.boundary(polygon))
+        coordinates, ring_index = shapely.get_coordinates(rings, return_index=True)
+        same_ring = ring_index[1:] == ring_index[:-1]
+        start, end = coordinates[:-1][same_ring], coordinates[1:][same_ring]
+
+        # Each edge counts as crossing a row of centers when one end is on or below it and the other above it
+        center_y = self.min_y + (np.arange(rows.start, rows.stop) + 0.5) * self.cell_size
+        below_start = start[:, 1] <= center_y[:, np.newaxis]
+        crosses = below_start != (end[:, 1] <= center_y[:, np.newaxis])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = start[:, 0] + (center_y[:, np.newaxis] - start[:, 1]) * \
+                (end[:, 0] - start[:, 0]) / (end[:, 1] - start[:, 1])
+        crossing_x = np.sort(np.where(crosses, crossing_x, np.inf), axis=1)
+
+        # Cells are set from the first center right of each entering crossing up to the next crossing
+        width = cols.stop - cols.start
+        span_start = np.ceil((crossing_x[:, 0::2] - self.min_x) / self.cell_size - 0.5) - cols.start
+        span_stop = np.ceil((crossing_x[:, 1::2] - self.min_x) / self.cell_size - 0.5) - cols.start
+        span_start, span_stop = span_start[:, :span_stop.shape[1]], span_stop[:, :span_start.shape[1]]
+        valid = np.isfinite(span_stop)
+        row = np.broadcast_to(np.arange(len(center_y))[:, np.newaxis], valid.shape)[valid]
+        span_start = np.clip(span_start[valid], 0, width).astype(np.int64)
+        span_stop = np.clip(span_stop[valid], 0, width).astype(np.int64)
+
+        change = np.zeros((len(center_y), width + 1), dtype=np.int32)
+        np.add.at(change, (row, span_start), 1)
+        np.add.at(change, (row, span_stop), -1)
+        inside[rows, cols] |= np.cumsum(change[:, :-1], axis=1) > 0
+
+    def rasterize(self, geometries, distance):
+        """
+        Builds the bit-packed mask of the cells whose center is within a distance of any of the geometries. Points
+        are tested with NumPy against the cells around them, other geometries are buffered one by one, without
+        dissolving the buffers, and filled.
+        :param geometries: A list of shapely geometries
+        :param distance: Buffer distance in data units
+        :return: A uint8 array of shape (rows, ceil(cols / 8))
+        """
+        inside = np.zeros((self.rows, self.cols), dtype=bool)
+        if not geometries:
+            return np.packbits(inside, axis=1)
+
+        geometries = np.asarray(geometries, dtype=object)
+        is_point = shapely.get_type_id(geometries) == shapely.GeometryType.POINT
+
+        for x, y in shapely.get_coordinates(geometries[is_point]):
+            rows, cols = self.window((x - distance, y - distance, x + distance, y + distance))
+            center_x = self.min_x + (np.arange(cols.start, cols.stop) + 0.5) * self.cell_size
+            center_y = self.min_y + (np.arange(rows.start, rows.stop) + 0.5) * self.cell_size
+            inside[rows, cols] |= ((center_y - y) ** 2)[:, np.newaxis] + ((center_x - x) ** 2) <= distance ** 2
+
+        for zone in shapely.buffer(geometries[~is_point], distance):
+            if not zone.is_empty:
+                self.fill(zone, inside)
+
+        return np.packbits(inside, axis=1)
+
+    def lookup(self, mask, x, y):
+        """
+        Looks up the mask bit of the cell each point falls in.
+        :param mask: A bit-packed mask from rasterize
+        :param x: NumPy array of x coordinates
+        :param y: NumPy array of y coordinates
+        :return: A boolean NumPy array, False for points outside the grid
+        """
+        row, col = self.cell_indices(x, y)
+        inside_grid = (col >= 0) & (col < self.cols) & (row >= 0) & (row < self.rows)
+
+        result = np.zeros(len(x), dtype=bool)
+        col, row = col[inside_grid], row[inside_grid]
+        result[inside_grid] = (mask[row, col >> 3] >> (7 - (col & 7))) & 1 == 1
+        return result
+
+
+def raster_count(read_geometries, layers, avoid_layer, address_layer, cell_size, masks=None):
+    """
+    Counts the addresses in the risk zone with the raster approximation of the overlay.
+    :param read_geometries: A function that reads the shapely geometries of a layer, such as
+    GeometryBackend.read_geometries
+    :param layers: A list of (layer name, distance) tuples, one for each buffered layer
+    :param avoid_layer: A (layer name, distance) tuple for the avoid points
+    :param address_layer: The address point layer name
+    :param cell_size: Cell size in data units
+    :param masks: (optional) A dictionary the masks are cached in, keyed on the layer, the distance and the grid.
+    Keep it between previews of unchanged layers so only new distances are rasterized.
+    :return: The number of addresses in the risk zone
+    """
+    address_points = np.asarray(read_geometries(address_layer))
+    if not len(address_points):
+        return 0
+
+    x = shapely.get_x(address_points)
+    y = shapely.get_y(address_points)
+
+    # Cells outside the addresses are never looked up, so the grid only covers the addresses
+    grid = RasterGrid((x.min(), y.min(), x.max() + cell_size, y.max() + cell_size), cell_size)
+    masks = {} if masks is None else masks
+
+    def mask(layer, distance):
+        key = (layer, distance, grid.key())
+        if key not in masks:
+            logger.debug("Rasterizing %s buffered by %s to a %s x %s grid", layer, distance, grid.rows, grid.cols)
+            masks[key] = grid.rasterize(read_geometries(layer), distance)
+        return masks[key]
+
+    zone = np.bitwise_and.reduce([mask(layer, distance) for layer, distance in layers]) if layers \
+        else np.full((grid.rows, (grid.cols + 7) // 8), 0xFF, dtype=np.uint8)
+    zone = zone & ~mask(*avoid_layer)
+
+    return int(grid.lookup(zone, x, y).sum())
@@ -0,0 +1,135 @@
+"""
+This module contains the ScenarioSweep class, which runs the risk-zone analysis for every combination of buffer
+distances in a grid without prompting. Each (layer, distance) buffer is computed once and shared by every scenario
+that uses it, and intersects of the same leading buffers are reused, so a sweep costs far less than one full run
+per scenario.
+"""
+
+import csv
+import hashlib
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ScenarioSweep:
+    """
+    A class to represent a sweep over a grid of buffer distances.
+    """
+
+    def __init__(self, backend, config_dict):
+        """
+        Initializes the sweep from the sweep section of the configuration dictionary.
+        :param backend: The GeometryBackend that runs the analysis steps
+        :param config_dict: A dictionary containing configuration settings
+        :return: None
+        """
+        self.backend = backend
+        self.config_dict = config_dict
+        sweep_config = config_dict.get('sweep') or {}
+
+        self.layers = config_dict["buffer_layer_list"]
+        self.distances = {layer: [str(distance) for distance in sweep_config['distances'][layer]]
+                          for layer in self.layers}
+        self.avoid_distances = [str(distance) for distance in sweep_config['avoid_distances']]
+        self.output = f"{config_dict.get('proj_dir')}{sweep_config.get('output', 'sweep_results.csv')}"
+
+        # Memoized layer names, keyed on what they were made from
+        self.buffers = {}
+        self.intersects = {}
+        self.created = []
+
+    @staticmethod
+    def layer_name(prefix, key):
+        """
+        Builds a short, valid layer name for a memoized output.
+        :param prefix: Name prefix
+        :param key: The tuple the output was made from
+        :return: The layer name
+        """
+        return f"{prefix}_{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:10]}"
+
+    def scratch_name(self, prefix, key):
+        """
+        Builds the name of a memoized output in the backend's scratch workspace.
+        :param prefix: Name prefix
+        :param key: The tuple the output was made from
+        :return: The layer name
+        """
+        return self.backend.scratch_name(self.layer_name(prefix, key))
+
+    def buffer(self, layer, distance):
+        """
+        Buffers a layer, or reuses the buffer if this (layer, distance) pair has been computed already.
+        :param layer: Layer name
+        :param distance: Buffer distance
+        :return: The buffered layer name
+        """
+        key = (layer, distance)
+        if key not in self.buffers:
+            out_layer = self.scratch_name("sweep_buf", key)
+            logger.debug("Buffering %s by %s to %s", layer, distance, out_layer)
+            self.backend.buffer(layer, out_layer, distance)
+            self.created.append(out_layer)
+            self.buffers[key] = out_layer
+        return self.buffers[key]
+
+    def intersect(self, scenario):
+        """
+        Intersects the buffers of a scenario, reusing the intersect of every leading subset of layers that an
+        earlier scenario has already computed.
+        :param scenario: A tuple of distances, one for each layer in buffer_layer_list
+        :return: The intersect layer name
+        """
+        prefix_layer = self.buffer(self.layers[0], scenario[0])
+        for i in range(1, len(self.layers)):
+            key = tuple(zip(self.layers[:i + 1], scenario[:i + 1]))
+            if key not in self.intersects:
+                out_layer = self.scratch_name("sweep_int", key)
+                self.backend.intersect([prefix_layer, self.buffer(self.layers[i], scenario[i])], out_layer)
+                self.created.append(out_layer)
+                self.intersects[key] = out_layer
+            prefix_layer = self.intersects[key]
+        return prefix_layer
+
+    def run(self):
+        """
+        Runs every scenario and writes a table of notification counts to the sweep output csv.
+        :param: None
+        :return: A list of result row dictionaries
+        """
+        results = []
+        # itertools.product varies the last layer fastest, so consecutive scenarios share intersect prefixes
+        scenarios = list(itertools.product(*(self.distances[layer] for layer in self.layers)))
+        logger.info("Running %s scenarios", len(scenarios) * len(self.avoid_distances))
+
+        for scenario in scenarios:
+            intersect_layer = self.intersect(scenario)
+            for avoid_distance in self.avoid_distances:
+                zone_layer = self.scratch_name("sweep_zone", (scenario, avoid_distance))
+                self.backend.erase(intersect_layer, self.buffer("Avoid_Points", avoid_distance), zone_layer)
+                self.created.append(zone_layer)
+
+                count = self.backend.count_within("Addresses", zone_layer)
+                results.append({**dict(zip(self.layers, scenario)), "Avoid_Points": avoid_distance,
+                                "Notifications": count})
+                logger.debug("%s", results[-1])
+
+        with open(self.output, "w", newline='') as output_file:
+            csv_writer = csv.DictWriter(output_file, fieldnames=self.layers + ["Avoid_Points", "Notifications"])
+            csv_writer.writeheader()
+            csv_writer.writerows(results)
+
+        return results
+
+    def cleanup(self):
+        """
+        Deletes the intermediate layers the sweep created.
+        :param: None
+        :return: None
+        """
+        for layer in self.created:
+            if self.backend.exists(layer):
+                self.backend.delete(layer)
+        self.created = []
@@ -3,6 +3,9 @@ This module contains the SpatialEtl superclass, which provides a high-level stru
 and Load (ETL) process for spatial data. The SpatialEtl class has methods for extracting data from a remote source,
 transforming it, and loading it into a specified destination. This class serves as a base class that can be extended
 for specific use cases.
+
+Subclasses can also implement the streaming pipeline, where extract_rows, transform_rows and load_rows are chained
+generators of row dictionaries so rows flow from the source to the destination without intermediate files.
 """
 
 
@@ -50,4 +53,53 @@ class SpatialEtl:
         try:
             print(f"Loading data into {self.destination}")
         except Exception as e:
-            print(f"Error in the superclass load function{e}")
\ No newline at end of file
+            print(f"Error in the superclass load function{e}")
+
+    def process(self):
+        """
+        Executes the full ETL process (extract, transform, and load).
+        :param: None
+        :return: None
+        """
+        self.extract()
+        self.transform()
+        self.load()
+
+    def extract_rows(self):
+        """
+        Yields the rows of the remote source one at a time. Subclasses override this to take part in the
+        streaming pipeline.
+        :param: None
+        :return: A generator of row dictionaries
+        """
+        raise NotImplementedError
+
+    def transform_rows(self, rows):
+        """
+        Transforms a stream of rows. By default rows are passed through unchanged.
+        :param rows: An iterable of row dictionaries
+        :return: A generator of row dictionaries
+        """
+        yield from rows
+
+    def load_rows(self, rows):
+        """
+        Loads a stream of rows into the destination. Subclasses override this to take part in the
+        streaming pipeline.
+        :param rows: An iterable of row dictionaries
+        :return: None
+        """
+        raise NotImplementedError
+
+    def stream_process(self):
+        """
+        Executes the ETL process as a streaming pipeline. Subclasses that only implement the extract,
+        transform and load methods fall back to process().
+        :param: None
+        :return: None
+        """
+        if type(self).extract_rows is SpatialEtl.extract_rows or type(self).load_rows is SpatialEtl.load_rows:
+            self.process()
+            return
+
+        self.load_rows(self.transform_rows(self.extract_rows()))
@@ -0,0 +1,125 @@
+"""
+This module contains the StepCache class, a content-addressed cache for the steps of finalproject.py. A step's
+cache key is a hash of everything it depends on: source layer fingerprints, distances and the keys of the steps it
+builds on. Because downstream keys include upstream keys, changing one input only re-runs the steps that depend on
+it. Entries are directories under the cache directory and the least recently used entries are evicted once the
+cache grows past its size limit.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StepCache:
+    """
+    A class to represent an on-disk cache of step outputs.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, force=False):
+        """
+        Creates the cache directory.
+        :param cache_dir: Directory the cache entries are kept in
+        :param max_bytes: Maximum total size of the cache, None for no limit
+        :param force: Set to True to ignore existing entries and re-run every step
+        :return: None
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.force = force
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(step, inputs):
+        """
+        Builds the content hash of a step.
+        :param step: Step name
+        :param inputs: A JSON serializable description of everything the step depends on
+        :return: The cache key
+        """
+        return hashlib.sha256(json.dumps([step, inputs], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def entry_dir(self, key):
+        """
+        Gets the directory of a cache entry.
+        :param key: The cache key
+        :return: The entry directory
+        """
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, step, key):
+        """
+        Looks up a cache entry.
+        :param step: Step name, used for logging
+        :param key: The cache key
+        :return: The entry's metadata dictionary, or None on a miss
+        """
+        meta_path = os.path.join(self.entry_dir(key), "meta.json")
+        if self.force or not os.path.exists(meta_path):
+            logger.info("Step cache miss for %s (%s)", step, key[:12])
+            return None
+
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+
+        # The metadata file's modification time records when the entry was last used
+        os.utime(meta_path)
+        logger.info("Step cache hit for %s (%s)", step, key[:12])
+        return meta
+
+    def start(self, key):
+        """
+        Creates an empty directory for a new cache entry.
+        :param key: The cache key
+        :return: The entry directory
+        """
+        entry_dir = self.entry_dir(key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.makedirs(entry_dir)
+        return entry_dir
+
+    def finish(self, key, step, outputs, result):
+        """
+        Completes a cache entry by writing its metadata, then evicts old entries if the cache is too large.
+        :param key: The cache key
+        :param step: Step name
+        :param outputs: The layer names stored in the entry
+        :param result: A JSON serializable value returned by the step
+        :return: None
+        """
+        with open(os.path.join(self.entry_dir(key), "meta.json"), "w") as meta_file:
+            json.dump({"step": step, "outputs": outputs, "result": result, "created": time.time()}, meta_file)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+        :param: None
+        :return: None
+        """
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self.entry_dir(key)
+            meta_path = os.path.join(entry_dir, "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, name))
+                       for root, dirs, files in os.walk(entry_dir) for name in files)
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+            total += size
+
+        for last_used, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.debug("Evicting step cache entry %s", entry_dir)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
@@ -0,0 +1,323 @@
+"""
+This module contains the tracing layer for the West Nile Virus pipeline. Every traced step records its wall time,
+CPU time, resident memory at its start and end, the process's resident memory high-water mark so far and a row or
+feature count. Steps nest, so a per-row geocode call shows up inside
+the transform step that made it. Finished spans are put on a queue, and a writer thread writes them as JSON lines to
+a trace file next to wnv.log and adds them to a summary table of all steps that can be printed at the end of a run.
+Spans are only measured while a trace is running.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import itertools
+import threading
+import functools
+import logging
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+_summary = {}
+
+# The queue of finished span records and the thread writing them, while a trace is running
+_records = None
+_writer = None
+_registered = False
+
+# The psutil handle of this process, opened again after a fork
+_process = None
+
+
+def current_rss():
+    """
+    Gets the resident memory this process uses now.
+    :param: None
+    :return: Resident memory in bytes, or None if it cannot be measured on this platform
+    """
+    global _process
+    if psutil is not None:
+        if _process is None or _process.pid != os.getpid():
+            _process = psutil.Process()
+        return _process.memory_info().rss
+    try:
+        # The second field of statm is the resident size in pages
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """
+    Gets the resident memory high-water mark of this process. It covers the whole run so far, not one step.
+    :param: None
+    :return: Peak resident memory in bytes, or None if it cannot be measured on this platform
+    """
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, "peak_wset", memory_info.rss)
+    return None
+
+
+def start_trace(path):
+    """
+    Starts writing finished spans to a JSON lines trace file, replacing any previous trace.
+    :param path: Path of the trace file
+    :return: None
+    """
+    global _records, _writer, _registered
+    stop_trace()
+    with _lock:
+        _summary.clear()
+
+    _records = queue.SimpleQueue()
+    _writer = threading.Thread(target=_write_records, args=(_records, open(path, "w")), name="trace-writer",
+                               daemon=True)
+    _writer.start()
+
+    if not _registered:
+        atexit.register(stop_trace)
+        _registered = True
+
+
+def stop_trace():
+    """
+    Writes out the spans still on the queue, stops the writer thread and closes the trace file.
+    :param: None
+    :return: None
+    """
+    global _records, _writer
+    if _writer is not None:
+        _records.put(None)
+        _writer.join()
+        _records = _writer = None
+
+
+def _write_records(records, trace_file):
+    """
+    Runs on the writer thread: writes each span record to the trace file and adds it to the summary, until the
+    None that stop_trace puts on the queue.
+    :param records: The queue of span records
+    :param trace_file: The open trace file
+    :return: None
+    """
+    try:
+        while True:
+            record = records.get()
+            if record is None:
+                return
+            if isinstance(record, threading.Event):
+                # summary_table waits for the records queued before it
+                record.set()
+                continue
+
+            trace_file.write(json.dumps(record, default=str) + "\n")
+            rss_start, rss_end = record["rss_start"], record["rss_end"]
+            growth = rss_end - rss_start if rss_start is not None and rss_end is not None else 0
+            with _lock:
+                totals = _summary.setdefault(record["name"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                                              "rss_growth": 0, "process_peak_rss": 0, "count": 0})
+                totals["calls"] += 1
+                totals["wall_s"] += record["wall_s"]
+                totals["cpu_s"] += record["cpu_s"]
+                totals["rss_growth"] = max(totals["rss_growth"], growth)
+                totals["process_peak_rss"] = max(totals["process_peak_rss"], record["process_peak_rss"] or 0)
+                totals["count"] += record["count"] or 0
+    finally:
+        trace_file.close()
+
+
+class Span:
+    """
+    A class to represent one timed step.
+    """
+
+    def __init__(self, name, parent_id, attributes):
+        """
+        Initializes the span.
+        :param name: Step name
+        :param parent_id: The id of the enclosing span, or None
+        :param attributes: A dictionary of extra values to record
+        :return: None
+        """
+        self.name = name
+        self.id = next(_ids)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.count = None
+
+    def set_count(self, count):
+        """
+        Records the number of rows or features the step handled.
+        :param count: Row or feature count
+        :return: None
+        """
+        self.count = count
+
+
+def _stack():
+    """
+    Gets this thread's stack of open spans.
+    :param: None
+    :return: A list of spans
+    """
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span():
+    """
+    Gets the innermost open span of this thread.
+    :param: None
+    :return: The current Span, or None
+    """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def set_count(count):
+    """
+    Records a row or feature count on the current span.
+    :param count: Row or feature count
+    :return: None
+    """
+    span_ = current_span()
+    if span_ is not None:
+        span_.set_count(count)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Times the code inside the with block as a span.
+    :param name: Step name
+    :param parent: The enclosing Span when it was opened on another thread, the current span by default
+    :param attributes: Extra values to record with the span
+    :return: The Span
+    """
+    if parent is None:
+        parent = current_span()
+    span_ = Span(name, parent.id if parent is not None else None, attributes)
+
+    _stack().append(span_)
+    # Without a running trace the span only keeps nesting intact and measures nothing
+    records = _records
+    rss_start = current_rss() if records is not None else None
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield span_
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        _stack().pop()
+        if records is not None:
+            _record(records, span_, wall, cpu, rss_start, current_rss(), peak_rss())
+
+
+def _record(records, span_, wall, cpu, rss_start, rss_end, process_peak_rss):
+    """
+    Queues a finished span for the writer thread. Putting on a SimpleQueue takes no lock the other threads wait on
+    and does no file I/O.
+    :param records: The queue of span records
+    :param span_: The finished Span
+    :param wall: Wall time in seconds
+    :param cpu: CPU time in seconds
+    :param rss_start: Resident memory in bytes when the span started
+    :param rss_end: Resident memory in bytes when the span ended
+    :param process_peak_rss: The process's resident memory high-water mark in bytes when the span ended
+    :return: None
+    """
+    records.put({"name": span_.name, "id": span_.id, "parent": span_.parent_id, "pid": os.getpid(),
+                 "thread": threading.current_thread().name, "wall_s": round(wall, 6), "cpu_s": round(cpu, 6),
+                 "rss_start": rss_start, "rss_end": rss_end, "process_peak_rss": process_peak_rss,
+                 "count": span_.count, **span_.attributes})
+
+
+def traced(name):
+    """
+    Decorates a function so every call runs in a span. The Entering and Exiting debug log lines are written
+    here, so traced functions do not need to log them.
+    :param name: Step name
+    :return: The decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            logger.debug("Entering %s function", name)
+            try:
+                with span(name):
+                    return func(*args, **kwargs)
+            finally:
+                logger.debug("Exiting %s function", name)
+        return wrapper
+    return decorator
+
+
+def in_current_span(func):
+    """
+    Wraps a function that will run on a worker thread so the spans it opens nest under the current span.
+    :param func: The function to wrap
+    :return: The wrapped function
+    """
+    parent = current_span()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if parent is None or current_span() is not None:
+            return func(*args, **kwargs)
+
+        # Seed the worker thread's stack with the parent so nested spans point at it
+        _stack().append(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _stack().pop()
+    return wrapper
+
+
+def summary_table():
+    """
+    Formats the totals of every step traced since start_trace as a table. RSS growth is the largest rise in
+    resident memory over one call of the step, and the process peak is the high-water mark of the whole process when
+    the step last ended, so it also includes the steps that ran before.
+    :param: None
+    :return: The table as a string
+    """
+    if _writer is not None:
+        written = threading.Event()
+        _records.put(written)
+        written.wait()
+
+    lines = [f"{'Step':<32}{'Calls':>8}{'Wall (s)':>12}{'CPU (s)':>12}{'RSS growth (MB)':>18}"
+             f"{'Process peak (MB)':>20}{'Count':>10}"]
+    with _lock:
+        rows = sorted(_summary.items(), key=lambda item: item[1]["wall_s"], reverse=True)
+    for name, totals in rows:
+        lines.append(f"{name:<32}{totals['calls']:>8}{totals['wall_s']:>12.3f}{totals['cpu_s']:>12.3f}"
+                     f"{totals['rss_growth'] / (1024 * 1024):>18.1f}"
+                     f"{totals['process_peak_rss'] / (1024 * 1024):>20.1f}{totals['count']:>10}")
+    return "\n".join(lines)
@@ -0,0 +1,241 @@
+"""
+This module contains the StubServer class, a local stand-in for the published Google Sheet and the Census
+geocoder. It serves the synthetic address sheet and answers onelineaddress and addressbatch requests from the
+generated geocoder index, after a configurable delay, so the ETL can be benchmarked without a network.
+
+Run it on its own to point finalproject.py at it:
+    python -m Etl.benchmarks.StubServer <dataset directory> --port 8765 --latency 0.05
+"""
+
+import io
+import os
+import csv
+import json
+import gzip
+import time
+import email
+import hashlib
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    A class to represent one request to the stub server.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so without this every keep-alive response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug("Stub server: " + format, *args)
+
+    def send_body(self, body, content_type, headers=None):
+        """
+        Sends a 200 response.
+        :param body: Response bytes
+        :param content_type: Content type header
+        :param headers: A dictionary of extra headers
+        :return: None
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        stub.count(url.path)
+        time.sleep(stub.latency)
+
+        if url.path == "/sheet.csv":
+            if self.headers.get("If-None-Match") == stub.etag:
+                self.send_response(304)
+                self.send_header("ETag", stub.etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            headers = {"ETag": stub.etag}
+            body = stub.sheet
+            if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                headers["Content-Encoding"] = "gzip"
+                body = stub.sheet_gzip
+            self.send_body(body, "text/csv", headers)
+        elif url.path == "/geocoder/locations/onelineaddress":
+            address = parse_qs(url.query).get("address", [""])[0]
+            coordinates = stub.lookup(address)
+            matches = [{"coordinates": {"x": coordinates[0], "y": coordinates[1]}}] if coordinates else []
+            self.send_body(json.dumps({"result": {"addressMatches": matches}}).encode("utf-8"), "application/json")
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        stub.count(url.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if url.path != "/geocoder/locations/addressbatch":
+            self.send_error(404)
+            return
+
+        # Rebuild the multipart form as a MIME message to get at the uploaded file
+        form = email.message_from_bytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+                                        + body)
+        upload = ""
+        for part in form.walk():
+            if part.get_param("name", header="Content-Disposition") == "addressFile":
+                upload = part.get_payload(decode=True).decode("utf-8")
+
+        time.sleep(stub.latency + stub.batch_row_latency * upload.count("\n"))
+
+        output = io.StringIO()
+        csv_writer = csv.writer(output, quoting=csv.QUOTE_ALL)
+        for row in csv.reader(io.StringIO(upload)):
+            unique_id, street, city, state = row[:4]
+            coordinates = stub.lookup(street)
+            input_address = f"{street}, {city}, {state}, "
+            if coordinates:
+                csv_writer.writerow([unique_id, input_address, "Match", "Exact", input_address.upper(),
+                                     f"{coordinates[0]},{coordinates[1]}", "0", "L"])
+            else:
+                csv_writer.writerow([unique_id, input_address, "No_Match"])
+        self.send_body(output.getvalue().encode("utf-8"), "text/csv")
+
+
+class StubServer:
+    """
+    A class to represent the local sheet and geocoder server used by the benchmarks.
+    """
+
+    def __init__(self, sheet_path, index_path, latency=0.0, batch_row_latency=0.0, host="127.0.0.1", port=0):
+        """
+        Loads the sheet and the geocoder index.
+        :param sheet_path: Path to the address sheet csv
+        :param index_path: Path to the geocoder index JSON file of upper case street to [x, y]
+        :param latency: Seconds to wait before answering each request
+        :param batch_row_latency: Extra seconds to wait per address of a batch upload
+        :param host: Host to listen on
+        :param port: Port to listen on, 0 picks a free port
+        :return: None
+        """
+        with open(sheet_path, "rb") as sheet_file:
+            self.sheet = sheet_file.read()
+        self.sheet_gzip = gzip.compress(self.sheet, mtime=0)
+        self.etag = f'"{hashlib.sha1(self.sheet).hexdigest()}"'
+
+        with open(index_path) as index_file:
+            self.index = json.load(index_file)
+
+        self.latency = latency
+        self.batch_row_latency = batch_row_latency
+        self.requests = {}
+        self.lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        Gets the base URL of the server.
+        :param: None
+        :return: The base URL
+        """
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, path):
+        """
+        Counts a request to a path.
+        :param path: Request path
+        :return: None
+        """
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def lookup(self, address):
+        """
+        Finds the coordinates of an address. One line addresses end with the city and state the ETL adds.
+        :param address: Street or one line address
+        :return: An [x, y] list, or None if the address is not in the index
+        """
+        street = " ".join(address.upper().split())
+        if street.endswith(" BOULDER CO"):
+            street = street[:-len(" BOULDER CO")]
+        return self.index.get(street)
+
+    def config(self):
+        """
+        Builds the config keys that point the ETL at this server.
+        :param: None
+        :return: A dictionary of config keys
+        """
+        return {"remote_url": f"{self.url}/sheet.csv",
+                "geocoder_prefix_url": f"{self.url}/geocoder/locations/onelineaddress?address=",
+                "geocoder_suffix_url": "&benchmark=2020&format=json",
+                "geocoder_batch_url": f"{self.url}/geocoder/locations/addressbatch"}
+
+    def start(self):
+        """
+        Starts serving on a background thread.
+        :param: None
+        :return: The StubServer
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server.
+        :param: None
+        :return: None
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    """
+    Serves a generated dataset until interrupted.
+    :param: None
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Serve a synthetic address sheet and geocoder")
+    parser.add_argument("dataset", help="Directory made by SyntheticData.generate")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    args = parser.parse_args()
+
+    server = StubServer(os.path.join(args.dataset, "sheet.csv"), os.path.join(args.dataset, "geocoder_index.json"),
+                        args.latency, port=args.port)
+    for key, value in server.config().items():
+        print(f"{key}: '{value}'")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+This module generates the synthetic Boulder-like datasets used by the benchmarks: a Google Sheets style address
+sheet, an address point layer, the four buffer layers of buffer_layer_list and the geocoder index the stub
+geocoder answers from. Everything is drawn from a seeded random generator, so the same scale and seed always
+produce the same files.
+
+Coordinates are in a projected coordinate system in feet around Boulder (State Plane Colorado North), and the
+stub geocoder returns them as they are, so the benchmark configuration leaves geojson_epsg unset.
+"""
+
+import os
+import csv
+import json
+import math
+import random
+import datetime
+
+# Bump when the generated data changes, so datasets made by an older generator are rebuilt
+GENERATOR_VERSION = 1
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+# A Boulder-sized extent in State Plane feet
+XMIN, YMIN, XMAX, YMAX = 3040000.0, 1220000.0, 3110000.0, 1290000.0
+
+STREET_NAMES = ["Arapahoe Ave", "Baseline Rd", "Broadway", "Pearl St", "Canyon Blvd", "Table Mesa Dr", "Folsom St",
+                "Valmont Rd", "Iris Ave", "Jay Rd", "Mapleton Ave", "Spruce St", "Walnut St", "Marine St",
+                "College Ave", "Aurora Ave", "Colorado Ave", "Hanover Ave", "Balsam Ave", "Alpine Ave", "Linden Ave",
+                "Sumac Ave", "Kalmia Ave", "Norwood Ave", "Cherryvale Rd", "Foothills Pkwy", "Mohawk Dr",
+                "Moorhead Ave", "Darley Ave", "Hawthorn Ave", "Glenwood Dr", "Independence Rd", "Lehigh St",
+                "Gapter Rd", "Pine St", "High St", "Euclid Ave", "Grape Ave", "Bluff St", "Dellwood Ave"]
+
+BUFFER_LAYERS = {
+    # Layer name: (geometry type, min radius, max radius) in feet
+    "Mosquito_Larval_Sites": ("Point", 0, 0),
+    "Wetlands": ("Polygon", 200, 800),
+    "Lakes_and_Reservoirs___Boulder_County": ("Polygon", 300, 1500),
+    "OSMP_Properties": ("Polygon", 1500, 5000),
+}
+
+
+def scale_size(scale):
+    """
+    Converts a scale name such as 10k, or a plain number, to a row count.
+    :param scale: Scale name or number of rows
+    :return: The number of rows
+    """
+    return SCALES[scale] if scale in SCALES else int(scale)
+
+
+def clustered_point(rng, centers, spread=4000.0):
+    """
+    Draws a point near one of the neighborhood centers, clipped to the extent.
+    :param rng: A random.Random
+    :param centers: A list of (x, y) neighborhood centers
+    :param spread: Standard deviation of the distance from the center in feet
+    :return: An (x, y) tuple
+    """
+    cx, cy = rng.choice(centers)
+    x = min(max(rng.gauss(cx, spread), XMIN), XMAX)
+    y = min(max(rng.gauss(cy, spread), YMIN), YMAX)
+    return round(x, 2), round(y, 2)
+
+
+def polygon_ring(rng, x, y, min_radius, max_radius):
+    """
+    Builds a closed, star shaped polygon ring around a point, which is always a valid polygon.
+    :param rng: A random.Random
+    :param x: Center x
+    :param y: Center y
+    :param min_radius: Smallest vertex distance from the center
+    :param max_radius: Largest vertex distance from the center
+    :return: A list of [x, y] vertices, first and last equal
+    """
+    sides = rng.randint(8, 16)
+    radius = rng.uniform(min_radius, max_radius)
+    ring = []
+    for i in range(sides):
+        angle = 2 * math.pi * i / sides
+        distance = radius * rng.uniform(0.7, 1.0)
+        ring.append([round(x + distance * math.cos(angle), 2), round(y + distance * math.sin(angle), 2)])
+    ring.append(ring[0])
+    return ring
+
+
+def write_collection(path, features):
+    """
+    Writes features to a GeoJSON file.
+    :param path: Path to the GeoJSON file
+    :param features: A list of (geometry dictionary, properties) tuples
+    :return: None
+    """
+    collection = {"type": "FeatureCollection",
+                  "features": [{"type": "Feature", "geometry": geometry, "properties": properties}
+                               for geometry, properties in features]}
+    with open(path, "w") as layer_file:
+        json.dump(collection, layer_file)
+
+
+def street_addresses(rng, count):
+    """
+    Draws unique street addresses.
+    :param rng: A random.Random
+    :param count: Number of addresses
+    :return: A list of street addresses
+    """
+    addresses = set()
+    ordered = []
+    while len(ordered) < count:
+        street = f"{rng.randint(100, 9999)} {rng.choice(STREET_NAMES)}"
+        if street not in addresses:
+            addresses.add(street)
+            ordered.append(street)
+    return ordered
+
+
+def generate(out_dir, scale="1k", seed=2023, unmatched_rate=0.02):
+    """
+    Generates a dataset, or reuses the one already in out_dir if it was made with the same settings.
+    :param out_dir: Directory to write the dataset to
+    :param scale: Scale name (1k, 10k or 100k) or number of addresses
+    :param seed: Random seed
+    :param unmatched_rate: Fraction of sheet rows whose address the geocoder does not know
+    :return: A dictionary with the paths of the sheet, the GeoJSON directory and the geocoder index
+    """
+    size = scale_size(scale)
+    settings = {"version": GENERATOR_VERSION, "size": size, "seed": seed, "unmatched_rate": unmatched_rate}
+    paths = {"sheet": os.path.join(out_dir, "sheet.csv"),
+             "geojson_dir": os.path.join(out_dir, "geojson"),
+             "geocoder_index": os.path.join(out_dir, "geocoder_index.json")}
+    manifest_path = os.path.join(out_dir, "dataset.json")
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            if json.load(manifest_file) == settings:
+                return paths
+
+    os.makedirs(paths["geojson_dir"], exist_ok=True)
+    rng = random.Random(seed)
+    centers = [(rng.uniform(XMIN + 10000, XMAX - 10000), rng.uniform(YMIN + 10000, YMAX - 10000))
+               for _ in range(8)]
+
+    # Address points, which the analysis counts and the stub geocoder matches sheet rows against
+    streets = street_addresses(rng, size)
+    index = {}
+    features = []
+    for street in streets:
+        x, y = clustered_point(rng, centers)
+        index[street.upper()] = [x, y]
+        features.append(({"type": "Point", "coordinates": [x, y]}, {"ADDRESS": street}))
+    write_collection(os.path.join(paths["geojson_dir"], "addresses.geojson"), features)
+
+    # The buffer layers grow with the scale, so buffering and intersecting do too
+    layer_size = max(20, size // 20)
+    for layer, (geometry_type, min_radius, max_radius) in BUFFER_LAYERS.items():
+        features = []
+        for fid in range(1, layer_size + 1):
+            x, y = clustered_point(rng, centers)
+            if geometry_type == "Point":
+                geometry = {"type": "Point", "coordinates": [x, y]}
+            else:
+                geometry = {"type": "Polygon", "coordinates": [polygon_ring(rng, x, y, min_radius, max_radius)]}
+            features.append((geometry, {"OBJECTID": fid}))
+        write_collection(os.path.join(paths["geojson_dir"], f"{layer.lower()}.geojson"), features)
+
+    # The sheet asks residents to opt out, so its rows are addresses from the address layer
+    timestamp = datetime.datetime(2023, 6, 1, 8, 0, 0)
+    with open(paths["sheet"], "w", newline='') as sheet_file:
+        csv_writer = csv.writer(sheet_file)
+        csv_writer.writerow(["Timestamp", "Street Address:"])
+        for row in range(size):
+            if rng.random() < unmatched_rate:
+                street = f"{rng.randint(1, 99)} Unknown Ln"
+            else:
+                street = rng.choice(streets)
+            timestamp += datetime.timedelta(seconds=rng.randint(1, 120))
+            csv_writer.writerow([f"{timestamp.month}/{timestamp.day}/{timestamp.year} {timestamp:%H:%M:%S}", street])
+
+    with open(paths["geocoder_index"], "w") as index_file:
+        json.dump(index, index_file)
+
+    # The manifest is written last, so an interrupted run is regenerated next time
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(settings, manifest_file)
+
+    return paths
@@ -0,0 +1,315 @@
+"""
+This module runs the offline benchmarks. It generates (or reuses) a synthetic dataset, starts the stub sheet and
+geocoder server, and times GSheetsEtl.extract, transform and load and the analysis steps of finalproject.py with
+the shapely geometry backend. Each step runs several times and the median is reported.
+
+The results are written as JSON together with the git commit, the benchmark settings and the result of every step
+(row and address counts), so two result files can be compared with --compare. A comparison is only meaningful
+when the settings match, and a changed count means the change under test also changed the output.
+
+    python -m Etl.benchmarks.benchmark --scale 10k --latency 0.01 --repeat 5
+    python -m Etl.benchmarks.benchmark --scale 10k --latency 0.01 --repeat 5 --compare base.json
+"""
+
+import os
+import gc
+import csv
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from Etl.GSheetsEtl import GSheetsEtl
+from Etl.GeometryBackend import create_backend, parse_distance
+from Etl.RasterOverlay import raster_count
+from Etl.LogConfig import setup_logging, stop_logging
+from Etl.benchmarks.SyntheticData import generate, BUFFER_LAYERS
+from Etl.benchmarks.StubServer import StubServer
+
+# Settings that must match for two result files to be comparable
+COMPARABLE_SETTINGS = ["scale", "seed", "latency", "concurrency", "geocoder_mode", "local_geocoder",
+                       "buffer_distance", "avoid_distance", "raster_cell_size", "log_level", "layer_format"]
+
+
+def git_commit():
+    """
+    Gets the commit being benchmarked.
+    :param: None
+    :return: A (commit hash, dirty) tuple, or (None, None) outside a git checkout
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=here, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(status)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def measure(func, repeat, before=None):
+    """
+    Times a function over several runs.
+    :param func: The function to time, its return value is recorded as the step result
+    :param repeat: Number of runs
+    :param before: A function run, untimed, before each run
+    :return: A dictionary of the median, minimum and individual run times and the last result
+    """
+    runs = []
+    result = None
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(runs), "min_s": min(runs), "runs": runs, "result": result}
+
+
+def count_rows(path):
+    """
+    Counts the data rows of a csv file.
+    :param path: Path to the csv file
+    :return: The number of rows
+    """
+    with open(path, newline='') as csv_file:
+        return sum(1 for row in csv.DictReader(csv_file))
+
+
+def etl_benchmarks(config_dict, repeat):
+    """
+    Times the extract, transform and load steps of GSheetsEtl against the stub server.
+    :param config_dict: A dictionary containing configuration settings
+    :param repeat: Number of runs of each step
+    :return: A dictionary of step name to timing
+    """
+    etl = GSheetsEtl(config_dict)
+    proj_dir = config_dict['proj_dir']
+
+    def reset_extract():
+        # Without the saved ETag the sheet is downloaded every run instead of answered with a 304
+        for name in ("addresses.csv", "addresses.meta.json"):
+            if os.path.exists(os.path.join(proj_dir, name)):
+                os.remove(os.path.join(proj_dir, name))
+
+    def extract():
+        etl.extract()
+        return count_rows(os.path.join(proj_dir, "addresses.csv"))
+
+    def transform():
+        etl.transform()
+        return count_rows(os.path.join(proj_dir, "output.csv"))
+
+    def load():
+        etl.load()
+        return len(create_backend(config_dict).read_geometries("avoid_points"))
+
+    results = {"extract": measure(extract, repeat, reset_extract)}
+    results["transform"] = measure(transform, repeat)
+    results["load"] = measure(load, repeat)
+    results["load"]["bytes_written"] = os.path.getsize(create_backend(config_dict).layer_path("avoid_points"))
+    etl.http.close()
+    return results
+
+
+def analysis_benchmarks(config_dict, repeat, buffer_distance, avoid_distance, raster_cell_size):
+    """
+    Times the analysis steps of finalproject.py on the loaded avoid points and the synthetic layers.
+    :param config_dict: A dictionary containing configuration settings
+    :param repeat: Number of runs of each step
+    :param buffer_distance: Buffer distance of every layer in buffer_layer_list
+    :param avoid_distance: Buffer distance of the avoid points
+    :param raster_cell_size: Cell size of the raster preview
+    :return: A dictionary of step name to timing
+    """
+    backend = create_backend(config_dict)
+    layers = config_dict['buffer_layer_list']
+    buffer_layers = [f"buf_{layer}" for layer in layers]
+    results = {}
+
+    def buffer_all():
+        for layer, out_layer in zip(layers, buffer_layers):
+            backend.buffer(layer, out_layer, buffer_distance)
+        return len(buffer_layers)
+
+    def buffer_avoid_points():
+        backend.buffer("Avoid_Points", "buf_Avoid_Points", avoid_distance)
+        return len(backend.read_geometries("Avoid_Points"))
+
+    def intersect():
+        backend.intersect(buffer_layers, "intersect")
+        return len(backend.read_geometries("intersect"))
+
+    def erase():
+        backend.erase("intersect", "buf_Avoid_Points", "intersect_minus_avoidPoints")
+        return len(backend.read_geometries("intersect_minus_avoidPoints"))
+
+    results["buffer"] = measure(buffer_all, repeat)
+    results["buffer_avoid_points"] = measure(buffer_avoid_points, repeat)
+    results["intersect"] = measure(intersect, repeat)
+    results["erase"] = measure(erase, repeat)
+
+    def join_and_count():
+        backend.spatial_join("Addresses", "intersect_minus_avoidPoints", "joined_addresses")
+        return backend.count_within("joined_addresses", "intersect_minus_avoidPoints")
+
+    results["spatial_join_count"] = measure(join_and_count, repeat)
+    results["classify_addresses"] = measure(
+        lambda: backend.classify_addresses("Addresses", "intersect_minus_avoidPoints", "target_addresses")[1],
+        repeat)
+
+    def raster_preview():
+        unit = backend.linear_unit("Addresses")
+        raster_layers = [(layer, parse_distance(buffer_distance, unit)) for layer in layers]
+        avoid_layer = ("Avoid_Points", parse_distance(avoid_distance, unit))
+        # No mask cache, so every repeat times the full rasterization
+        return raster_count(backend.read_geometries, raster_layers, avoid_layer, "Addresses", raster_cell_size)
+
+    results["raster_preview"] = measure(raster_preview, repeat)
+    # The preview is only worth running while it is cheaper than the exact steps it stands in for
+    results["raster_preview"]["vector_s"] = sum(results[step]["median_s"] for step in
+                                                ("buffer", "buffer_avoid_points", "intersect", "erase",
+                                                 "classify_addresses"))
+    return results
+
+
+def run(args):
+    """
+    Runs the benchmarks.
+    :param args: The parsed command line arguments
+    :return: The results dictionary
+    """
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "wnv_benchmark_data", f"{args.scale}_{args.seed}")
+    dataset = generate(data_dir, args.scale, args.seed)
+    commit, dirty = git_commit()
+
+    results = {"commit": commit, "dirty": dirty, "python": platform.python_version(),
+               "platform": platform.platform(), "cpu_count": os.cpu_count(), "repeat": args.repeat,
+               "settings": {"scale": args.scale, "seed": args.seed, "latency": args.latency,
+                            "concurrency": args.concurrency, "geocoder_mode": args.geocoder_mode,
+                            "local_geocoder": args.local_geocoder, "log_level": args.log_level,
+                            "layer_format": args.layer_format,
+                            "buffer_distance": args.buffer_distance, "avoid_distance": args.avoid_distance,
+                            "raster_cell_size": args.raster_cell_size},
+               "steps": {}}
+
+    with tempfile.TemporaryDirectory(prefix="wnv_benchmark_") as work_dir, \
+            StubServer(dataset["sheet"], dataset["geocoder_index"], args.latency) as stub:
+        # Work on a copy so the loads and analysis outputs never touch the generated dataset
+        geojson_dir = os.path.join(work_dir, "geojson")
+        shutil.copytree(dataset["geojson_dir"], geojson_dir)
+        log_path = os.path.join(work_dir, "wnv.log")
+        setup_logging({'log_level': args.log_level}, log_path)
+
+        config_dict = {"proj_dir": work_dir + os.sep, "geometry_backend": "shapely", "geojson_dir": geojson_dir,
+                       "geojson_linear_unit": "Feet", "geojson_epsg": None, "layer_format": args.layer_format,
+                       "geocode_cache": False,
+                       "incremental": False, "geocoder_concurrency": args.concurrency,
+                       "geocoder_mode": args.geocoder_mode, "geocoder_batch_size": 1000,
+                       "local_geocoder": args.local_geocoder, "local_geocoder_source": "Addresses",
+                       "local_geocoder_address_field": "ADDRESS",
+                       "buffer_layer_list": list(BUFFER_LAYERS), **stub.config()}
+
+        if args.steps in ("all", "etl"):
+            results["steps"].update(etl_benchmarks(config_dict, args.repeat))
+        elif not create_backend(config_dict).exists("avoid_points"):
+            # The analysis needs the avoid points, so load them once without timing it
+            GSheetsEtl(config_dict).process()
+
+        if args.steps in ("all", "analysis"):
+            results["steps"].update(analysis_benchmarks(config_dict, args.repeat, args.buffer_distance,
+                                                        args.avoid_distance, args.raster_cell_size))
+        results["stub_requests"] = dict(stub.requests)
+
+        stop_logging()
+        results["log_bytes"] = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+
+    return results
+
+
+def compare(base, results):
+    """
+    Prints the step timings of two result files side by side.
+    :param base: The results to compare against
+    :param results: The new results
+    :return: None
+    """
+    mismatched = [name for name in COMPARABLE_SETTINGS
+                  if base["settings"].get(name) != results["settings"].get(name)]
+    if mismatched:
+        print(f"Warning: the runs used different settings ({', '.join(mismatched)}), the timings are not comparable")
+    if base.get("cpu_count") != results.get("cpu_count") or base.get("python") != results.get("python"):
+        print("Warning: the runs used different machines or Python versions")
+
+    print(f"{'Step':<24}{'Base (s)':>12}{'New (s)':>12}{'Ratio':>10}  Result")
+    for step, timing in results["steps"].items():
+        base_timing = base["steps"].get(step)
+        if base_timing is None:
+            print(f"{step:<24}{'':>12}{timing['median_s']:>12.4f}{'':>10}  new step")
+            continue
+        ratio = timing["median_s"] / base_timing["median_s"] if base_timing["median_s"] else float("nan")
+        changed = "same" if timing["result"] == base_timing["result"] else \
+            f"changed {base_timing['result']} -> {timing['result']}"
+        print(f"{step:<24}{base_timing['median_s']:>12.4f}{timing['median_s']:>12.4f}{ratio:>10.2f}  {changed}")
+
+
+def main():
+    """
+    Parses the command line, runs the benchmarks and writes the results.
+    :param: None
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Run the offline West Nile Virus benchmarks")
+    parser.add_argument("--scale", default="1k", help="1k, 10k, 100k or a number of addresses")
+    parser.add_argument("--seed", type=int, default=2023)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each step, the median is reported")
+    parser.add_argument("--latency", type=float, default=0.005, help="Stub server delay per request in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="The geocoder_concurrency config key")
+    parser.add_argument("--geocoder-mode", default="onelineaddress", choices=["onelineaddress", "batch"])
+    parser.add_argument("--local-geocoder", action="store_true",
+                        help="Match addresses against the synthetic address points before the stub geocoder")
+    parser.add_argument("--log-level", default="WARNING",
+                        help="Level of the benchmark's wnv.log, set DEBUG to measure the cost of debug logging")
+    parser.add_argument("--layer-format", default="geojson", choices=["geojson", "gpkg"],
+                        help="The layer_format config key, the file format the loads and analysis write")
+    parser.add_argument("--buffer-distance", default="1500 Feet")
+    parser.add_argument("--avoid-distance", default="500 Feet")
+    parser.add_argument("--raster-cell-size", type=float, default=50.0)
+    parser.add_argument("--steps", default="all", choices=["all", "etl", "analysis"])
+    parser.add_argument("--data-dir", help="Where to keep the generated dataset, a temporary directory by default")
+    parser.add_argument("--output", help="Results file, benchmark_results/<scale>_<commit>.json by default")
+    parser.add_argument("--compare", help="A results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    output = args.output or os.path.join("benchmark_results",
+                                         f"{args.scale}_{(results['commit'] or 'nogit')[:10]}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    print(f"{'Step':<24}{'Median (s)':>12}{'Min (s)':>12}  Result")
+    for step, timing in results["steps"].items():
+        print(f"{step:<24}{timing['median_s']:>12.4f}{timing['min_s']:>12.4f}  {timing['result']}")
+    if "load" in results["steps"]:
+        print(f"avoid_points is {results['steps']['load']['bytes_written']} bytes")
+    if "raster_preview" in results["steps"]:
+        preview = results["steps"]["raster_preview"]
+        print(f"The raster preview took {preview['median_s']:.4f} s, the vector steps it previews took "
+              f"{preview['vector_s']:.4f} s")
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as base_file:
+            compare(json.load(base_file), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,35 +7,69 @@ symbology of layers and exports the map to a PDF file with a user-defined subtit
 """
 
 import yaml
-import arcpy
 import logging
 import datetime
+import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from Etl.GSheetsEtl import GSheetsEtl
+from Etl.GeoJsonEtl import GeoJsonEtl
+from Etl.MultiSourceEtl import MultiSourceEtl
+from Etl.GeometryBackend import create_backend, parse_distance, buffer_worker
+from Etl.ScenarioSweep import ScenarioSweep
+from Etl.StepCache import StepCache
+from Etl.ProjectSession import ProjectSession
+from Etl.MapExport import set_layout_text, export_worker
+from Etl.Tracing import traced, set_count, start_trace, stop_trace, summary_table
+from Etl.LogConfig import setup_logging, stop_logging
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+logger = logging.getLogger(__name__)
 
 config_dict = None
 
+# The geometry backend (arcpy or shapely) that runs the analysis steps
+backend = None
+
+# The step cache, when the step_cache config key is set
+step_cache = None
+
+# The open ArcGIS Pro project, when the backend has a map
+project_session = None
+
+# The raster preview masks, keyed on layer, distance and grid, kept for the rest of the run
+raster_masks = {}
+
 # Create an empty list for output layer names for later use in the intersect function
 buffer_layer_name_list = []
 
 
+@traced("etl")
 def etl():
     """
-    Extracts, transforms, and loads data from Google Sheets.
+    Extracts, transforms, and loads data from Google Sheets, then streams each GeoJSON export listed in the
+    geojson_sources config key into its layer. When the sources config key lists several sheets they are
+    processed together and loaded into avoid_points at once.
     :param: None
     :return: None
     """
     global config_dict
-    logging.debug("Entering etl function")
 
     try:
-        etl_instance = GSheetsEtl(config_dict)
+        if config_dict.get('sources'):
+            etl_instance = MultiSourceEtl(config_dict)
+        else:
+            etl_instance = GSheetsEtl(config_dict)
         etl_instance.process()
     except Exception as e:
         print(f"Error in ETL {e}")
 
-
-    logging.debug("Exiting etl function")
-
+    for source in config_dict.get('geojson_sources') or []:
+        GeoJsonEtl(config_dict, source).process()
 
 
 def setup():
@@ -44,180 +78,423 @@ def setup():
     :param: None
     :return: Configuration dictionary
     """
-    global config_dict
+    global config_dict, backend, project_session
     with open('config/wnvoutbreak.yaml') as f:
         config_dict = yaml.load(f, Loader=yaml.FullLoader)
 
+    backend = create_backend(config_dict)
+    if backend.has_map:
+        project_session = ProjectSession(f"{config_dict.get('proj_dir')}WestNileOutbreak.aprx")
 
-    arcpy.env.workspace = fr"{config_dict.get('proj_dir')}WestNileOutbreak.gdb"
-    arcpy.env.overwriteOutput = True
-
-    logging.basicConfig(filename=f"{config_dict.get('proj_dir')}wnv.log", filemode="w", level=logging.DEBUG)
+    setup_logging(config_dict)
+    start_trace(f"{config_dict.get('proj_dir')}wnv_trace.jsonl")
 
     return config_dict
 
 
+def scratch(layer):
+    """
+    Gets the name of an intermediate layer in the scratch workspace. Only the final deliverables are written to
+    the project workspace when the scratch_workspace config key is memory.
+    :param layer: Layer name
+    :return: The layer name in the scratch workspace
+    """
+    return backend.scratch_name(layer)
+
+
+@traced("delete_if_exists")
 def delete_if_exists(layer):
     """
     A helper function that deletes a specified layer to keep things tidy.
     :param layer: Layer to be deleted if it exists
     :return: None
     """
-    logging.debug(f"Entering delete_if_exists function for layer {layer}")
-
     try:
-        if arcpy.Exists(layer):
-            arcpy.Delete_management(layer)
+        if backend.exists(layer):
+            backend.delete(layer)
     except Exception as e:
         print(f"Error in delete_if_exists {layer} {e}")
 
-    logging.debug("Exiting delete_if_exists function")
 
-def buffer(layer_name):
+@traced("buffer")
+def buffer(layer_name, buf_dist=None):
     """
     Buffers a layer by the specified distance and adds output layer name to buffer_layer_name_list.
     :param layer_name: The name of the layer to buffer
+    :param buf_dist: The buffer distance, asked for when not given
     :return: None
     """
-    logging.debug("Entering buffer function")
     # Ask for a buffer distance for the given layer
-    buf_dist = input(f"Please input a buffer distance for {layer_name}")
+    if buf_dist is None:
+        buf_dist = input(f"Please input a buffer distance for {layer_name}")
 
     try:
         # Buffer the incoming layer by the buffer distance and add names to the list
-        output_buffer_layer_name = f"buf_{layer_name}"
-        logging.debug(f"Buffering {layer_name} to generate {output_buffer_layer_name} layer...")
+        output_buffer_layer_name = scratch(f"buf_{layer_name}")
+        logger.debug("Buffering %s to generate %s layer...", layer_name, output_buffer_layer_name)
         buffer_layer_name_list.append(output_buffer_layer_name)
 
         # Run the buffer analysis
-        arcpy.analysis.Buffer(layer_name, output_buffer_layer_name, buf_dist, "FULL", "ROUND", "All")
+        backend.buffer(layer_name, output_buffer_layer_name, buf_dist)
     except Exception as e:
         print(f"Error in buffer function {e}")
 
-    logging.debug("Exiting buffer function")
-
 
-def buffer_processing():
+@traced("buffer_processing")
+def buffer_processing(distances=None, buffer_layer_list=None):
     """
     Buffers multiple input layers based on the configuration dictionary.
-    :param: None
+    :param distances: A dictionary of layer name to buffer distance, distances are asked for when not given
+    :param buffer_layer_list: The names of the layers to buffer, buffer_layer_list from the configuration by default
     :return: None
     """
     global config_dict
-    logging.debug("Entering buffer_processing function")
 
     try:
-        buffer_layer_list = config_dict["buffer_layer_list"]
+        buffer_layer_list = buffer_layer_list or config_dict["buffer_layer_list"]
+
+        if int(config_dict.get('buffer_workers', 1) or 1) > 1:
+            parallel_buffer_processing(buffer_layer_list, distances)
+            return
 
         # Loop through the layers in layer list and create the appropriate buffer for each layer
         for layer in buffer_layer_list:
-            buffer(layer)
+            buffer(layer, (distances or {}).get(layer))
     except Exception as e:
         print(f"Error in buffer_processing {e}")
 
-    logging.debug("Exiting buffer_processing function")
 
+@traced("parallel_buffer_processing")
+def parallel_buffer_processing(buffer_layer_list, distances=None):
+    """
+    Buffers the layers in a pool of buffer_workers processes, each with its own scratch workspace, and adds the
+    output layer names to buffer_layer_name_list in the order of buffer_layer_list.
+    :param buffer_layer_list: The names of the layers to buffer
+    :param distances: A dictionary of layer name to buffer distance, distances are asked for when not given
+    :return: None
+    """
+    global config_dict
+
+    # Workers cannot prompt, so every distance is collected before the pool starts
+    distances = {layer: (distances or {}).get(layer) or input(f"Please input a buffer distance for {layer}")
+                 for layer in buffer_layer_list}
+    workers = min(int(config_dict['buffer_workers']), len(buffer_layer_list))
+
+    with tempfile.TemporaryDirectory(prefix="wnv_buffers_") as scratch_dir, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(buffer_worker, config_dict, layer, f"buf_{layer}", distances[layer], scratch_dir)
+                   for layer in buffer_layer_list]
 
-def buffer_avoid_points():
+        # Collect in submission order so the intersect inputs are always in the same order
+        for layer, future in zip(buffer_layer_list, futures):
+            output_buffer_layer_name = scratch(f"buf_{layer}")
+            try:
+                backend.import_buffer(future.result(), output_buffer_layer_name)
+                buffer_layer_name_list.append(output_buffer_layer_name)
+            except Exception as e:
+                print(f"Error buffering {layer} {e}")
+
+
+@traced("buffer_avoid_points")
+def buffer_avoid_points(buf_avoid_answer=None):
     """
     Buffers avoid points and returns the buffered layer.
-    :param: None
+    :param buf_avoid_answer: The buffer distance, asked for when not given
     :return: Buffered avoid points layer name
     """
-    logging.debug("Entering buffer_avoid_points function")
-
     try:
         Avoid_Points = "Avoid_Points"
-        buf_Avoid_Points = "buf_Avoid_Points"
-        buf_avoid_answer = input("Please give a buffer distance for points to avoid")
+        buf_Avoid_Points = scratch("buf_Avoid_Points")
+        if buf_avoid_answer is None:
+            buf_avoid_answer = input("Please give a buffer distance for points to avoid")
         delete_if_exists(buf_Avoid_Points)
-        arcpy.analysis.Buffer(Avoid_Points, buf_Avoid_Points, buf_avoid_answer, "FULL", "ROUND", "All")
+        backend.buffer(Avoid_Points, buf_Avoid_Points, buf_avoid_answer)
     except Exception as e:
         print(f"Error in buffer_avoid_points {e}")
 
-    logging.debug("Exiting buffer_avoid_points function")
     return buf_Avoid_Points
 
 
+def ask_buffer_distances():
+    """
+    Asks for the buffer distance of every layer in the configuration dictionary and of the avoid points.
+    :param: None
+    :return: A (distances, avoid distance) tuple, distances is a dictionary of layer name to buffer distance
+    """
+    global config_dict
+    distances = {layer: input(f"Please input a buffer distance for {layer}")
+                 for layer in config_dict["buffer_layer_list"]}
+    return distances, input("Please give a buffer distance for points to avoid")
+
+
+@traced("raster_preview")
+def raster_preview(distances, avoid_distance):
+    """
+    Estimates the number of addresses to notify with the raster approximation of the buffer, intersect and
+    erase overlay, using the raster_cell_size config key.
+    :param distances: A dictionary of layer name to buffer distance
+    :param avoid_distance: The avoid points buffer distance
+    :return: The estimated number of addresses to notify
+    """
+    global config_dict, raster_masks
+
+    count = None
+    try:
+        # Imported here so NumPy is only needed when the raster mode is used
+        from Etl.RasterOverlay import raster_count
+
+        unit = backend.linear_unit("Addresses")
+        layers = [(layer, parse_distance(distances[layer], unit)) for layer in config_dict["buffer_layer_list"]]
+        avoid_layer = ("Avoid_Points", parse_distance(avoid_distance, unit))
+
+        count = raster_count(backend.read_geometries, layers, avoid_layer, "Addresses",
+                             float(config_dict.get('raster_cell_size', 50)), raster_masks)
+        set_count(count)
+        print(f"About {count} addresses need to be notified (raster preview).")
+    except Exception as e:
+        print(f"Error in raster_preview function {e}")
+
+    return count
+
+
+def restore_step(step, inputs, outputs):
+    """
+    Looks a step up in the step cache and, on a hit, restores its output layers.
+    :param step: Step name
+    :param inputs: A JSON serializable description of everything the step depends on
+    :param outputs: The layer names the step writes
+    :return: A (key, meta) tuple, meta is None on a miss or when the outputs could not be restored
+    """
+    key = step_cache.key(step, inputs)
+    meta = step_cache.get(step, key)
+
+    if meta is not None:
+        try:
+            for layer in outputs:
+                backend.restore_layer(step_cache.entry_dir(key), layer)
+            return key, meta
+        except Exception as e:
+            logger.warning("Could not restore %s from the step cache, running it again: %s", step, e)
+
+    # The step functions print their own errors, so a failed step must not find an older output to leave behind
+    for layer in outputs:
+        delete_if_exists(layer)
+    return key, None
+
+
+def save_step(step, key, outputs, result):
+    """
+    Saves the outputs of a step that has just run to the step cache. A step that did not write all of its
+    outputs has failed, so it raises instead of being cached.
+    :param step: Step name
+    :param key: The cache key from restore_step
+    :param outputs: The layer names the step writes
+    :param result: A JSON serializable value returned by the step
+    :return: None
+    """
+    missing = [layer for layer in outputs if not backend.exists(layer)]
+    if missing:
+        raise RuntimeError(f"The {step} step failed to write {', '.join(missing)}")
+
+    entry_dir = step_cache.start(key)
+    for layer in outputs:
+        backend.save_layer(layer, entry_dir)
+    step_cache.finish(key, step, outputs, result)
+
+
+def run_step(step, inputs, outputs, func):
+    """
+    Runs a step through the step cache. On a hit the step's output layers are restored from the cache, on a
+    miss the step runs and its outputs are saved.
+    :param step: Step name
+    :param inputs: A JSON serializable description of everything the step depends on
+    :param outputs: The layer names the step writes
+    :param func: A function that runs the step and returns a JSON serializable result
+    :return: A (key, result) tuple, the key is passed as an input to the steps that depend on this one
+    """
+    key, meta = restore_step(step, inputs, outputs)
+    if meta is not None:
+        return key, meta["result"]
+
+    result = func()
+    save_step(step, key, outputs, result)
+    return key, result
+
+
+@traced("cached_analysis")
+def cached_analysis(distances, avoid_distance):
+    """
+    Runs the buffer, intersect, erase and join steps through the step cache, so only the steps whose inputs
+    changed since an earlier run are executed.
+    :param distances: A dictionary of layer name to buffer distance
+    :param avoid_distance: The avoid points buffer distance
+    :return: The number of addresses that need to be notified
+    """
+    global config_dict
+
+    count = None
+    try:
+        buffer_layer_list = config_dict["buffer_layer_list"]
+        buffer_keys = []
+        misses = []
+        for layer in buffer_layer_list:
+            key, meta = restore_step("buffer", {"source": backend.fingerprint(layer), "distance": distances[layer]},
+                                     [scratch(f"buf_{layer}")])
+            buffer_keys.append(key)
+            if meta is None:
+                misses.append((layer, key))
+
+        # The buffers missing from the cache are made together, so buffer_workers still buffers them in parallel
+        if misses:
+            buffer_processing(distances, [layer for layer, key in misses])
+            for layer, key in misses:
+                save_step("buffer", key, [scratch(f"buf_{layer}")], None)
+        buffer_layer_name_list[:] = [scratch(f"buf_{layer}") for layer in buffer_layer_list]
+
+        avoid_key, result = run_step("buffer_avoid_points",
+                                     {"source": backend.fingerprint("Avoid_Points"), "distance": avoid_distance},
+                                     [scratch("buf_Avoid_Points")], lambda: buffer_avoid_points(avoid_distance))
+        intersect_key, result = run_step("intersect", {"buffers": buffer_keys}, [scratch("intersect")],
+                                         lambda: intersect(scratch("intersect")))
+        erase_key, result = run_step("erase", {"intersect": intersect_key, "avoid": avoid_key},
+                                     ["intersect_minus_avoidPoints"],
+                                     lambda: erase(scratch("buf_Avoid_Points"), scratch("intersect"), False))
+        # A cache hit restores the layer without running erase, so the map gets it here on a hit or a miss
+        add_layer_to_map("intersect_minus_avoidPoints")
+
+        def join():
+            if config_dict.get('single_pass_join'):
+                delete_if_exists("target_addresses")
+                return backend.classify_addresses("Addresses", "intersect_minus_avoidPoints", "target_addresses")[1]
+            spatial_join("intersect_minus_avoidPoints")
+            return count_addresses_within_layer(scratch("joined_addresses"), "intersect_minus_avoidPoints")
+
+        outputs = ["target_addresses"] if config_dict.get('single_pass_join') else [scratch("joined_addresses")]
+        join_key, count = run_step("join", {"zones": erase_key, "addresses": backend.fingerprint("Addresses"),
+                                            "single_pass": bool(config_dict.get('single_pass_join'))},
+                                   outputs, join)
+        set_count(count)
+        print(f"{count} addresses need to be notified.")
+    except Exception as e:
+        print(f"Error in cached_analysis function {e}")
+
+    return count
+
+
+@traced("sweep")
+def sweep():
+    """
+    Runs the analysis for every combination of buffer distances in the sweep section of the configuration
+    dictionary and prints a table of notification counts.
+    :param: None
+    :return: None
+    """
+    global config_dict
+
+    scenario_sweep = ScenarioSweep(backend, config_dict)
+    try:
+        results = scenario_sweep.run()
+
+        columns = config_dict["buffer_layer_list"] + ["Avoid_Points", "Notifications"]
+        print(" | ".join(columns))
+        for result in results:
+            print(" | ".join(str(result[column]) for column in columns))
+        print(f"Results written to {scenario_sweep.output}")
+    except Exception as e:
+        print(f"Error in sweep function {e}")
+    finally:
+        if not (config_dict.get('sweep') or {}).get('keep_layers'):
+            scenario_sweep.cleanup()
+
+
+@traced("intersect")
 def intersect(intersect_lyr_name="intersect"):
     """
     Run an intersect operation on multiple input layers.
     :param intersect_lyr_name: Name of the output intersect layer
     :return: None
     """
-    logging.debug("Entering intersect function")
-
     try:
-        arcpy.Intersect_analysis(buffer_layer_name_list, intersect_lyr_name)
+        backend.intersect(buffer_layer_name_list, intersect_lyr_name)
     except Exception as e:
         print(f"Error in intersect function {e}")
 
-    logging.debug("Exiting intersect function")
-
 
+@traced("spatial_join")
 def spatial_join(intersect_minus_avoidPoints_lyr):
     """
     Joins the address layer with the intersect_minus_avoidPoints layer.
     :param intersect_minus_avoidPoints_lyr: Layer name to be joined with the address layer
     :return: None
     """
-    logging.debug("Entering join function")
-
     try:
-        delete_if_exists("joined_addresses")
-        arcpy.analysis.SpatialJoin("Addresses", intersect_minus_avoidPoints_lyr, "joined_addresses")
+        delete_if_exists(scratch("joined_addresses"))
+        backend.spatial_join("Addresses", intersect_minus_avoidPoints_lyr, scratch("joined_addresses"))
     except Exception as e:
         print(f"Error in spatial_join function {e}")
 
-    logging.debug("Exiting join function")
 
+@traced("process_joined_addresses")
 def process_joined_addresses(buf_Avoid_Points, intersect_lyr_name):
     """
     Performs the intersect, erase, and spatial join operations.
     :param buf_Avoid_Points: Buffered avoid points layer name
     :param intersect_lyr_name: Name of the output intersect layer
-    :return: None
+    :return: The number of addresses that need to be notified
     """
-    logging.debug("Entering process_joined_addresses function")
+    global config_dict
 
+    count = None
     try:
         intersect(intersect_lyr_name)
         erase(buf_Avoid_Points, intersect_lyr_name)
+
+        if config_dict.get('single_pass_join'):
+            # Classify every address in one indexed pass, which also writes the target_addresses layer
+            delete_if_exists("target_addresses")
+            joined, count = backend.classify_addresses("Addresses", "intersect_minus_avoidPoints",
+                                                       "target_addresses")
+            logger.debug("%s addresses joined to intersect_minus_avoidPoints", joined)
+            set_count(count)
+            print(f"{count} addresses need to be notified.")
+            return count
+
         spatial_join("intersect_minus_avoidPoints")
 
-        # Create a feature layer from the joined_addresses feature class and print the count
-        arcpy.management.MakeFeatureLayer("joined_addresses", "joined_addresses_layer")
-        count = count_addresses_within_layer("joined_addresses_layer", "intersect_minus_avoidPoints")
+        # Count the joined addresses within the intersect_minus_avoidPoints layer
+        count = count_addresses_within_layer(scratch("joined_addresses"), "intersect_minus_avoidPoints")
+        set_count(count)
         print(f"{count} addresses need to be notified.")
     except Exception as e:
         print(f"Error in process_joined_addresses function {e}")
 
-    logging.debug("Exiting process_joined_addresses function")
+    return count
 
 
-def erase(buf_Avoid_Points, intersect_lyr_name):
+@traced("erase")
+def erase(buf_Avoid_Points, intersect_lyr_name, add_to_map=True):
     """
     Erases the avoid point buffers from the intersect layer and adds the new layer to the map.
     :param buf_Avoid_Points: Buffered avoid points layer name
     :param intersect_lyr_name: Name of the output intersect layer
+    :param add_to_map: False when the caller adds the layer to the map itself
     :return: None
     """
     global config_dict
-    logging.debug("Entering erase function")
 
     try:
-        logging.debug("Creating new layer called intersect_minus_avoidPoints")
+        logger.debug("Creating new layer called intersect_minus_avoidPoints")
         delete_if_exists("intersect_minus_avoidPoints")
         intersect_minus_avoidPoints = "intersect_minus_avoidPoints"
-        arcpy.analysis.Erase(intersect_lyr_name, buf_Avoid_Points, intersect_minus_avoidPoints)
+        backend.erase(intersect_lyr_name, buf_Avoid_Points, intersect_minus_avoidPoints)
 
-        add_layer_to_map("intersect_minus_avoidPoints")
+        if add_to_map:
+            add_layer_to_map("intersect_minus_avoidPoints")
     except Exception as e:
         print(f"Error in erase function{e}")
 
-    logging.debug("Exiting erase function")
-
 
+@traced("add_layer_to_map")
 def add_layer_to_map(added_layer_name):
     """
     A helpful function which adds a layer to the map after first deleting it if it already exists.
@@ -225,29 +502,21 @@ def add_layer_to_map(added_layer_name):
     :return: None
     """
     global config_dict
-    logging.debug(f"Entering add layer function for {added_layer_name}")
+
+    if not backend.has_map:
+        logger.debug("No map to add %s to with this geometry backend", added_layer_name)
+        return
 
     try:
         proj_path = fr"{config_dict.get('proj_dir')}"
-        aprx = arcpy.mp.ArcGISProject(rf"{proj_path}WestNileOutbreak.aprx")
-
-        map_doc = aprx.listMaps()[0]
 
-        # Remove the layer with the same name if it already exists
-        for lyr in map_doc.listLayers():
-            if lyr.name == added_layer_name:
-                map_doc.removeLayer(lyr)
-                break
-
-        map_doc.addDataFromPath(rf"{proj_path}WestNileOutbreak.gdb\{added_layer_name}")
-
-        aprx.save()
+        # The project session replaces any layer with the same name when the changes are saved before export
+        project_session.add_layer(added_layer_name, rf"{proj_path}WestNileOutbreak.gdb\{added_layer_name}")
     except Exception as e:
         print(f"Error in add_layer_to_map function {e}")
 
-    logging.debug("Exiting add layer function")
-
 
+@traced("count_addresses_within_layer")
 def count_addresses_within_layer(target_layer, intersect_minus_avoidPoints):
     """
     Counts the number of addresses within the intersect_minus_avoidPoints layer.
@@ -255,43 +524,38 @@ def count_addresses_within_layer(target_layer, intersect_minus_avoidPoints):
     :param intersect_minus_avoidPoints: Intersect layer for selecting addresses
     :return: Count of addresses within the intersect layer
     """
-    logging.debug("Entering count addresses function")
-
     try:
-        # Select features from the target_layer that are within the intersect_layer
-        arcpy.management.SelectLayerByLocation(target_layer, "WITHIN", intersect_minus_avoidPoints)
-
-        # Count the selected features
-        count = int(arcpy.GetCount_management(target_layer).getOutput(0))
+        # Count the features from the target_layer that are within the intersect_layer
+        count = backend.count_within(target_layer, intersect_minus_avoidPoints)
+        set_count(count)
     except Exception as e:
         print(f"Error in {e}")
 
-    logging.debug("Exiting count addresses function")
-
     return count
 
+
+@traced("select_target_addresses")
 def select_target_addresses():
     """
     Selects addresses within the intersect_minus_avoidPoints buffer and exports them to a new layer.
     :param: None
     :return: None
     """
-    logging.debug("Entering select_target_addresses function")
+    global config_dict
 
     try:
-        delete_if_exists("target_addresses")
-        arcpy.management.MakeFeatureLayer("joined_addresses", "joined_addresses_layer")
-        arcpy.management.SelectLayerByAttribute("joined_addresses_layer", "NEW_SELECTION", "Join_Count = 1")
-        arcpy.management.CopyFeatures("joined_addresses_layer", "target_addresses")
+        # The single pass join has already written target_addresses
+        if not config_dict.get('single_pass_join'):
+            delete_if_exists("target_addresses")
+            backend.select_joined(scratch("joined_addresses"), "target_addresses")
 
         # Add the target_addresses layer to the map
         add_layer_to_map("target_addresses")
     except Exception as e:
         print(f"Error in select_target_addresses function {e}")
 
-    logging.debug("Exiting select_target_addresses function")
-
 
+@traced("pre_export_symbology")
 def pre_export_symbology(lyr_name):
     """
     Changes the symbology of a layer before exporting the map.
@@ -299,64 +563,132 @@ def pre_export_symbology(lyr_name):
     :return: None
     """
     global config_dict
-    logging.debug("Entering pre_export_symbology function")
 
-    try:
-        proj_path = fr"{config_dict.get('proj_dir')}"
-        aprx = arcpy.mp.ArcGISProject(rf"{proj_path}WestNileOutbreak.aprx")
-        map_doc = aprx.listMaps()[0]
+    if not backend.has_map:
+        logger.debug("No map to change the symbology of with this geometry backend")
+        return
 
+    try:
         # Change spatial reference
-        map_doc.spatialReference = arcpy.SpatialReference(2231)
+        project_session.set_spatial_reference(arcpy.SpatialReference(2231))
 
         # Set layer symbology
-        lyr = map_doc.listLayers(lyr_name)[0]
-        sym = lyr.symbology
-
-        sym.renderer.symbol.color = {'RGB': [255, 0, 0, 100]}
-        sym.renderer.symbol.outlineColor = {'RGB': [0, 0, 0, 100]}
-        lyr.symbology = sym
-        lyr.transparency = 50
-
-        aprx.save()
+        project_session.set_symbology(lyr_name, {'RGB': [255, 0, 0, 100]}, {'RGB': [0, 0, 0, 100]}, 50)
     except Exception as e:
         print(f"Error in pre_export_symbology function {e}")
 
-    logging.debug("Exiting pre_export_symbology function")
-
 
+@traced("exportMap")
 def exportMap():
     """
-    Exports the map with user-defined subtitle and current date/time.
+    Exports the map with user-defined subtitle and current date/time. When the export_batch config key lists
+    several subtitles the maps are exported by batch_export instead.
     :param: None
     :return: None
     """
     global config_dict
-    logging.debug("Entering Export function")
+
+    if not backend.has_map:
+        logger.debug("No map to export with this geometry backend")
+        return
+
+    if config_dict.get('export_batch'):
+        batch_export(config_dict['export_batch'])
+        return
 
     try:
-        aprx = arcpy.mp.ArcGISProject(f"{config_dict.get('proj_dir')}WestNileOutbreak.aprx")
-        lyt = aprx.listLayouts()[0]
+        # Save every queued map change once, then export from the same open project
+        lyt = project_session.layout()
         user_subtitle = input("Please enter the sub-title for the output map: ")
 
         current_date = datetime.datetime.now().strftime("%m/%d/%Y")
         current_time = datetime.datetime.now().strftime("%I:%M %p")
 
-        for el in lyt.listElements():
-            logging.debug(el.name)
-            if "Title" in el.name:
-                el.text = el.text + user_subtitle
-            elif "Date" in el.name:
-                el.text = f"{current_date}"
-            elif "Time" in el.name:
-                el.text = f"{current_time}"
+        set_layout_text(lyt, user_subtitle, current_date, current_time)
 
         pdf_output = f"{config_dict.get('proj_dir')}WestNileOutbreak_{user_subtitle}.pdf"
         lyt.exportToPDF(pdf_output)
     except Exception as e:
         print(f"Error in export_map function {e}")
 
-    logging.debug("Exiting Export function")
+
+@traced("batch_export")
+def batch_export(exports):
+    """
+    Exports one PDF for each subtitle, and optional extent, in a pool of export_workers processes.
+    :param exports: A list of subtitles, or of dictionaries with a subtitle key and an optional extent key
+    :return: None
+    """
+    global config_dict
+
+    try:
+        # Save the queued map changes so every worker starts from the finished project
+        project_session.commit()
+        aprx_path = project_session.aprx_path
+
+        current_date = datetime.datetime.now().strftime("%m/%d/%Y")
+        current_time = datetime.datetime.now().strftime("%I:%M %p")
+        exports = [export if isinstance(export, dict) else {"subtitle": str(export)} for export in exports]
+
+        workers = min(int(config_dict.get('export_workers', 4)), len(exports))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(export_worker, aprx_path, export["subtitle"], export.get("extent"),
+                                       f"{config_dict.get('proj_dir')}WestNileOutbreak_{export['subtitle']}.pdf",
+                                       current_date, current_time)
+                       for export in exports]
+
+            for export, future in zip(exports, futures):
+                try:
+                    print(f"Exported {future.result()}")
+                except Exception as e:
+                    print(f"Error exporting {export['subtitle']} {e}")
+    except Exception as e:
+        print(f"Error in batch_export function {e}")
+
+
+def run(force=False):
+    """
+    Runs the ETL and the analysis selected by the analysis_mode config key, then exports the map.
+    :param force: Set to True to ignore the step cache and re-run every step
+    :return: None
+    """
+    global config_dict, step_cache
+    etl()
+
+    if config_dict.get('step_cache'):
+        step_cache = StepCache(f"{config_dict.get('proj_dir')}step_cache",
+                               int(config_dict.get('step_cache_max_mb', 2048)) * 1024 * 1024, force)
+
+    if config_dict.get('analysis_mode') == 'sweep':
+        sweep()
+        return
+
+    if config_dict.get('analysis_mode') == 'raster':
+        # Preview the notification count on the raster grid before committing to the exact vector run
+        distances, avoid_distance = ask_buffer_distances()
+        raster_estimate = raster_preview(distances, avoid_distance)
+        if input("Run the exact vector analysis? (y/n) ").strip().lower() != "y":
+            return
+
+        if step_cache is not None:
+            count = cached_analysis(distances, avoid_distance)
+        else:
+            buffer_processing(distances)
+            buf_Avoid_Points = buffer_avoid_points(avoid_distance)
+            count = process_joined_addresses(buf_Avoid_Points, scratch("intersect"))
+        if raster_estimate is not None and count is not None:
+            print(f"The raster preview differed from the vector analysis by {raster_estimate - count} addresses.")
+    elif step_cache is not None:
+        cached_analysis(*ask_buffer_distances())
+    else:
+        buffer_processing()
+
+        buf_Avoid_Points = buffer_avoid_points()
+        process_joined_addresses(buf_Avoid_Points, scratch("intersect"))
+    pre_export_symbology("intersect_minus_avoidPoints")
+    select_target_addresses()
+    exportMap()
+
 
 def main():
     """
@@ -365,18 +697,24 @@ def main():
     :return: None
     """
     global config_dict
+    parser = argparse.ArgumentParser(description="Map West Nile Virus spray zones in Boulder County")
+    parser.add_argument("--force", action="store_true", help="Ignore the step cache and re-run every step")
+    args, unknown = parser.parse_known_args()
+
     config_dict = setup()
-    logging.info("Starting West Nile Virus Simulation")
-    logging.debug(config_dict)
-    etl()
+    logger.info("Starting West Nile Virus Simulation")
+    logger.debug("%s", config_dict)
 
-    buffer_processing()
+    try:
+        run(args.force)
+    finally:
+        # The per-step timings are in wnv_trace.jsonl, this is the summary of them
+        table = summary_table()
+        logger.info("Step summary\n%s", table)
+        print(table)
+        stop_trace()
+        stop_logging()
 
-    buf_Avoid_Points = buffer_avoid_points()
-    process_joined_addresses(buf_Avoid_Points, "intersect")
-    pre_export_symbology("intersect_minus_avoidPoints")
-    select_target_addresses()
-    exportMap()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()